@@ -2,14 +2,26 @@ import streamlit as st
 import pandas as pd
 import json
 import time
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from itertools import zip_longest
 from datetime import datetime
 import os
 from dotenv import load_dotenv
 from vanna_setup import initialize_vanna
+from jobs import JobRegistry, JobCancelled, RESUMABLE, RUNNING, PENDING
+from llm_client import get_llm_client, estimate_tokens, PRIORITY_INTERACTIVE, PRIORITY_BATCH
+from training_import import import_training_file
+from table_index import TableIndex
+from intent_engine import IntentEngine
+from sql_tables import extract_tables
+from index_advisor import format_indexes, score_index_usage
+from sql_rewriter import REWRITE_RULES, SAFE_REWRITE_RULES, rewrite_sql
 import mysql.connector
-from mysql.connector import Error
+from mysql.connector import Error, InterfaceError, OperationalError, PoolError, pooling
 import hashlib
-from typing import Dict, List, Optional, Set, Tuple, Dict
+from typing import Dict, List, Optional, Set, Tuple
 import re
 
 # 加载环境变量
@@ -113,12 +125,194 @@ def init_vanna():
         st.error(f"初始化Vanna失败: {str(e)}")
         return None
 
+# 进度报告
+class ProgressReporter:
+    """合并高频的进度更新
+
+    每次刷新界面都会向浏览器发送一次 websocket 消息，因此只有距上次刷新超过 min_interval 秒、
+    或进度前进超过 min_step（比例）时才真正渲染；同时统计吞吐量（条/秒）和预计剩余时间。
+    render(已处理, 总数, 说明) 为空时使用 Streamlit 进度条和状态文本；unit 为吞吐量的计量单位。
+    """
+
+    def __init__(self, total: int, render=None, min_interval: float = 0.25, min_step: float = 0.01, unit: str = "条"):
+        self.total = total
+        self.unit = unit
+        self.done = 0
+        self.min_interval = min_interval
+        self.min_step = min_step
+        self.start_time = time.time()
+        self._last_render_time = 0.0
+        self._last_render_done = -1
+        self._widgets = None
+
+        if render is None:
+            self._widgets = (st.empty(), st.progress(0))
+
+            def render(done, total, message):
+                self._widgets[1].progress(min(1.0, done / total) if total else 1.0)
+                self._widgets[0].text(message)
+
+        self._render = render
+
+    @property
+    def rate(self) -> float:
+        """吞吐量（unit/秒）"""
+        elapsed = time.time() - self.start_time
+        return self.done / elapsed if elapsed > 0 else 0.0
+
+    @property
+    def eta(self) -> Optional[float]:
+        """预计剩余秒数"""
+        rate = self.rate
+        return (self.total - self.done) / rate if rate > 0 else None
+
+    def update(self, done: int, message: str = "", force: bool = False):
+        """报告当前进度，未达到刷新间隔或步长时只记录不渲染"""
+        self.done = done
+        now = time.time()
+        step = (done - self._last_render_done) / self.total if self.total else 1.0
+        finished = done >= self.total
+        if not (force or finished or now - self._last_render_time >= self.min_interval or step >= self.min_step):
+            return
+
+        self._last_render_time = now
+        self._last_render_done = done
+        eta = self.eta
+        stats = f"{self.rate:.1f} {self.unit}/秒"
+        if eta is not None and not finished:
+            stats += f"，预计剩余 {eta:.0f} 秒"
+        self._render(done, self.total, f"{message}（{stats}）" if message else stats)
+
+    def advance(self, count: int = 1, message: str = ""):
+        """进度前进 count 条"""
+        self.update(self.done + count, message)
+
+    def close(self):
+        """清除界面上的进度组件"""
+        if self._widgets:
+            for widget in self._widgets:
+                widget.empty()
+
+# 后台任务
+@st.cache_resource
+def get_job_registry():
+    """进程内共享的后台任务注册表，页面刷新后仍可查询任务进度"""
+    registry = JobRegistry(os.getenv('JOB_STATE_DIR', '.jobs'))
+    registry.register_handler('train_all_databases', run_training_job)
+    registry.register_handler('generate_pairs', run_pair_generation_job)
+    return registry
+
+def run_training_job(job, host: str, incremental: bool, priority_databases: List[str],
+                     databases: List[str] = None, shard_dedup: bool = True,
+                     query_generator=None, db_manager=None, db_info: Dict = None):
+    """后台训练任务：每批写入后记录已完成的表，恢复时跳过这些表
+
+    任务参数只保存主机和数据库列表；db_info 是运行时传入的已发现结构，
+    与主机不一致（如进程重启后恢复）时重新发现，并只训练任务中的数据库。
+    """
+    if not db_info or db_info.get('host') != host:
+        job.report(0, 1, "正在重新发现数据库结构...")
+        db_info = db_manager.discover_all_databases(host)
+    if databases is not None and db_info:
+        selected = set(databases)
+        db_info = dict(db_info, databases={name: data for name, data in db_info.get('databases', {}).items()
+                                           if name in selected})
+    query_generator.set_priority_databases(set(priority_databases))
+    completed = set(job.checkpoint_data.get('completed_tables', []))
+
+    def on_tables_written(tables):
+        completed.update(f"{db_name}.{table}" for db_name, table in tables)
+        job.checkpoint(completed_tables=sorted(completed))
+
+    result = query_generator.train_all_databases(
+        db_manager, host, db_info,
+        incremental=incremental,
+        shard_dedup=shard_dedup,
+        progress_callback=job.report,
+        should_stop=job.cancel_event.is_set,
+        skip_tables=completed,
+        on_tables_written=on_tables_written
+    )
+    if result['cancelled']:
+        raise JobCancelled()
+    return result
+
+def run_pair_generation_job(job, tables_info: List[dict], pair_count: int, diversity_level: str,
+                            host: str = None, validate: bool = False, use_cache: bool = True,
+                            training_manager=None, db_manager=None):
+    """后台批量生成问题-SQL对，结果为 [问题, SQL, 校验结果]
+
+    每组生成完成后记录到检查点，恢复时跳过已完成的组。
+    """
+    job.report(0, 1, "🤖 AI正在生成多样化的问题-SQL对...")
+    completed_groups = dict(job.checkpoint_data.get('pair_groups') or {})
+
+    def on_group_done(key, group_pairs):
+        completed_groups[key] = [list(pair) for pair in group_pairs]
+        job.checkpoint(pair_groups=dict(completed_groups))
+
+    pairs = generate_diverse_qsql_pairs(tables_info, pair_count, diversity_level, training_manager,
+                                        progress_callback=job.report, use_cache=use_cache,
+                                        completed_groups=completed_groups, on_group_done=on_group_done)
+    checks, failed = {}, []
+    if validate and db_manager and pairs:
+        try:
+            pairs, checks, failed = validate_qsql_pairs(db_manager, host, pairs, tables_info,
+                                                        progress_callback=job.report)
+            cache = get_pair_cache(training_manager)
+            if cache and failed:
+                cache.delete_cached_pairs(pair for pair, _ in failed)
+        except Error as e:
+            print(f"SQL校验不可用，跳过: {str(e)}")
+    # 生成过程中报告的错误（如未配置 API 密钥）保留在最终说明中
+    warning = f"（{job.message}）" if job.message.startswith("❌") else ""
+    job.report(1, 1, f"已生成 {len(pairs)} 个问题-SQL对" + (f"，丢弃 {len(failed)} 个无法执行的对" if failed else "") + warning)
+    return [[question, sql, checks.get((question, sql))] for question, sql in pairs]
+
+def show_job_panel(registry, kind: str, runtime: dict, key_prefix: str, limit: int = 3):
+    """显示后台任务的进度，并提供取消和恢复操作"""
+    jobs = registry.list_jobs(kind)[:limit]
+    if not jobs:
+        return
+
+    status_labels = {
+        'pending': "⏳ 等待中", 'running': "🔄 运行中", 'completed': "✅ 已完成",
+        'failed': "❌ 失败", 'cancelled': "⏹️ 已取消", 'interrupted': "⚠️ 已中断"
+    }
+    for job in jobs:
+        st.markdown(f"**{job['id']}** {status_labels.get(job['status'], job['status'])}")
+        st.progress(min(1.0, job['progress']))
+        if job['message']:
+            st.caption(job['message'])
+        if job['error']:
+            st.caption(f"错误: {job['error']}")
+
+        if job['status'] in (RUNNING, PENDING):
+            if st.button("⏹️ 取消", key=f"{key_prefix}_cancel_{job['id']}"):
+                registry.cancel(job['id'])
+                st.rerun()
+        elif job['status'] in RESUMABLE:
+            if st.button("▶️ 从检查点恢复", key=f"{key_prefix}_resume_{job['id']}"):
+                registry.resume(job['id'], **runtime)
+                st.rerun()
+
+    if st.button("🔄 刷新进度", key=f"{key_prefix}_refresh"):
+        st.rerun()
+
 # 智能数据库管理器
 class IntelligentDBAssistant:
+    # EXPLAIN 结果缓存的最大条数
+    EXPLAIN_CACHE_SIZE = 10000
+    # 连接池占满时等待空闲连接的最长时间（秒）
+    POOL_WAIT_TIMEOUT = 30
+
     def __init__(self):
         self.connections = {}
         self.discovered_databases = {}
         self.schema_cache = {}
+        self.pools = {}
+        self.explain_cache = {}
+        self._pool_lock = threading.Lock()
 
     def get_connection(self, host: str, database: str = None):
         """获取数据库连接"""
@@ -131,8 +325,15 @@ class IntelligentDBAssistant:
             except:
                 pass
 
+        conn = self.create_connection(host, database)
+        if conn:
+            self.connections[key] = conn
+        return conn
+
+    def create_connection(self, host: str, database: str = None):
+        """创建一个新的独立连接（不缓存），供后台线程使用，调用方负责关闭"""
         try:
-            conn = mysql.connector.connect(
+            return mysql.connector.connect(
                 host=host,
                 database=database,
                 user=os.getenv('DB_USER'),
@@ -141,8 +342,6 @@ class IntelligentDBAssistant:
                 charset='utf8mb4',
                 connect_timeout=10
             )
-            self.connections[key] = conn
-            return conn
         except Error as e:
             print(f"连接失败 {host}:{database}: {str(e)}")
             return None
@@ -169,6 +368,36 @@ class IntelligentDBAssistant:
 
             total_tables = 0
 
+            # 一次性读取所有表注释（用作表的中文别名）和估算行数
+            table_comments = {}
+            table_rows = {}
+            try:
+                cursor.execute("SELECT TABLE_SCHEMA, TABLE_NAME, TABLE_COMMENT, TABLE_ROWS FROM information_schema.TABLES")
+                for schema_name, table_name, comment, rows in cursor.fetchall():
+                    if comment:
+                        table_comments[(schema_name, table_name)] = comment
+                    if rows is not None:
+                        table_rows[(schema_name, table_name)] = int(rows)
+            except Error as e:
+                print(f"获取表注释失败: {str(e)}")
+
+            # 一次性读取所有索引，按索引内字段顺序排列
+            table_indexes = {}
+            try:
+                cursor.execute(
+                    "SELECT TABLE_SCHEMA, TABLE_NAME, INDEX_NAME, NON_UNIQUE, COLUMN_NAME "
+                    "FROM information_schema.STATISTICS "
+                    "ORDER BY TABLE_SCHEMA, TABLE_NAME, INDEX_NAME, SEQ_IN_INDEX"
+                )
+                for schema_name, table_name, index_name, non_unique, column_name in cursor.fetchall():
+                    indexes = table_indexes.setdefault((schema_name, table_name), [])
+                    if not indexes or indexes[-1]['name'] != index_name:
+                        indexes.append({'name': index_name, 'unique': not int(non_unique), 'columns': []})
+                    if column_name:
+                        indexes[-1]['columns'].append(column_name)
+            except Error as e:
+                print(f"获取索引信息失败: {str(e)}")
+
             for db in databases:
                 try:
                     db_conn = self.get_connection(host, db)
@@ -191,10 +420,16 @@ class IntelligentDBAssistant:
                                     tables_info[table] = {
                                         'columns': [col[0] for col in columns],
                                         'column_types': [col[1] for col in columns],
-                                        'column_count': len(columns)
+                                        'column_count': len(columns),
+                                        'comment': table_comments.get((db, table), ''),
+                                        'indexes': table_indexes.get((db, table), []),
+                                        'rows': table_rows.get((db, table))
                                     }
                                 except:
-                                    tables_info[table] = {'columns': [], 'column_types': [], 'column_count': 0}
+                                    tables_info[table] = {'columns': [], 'column_types': [], 'column_count': 0,
+                                                          'comment': table_comments.get((db, table), ''),
+                                                          'indexes': table_indexes.get((db, table), []),
+                                                          'rows': table_rows.get((db, table))}
 
                             all_info['databases'][db] = {
                                 'tables': tables,
@@ -218,10 +453,10 @@ class IntelligentDBAssistant:
             print(f"发现数据库失败: {str(e)}")
             return {}
 
-    def get_table_ddl(self, host: str, database: str, table_name: str) -> Optional[str]:
-        """获取表DDL"""
+    def get_table_ddl(self, host: str, database: str, table_name: str, conn=None) -> Optional[str]:
+        """获取表DDL，可以传入调用方自己的连接（多线程时每个线程一个连接）"""
         try:
-            conn = self.get_connection(host, database)
+            conn = conn or self.get_connection(host, database)
             if not conn:
                 return None
 
@@ -235,6 +470,95 @@ class IntelligentDBAssistant:
             print(f"获取DDL失败 {database}.{table_name}: {str(e)}")
             return None
 
+    def get_pool(self, host: str, size: int = 8):
+        """获取主机的连接池（不指定数据库，使用时再切换），供多线程校验使用"""
+        with self._pool_lock:
+            if host not in self.pools:
+                self.pools[host] = pooling.MySQLConnectionPool(
+                    pool_name=f"pool_{hashlib.md5(host.encode('utf-8')).hexdigest()[:12]}",
+                    pool_size=max(1, min(size, 32)),
+                    host=host,
+                    user=os.getenv('DB_USER'),
+                    password=os.getenv('DB_PASSWORD'),
+                    port=int(os.getenv('DB_PORT', 3306)),
+                    charset='utf8mb4',
+                    connect_timeout=10
+                )
+            return self.pools[host]
+
+    def _pooled_connection(self, host: str):
+        """从连接池取连接；连接池不会阻塞，占满时重试直到超时"""
+        deadline = time.monotonic() + self.POOL_WAIT_TIMEOUT
+        while True:
+            try:
+                return self.get_pool(host).get_connection()
+            except PoolError:
+                if time.monotonic() >= deadline:
+                    raise
+                time.sleep(0.05)
+
+    def explain_query(self, host: str, database: str, sql: str) -> Dict:
+        """用 EXPLAIN 校验 SQL 能否执行，返回 {'valid', 'error', 'estimated_rows'}
+
+        DESCRIBE / SHOW 只读取元数据，直接执行；其余语句只做 EXPLAIN，不会真正执行。
+        结果按 (主机, 数据库, SQL) 缓存；连接类错误无法判断 SQL 是否有效，valid 为 None 且不缓存。
+        """
+        statement = sql.strip().rstrip(';').strip()
+        key = (host, database, re.sub(r'\s+', ' ', statement))
+        cached = self.explain_cache.get(key)
+        if cached is not None:
+            return cached
+
+        result = {'valid': False, 'error': None, 'estimated_rows': None}
+        conn = None
+        try:
+            conn = self._pooled_connection(host)
+            # 连接归还后仍保留上次切换的库，每次都重新设置；未指定库时切到不含业务表的系统库
+            conn.database = database or 'information_schema'
+            cursor = conn.cursor(dictionary=True)
+            if statement.upper().startswith(('DESCRIBE', 'DESC ', 'SHOW')):
+                cursor.execute(statement)
+                cursor.fetchall()
+                result['estimated_rows'] = 0
+            else:
+                cursor.execute(f"EXPLAIN {statement}")
+                plan = cursor.fetchall()
+                result['estimated_rows'] = sum(int(row.get('rows') or 0) for row in plan)
+            cursor.close()
+            result['valid'] = True
+        except Error as e:
+            result['error'] = str(e)
+            if isinstance(e, (PoolError, InterfaceError, OperationalError)):
+                result['valid'] = None
+                return result
+        finally:
+            if conn:
+                conn.close()
+
+        with self._pool_lock:
+            if len(self.explain_cache) >= self.EXPLAIN_CACHE_SIZE:
+                self.explain_cache.pop(next(iter(self.explain_cache)))
+            self.explain_cache[key] = result
+        return result
+
+    def explain_many(self, host: str, statements: List[Tuple[str, str]], max_workers: int = 8,
+                     progress_callback=None) -> List[Dict]:
+        """并发校验多条 (数据库, SQL)，返回与输入顺序一致的结果"""
+        results = [None] * len(statements)
+        if not statements:
+            return results
+
+        max_workers = max(1, min(max_workers, len(statements)))
+        self.get_pool(host, max_workers)
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = {executor.submit(self.explain_query, host, database, sql): index
+                       for index, (database, sql) in enumerate(statements)}
+            for done, future in enumerate(as_completed(futures), 1):
+                results[futures[future]] = future.result()
+                if progress_callback:
+                    progress_callback(done, len(statements), f"正在校验SQL {done}/{len(statements)}")
+        return results
+
     def execute_query(self, host: str, database: str, query: str) -> tuple:
         """执行查询"""
         try:
@@ -273,6 +597,14 @@ class VannaTrainingManager:
     def __init__(self, vn):
         self.vn = vn
         self.train_history = []
+        # 按内容哈希去重后的写入结果计数
+        self.dedup_counts = {'new': 0, 'updated': 0, 'unchanged': 0}
+
+    def _record_status(self, status) -> bool:
+        """记录一次写入结果，返回内容是否发生了变化（新增或更新）"""
+        if status in self.dedup_counts:
+            self.dedup_counts[status] += 1
+        return status != 'unchanged'
 
     def add_to_history(self, train_type: str, content: str, metadata: dict = None):
         """添加训练历史"""
@@ -291,8 +623,8 @@ class VannaTrainingManager:
     def train_ddl(self, ddl: str, metadata: dict = None) -> bool:
         """训练DDL"""
         try:
-            self.vn.train(ddl=ddl)
-            self.add_to_history('DDL', ddl, metadata)
+            if self._record_status(self.vn.train(ddl=ddl, metadata=metadata)):
+                self.add_to_history('DDL', ddl, metadata)
             return True
         except Exception as e:
             st.error(f"DDL训练失败: {str(e)}")
@@ -301,8 +633,8 @@ class VannaTrainingManager:
     def train_documentation(self, documentation: str, metadata: dict = None) -> bool:
         """训练文档"""
         try:
-            self.vn.train(documentation=documentation)
-            self.add_to_history('Documentation', documentation, metadata)
+            if self._record_status(self.vn.train(documentation=documentation, metadata=metadata)):
+                self.add_to_history('Documentation', documentation, metadata)
             return True
         except Exception as e:
             st.error(f"文档训练失败: {str(e)}")
@@ -311,13 +643,134 @@ class VannaTrainingManager:
     def train_question_sql(self, question: str, sql: str, metadata: dict = None) -> bool:
         """训练问题-SQL对"""
         try:
-            self.vn.train(question=question, sql=sql)
-            self.add_to_history('Question-SQL', f"Q: {question}\nSQL: {sql}", metadata)
+            if self._record_status(self.vn.train(question=question, sql=sql, metadata=metadata)):
+                self.add_to_history('Question-SQL', f"Q: {question}\nSQL: {sql}", metadata)
             return True
         except Exception as e:
             st.error(f"问题-SQL训练失败: {str(e)}")
             return False
 
+    @staticmethod
+    def normalize_train_item(item: dict) -> Tuple[Optional[dict], Optional[str]]:
+        """把训练条目统一为 {'type', 'content'/'question'/'sql', 'metadata'}，返回 (条目, 错误原因)
+
+        同时接受带 type 的条目和批量导入的 {'ddl'} / {'documentation'} / {'question', 'sql'} 格式。
+        """
+        if not isinstance(item, dict):
+            return None, "条目不是对象"
+
+        item_type = item.get('type')
+        if item_type is None:
+            if 'ddl' in item:
+                item_type = 'ddl'
+            elif 'documentation' in item:
+                item_type = 'documentation'
+            elif 'question' in item or 'sql' in item:
+                item_type = 'sql'
+
+        metadata = item.get('metadata') or {}
+        if item_type == 'sql':
+            question, sql = item.get('question'), item.get('sql')
+            if not isinstance(question, str) or not question.strip():
+                return None, "缺少问题"
+            if not isinstance(sql, str) or not sql.strip():
+                return None, "缺少SQL"
+            return {'type': 'sql', 'question': question.strip(), 'sql': sql.strip(), 'metadata': metadata}, None
+
+        if item_type in ('ddl', 'documentation'):
+            content = item.get('content', item.get(item_type))
+            if not isinstance(content, str) or not content.strip():
+                return None, "内容为空"
+            return {'type': item_type, 'content': content.strip(), 'metadata': metadata}, None
+
+        return None, f"未知的训练类型: {item_type}"
+
+    def train_many(self, items, error_callback=None) -> dict:
+        """批量训练：统一校验后一次性写入存储，只更新一次历史和统计
+
+        返回 {'total', 'valid', 'invalid': [(序号, 原因)], 'new', 'updated', 'unchanged'}。
+        error_callback(说明) 用于在后台线程中报告错误（线程中不能调用 st.error）。
+        """
+        valid_items = []
+        invalid = []
+        for index, item in enumerate(items):
+            normalized, error = self.normalize_train_item(item)
+            if error:
+                invalid.append((index, error))
+            else:
+                valid_items.append(normalized)
+
+        result = {
+            'total': len(valid_items) + len(invalid),
+            'valid': len(valid_items),
+            'invalid': invalid,
+            'new': 0,
+            'updated': 0,
+            'unchanged': 0
+        }
+        if not valid_items:
+            return result
+
+        try:
+            counts = self.vn.train_many(valid_items)
+        except Exception as e:
+            (error_callback or st.error)(f"批量训练失败: {str(e)}")
+            result['error'] = str(e)
+            return result
+
+        result.update(counts)
+        for status, count in counts.items():
+            self.dedup_counts[status] = self.dedup_counts.get(status, 0) + count
+
+        by_type = {}
+        for item in valid_items:
+            by_type[item['type']] = by_type.get(item['type'], 0) + 1
+        summary = ", ".join(f"{item_type}: {count}" for item_type, count in by_type.items())
+        self.add_to_history(
+            'Batch',
+            f"批量训练 {len(valid_items)} 条（{summary}）",
+            {'by_type': by_type, 'new': counts['new'], 'updated': counts['updated'], 'unchanged': counts['unchanged']}
+        )
+        return result
+
+    def export_snapshot(self, path: str) -> Optional[int]:
+        """导出训练数据、表校验和以及训练历史与统计，返回导出条数"""
+        try:
+            count = self.vn.export_training_data(path, extra={
+                'train_history': self.train_history,
+                'dedup_counts': self.dedup_counts
+            })
+            self.add_to_history('Snapshot', f"导出训练快照 {count} 条到 {path}")
+            return count
+        except ImportError:
+            st.error("❌ 未安装pyarrow库，请运行: pip install pyarrow")
+            return None
+        except Exception as e:
+            st.error(f"导出训练快照失败: {str(e)}")
+            return None
+
+    def import_snapshot(self, path: str, replace: bool = True) -> Optional[dict]:
+        """导入训练快照并恢复训练历史与统计，返回 {new, unchanged}"""
+        try:
+            counts, extra = self.vn.import_training_data(path, replace)
+        except ImportError:
+            st.error("❌ 未安装pyarrow库，请运行: pip install pyarrow")
+            return None
+        except Exception as e:
+            st.error(f"导入训练快照失败: {str(e)}")
+            return None
+
+        history = extra.get('train_history') or []
+        if replace:
+            self.train_history = history
+            self.dedup_counts = {'new': 0, 'updated': 0, 'unchanged': 0}
+        else:
+            self.train_history.extend(history)
+        for status, count in (extra.get('dedup_counts') or {}).items():
+            self.dedup_counts[status] = self.dedup_counts.get(status, 0) + count
+        self.add_to_history('Snapshot', f"从 {path} 导入训练快照", counts)
+        return counts
+
     def train_plan(self, plan: str, metadata: dict = None) -> bool:
         """训练执行计划（如果有此方法）"""
         try:
@@ -355,8 +808,19 @@ class VannaTrainingManager:
 
         return stats
 
+PIPELINE_PUT_TIMEOUT = 0.5    # 训练流水线队列读写的超时（秒），超时后检查是否已停止
+
 # 智能查询生成器 - 修复版
 class EnhancedSmartQueryGenerator:
+    # 模糊匹配表名的最低相似度（字符三元组 Dice 系数）；0.7 时 order 会匹配到 orders（约 0.73）
+    FUZZY_TABLE_THRESHOLD = 0.75
+    # 只对明确指向表的词做模糊匹配："xxx表"、"表xxx"、"查xxx"、"from xxx"、"xxx table"
+    FUZZY_TABLE_CUE = r'(?:表|查询?|from|table)\s*{token}(?![A-Za-z0-9_$])|(?<![A-Za-z0-9_$]){token}\s*(?:表|table\b)'
+    # 问题中提到的表估算行数达到该值时，生成SQL时附带它的索引说明
+    INDEX_HINT_MIN_ROWS = int(os.getenv('INDEX_HINT_MIN_ROWS', '100000'))
+    # 生成的SQL索引命中低于该值、且用到的大表还没给过索引说明时，带上说明再生成一个候选
+    INDEX_SCORE_THRESHOLD = float(os.getenv('INDEX_SCORE_THRESHOLD', '0.5'))
+
     def __init__(self, vanna_instance):
         self.vn = vanna_instance
         self.trained_items = set()
@@ -364,6 +828,13 @@ class EnhancedSmartQueryGenerator:
         self.priority_databases = set()
         self.training_manager = None
 
+        # 表名查找索引，目录变化时增量更新
+        self.table_index = TableIndex()
+
+        # 同结构数据库（分片族）：代表库 -> 全部成员，成员库 -> 代表库
+        self.shard_families = {}
+        self.shard_of = {}
+
         # 初始化训练管理器
         if vanna_instance:
             self.training_manager = VannaTrainingManager(vanna_instance)
@@ -372,14 +843,134 @@ class EnhancedSmartQueryGenerator:
         """设置优先数据库"""
         self.priority_databases = databases
 
-    def train_all_databases(self, db_manager, host: str, db_info: Dict) -> Dict:
-        """一键训练所有数据库"""
+    def _table_checksum(self, db_name: str, table: str, tables_info: Dict) -> str:
+        """根据发现阶段得到的字段信息计算表结构校验和（不需要额外访问 MySQL）"""
+        info = tables_info.get(table, {})
+        payload = json.dumps({
+            'columns': info.get('columns', []),
+            'column_types': [str(col_type) for col_type in info.get('column_types', [])],
+            'indexes': info.get('indexes', []),
+            'priority': db_name in self.priority_databases
+        }, ensure_ascii=False)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def _database_checksum(self, db_name: str, tables: List[str], shard_members: List[str] = None) -> str:
+        """数据库上下文的校验和：表列表、优先标记和分片族成员"""
+        payload = json.dumps({
+            'tables': tables,
+            'priority': db_name in self.priority_databases,
+            'shard_members': shard_members or []
+        }, ensure_ascii=False)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def _schema_fingerprint(self, db_data: Dict) -> Optional[str]:
+        """数据库结构指纹：表名、字段名和字段类型，与库名无关；字段信息不完整时返回 None"""
+        tables_info = db_data.get('tables_info', {})
+        schema = []
+        for table in sorted(db_data.get('tables', [])):
+            info = tables_info.get(table, {})
+            if not info.get('columns'):
+                return None
+            schema.append([table, info['columns'], [str(col_type) for col_type in info.get('column_types', [])]])
+        if not schema:
+            return None
+        return hashlib.sha256(json.dumps(schema, ensure_ascii=False).encode('utf-8')).hexdigest()
+
+    def detect_shard_families(self, databases: Dict) -> Dict[str, List[str]]:
+        """按结构指纹把数据库分组为分片族，返回 {代表库: [全部成员]}
+
+        只有两个及以上结构完全相同的库才构成分片族；代表库优先选优先数据库，其次按库名排序。
+        """
+        groups = {}
+        for db_name, db_data in databases.items():
+            fingerprint = self._schema_fingerprint(db_data)
+            if fingerprint:
+                groups.setdefault(fingerprint, []).append(db_name)
+
+        self.shard_families = {}
+        self.shard_of = {}
+        for members in groups.values():
+            if len(members) < 2:
+                continue
+            members.sort()
+            priority_members = [db for db in members if db in self.priority_databases]
+            representative = (priority_members or members)[0]
+            self.shard_families[representative] = members
+            for db_name in members:
+                self.shard_of[db_name] = representative
+        return self.shard_families
+
+    @staticmethod
+    def map_sql_to_shard(sql: str, source_db: str, target_db: str) -> str:
+        """把 SQL 中对 source_db 的库名限定替换为 target_db（字符串常量中的内容保持不变）"""
+        if source_db == target_db:
+            return sql
+        pattern = re.compile(rf'(?<![\w.`])`?{re.escape(source_db)}`?(?=\s*\.)', flags=re.ASCII)
+        # 按字符串常量切分，奇数位置是引号内的内容
+        parts = re.split(r"""('(?:[^'\\]|\\.)*'|"(?:[^"\\]|\\.)*")""", sql)
+        return ''.join(
+            part if index % 2 else pattern.sub(f"`{target_db}`", part)
+            for index, part in enumerate(parts)
+        )
+
+    def _resolve_shard_target(self, user_query: str, result: Dict) -> Dict:
+        """SQL 使用了分片族中的库时，映射到问题中提到的成员库；没有提到时保持代表库"""
+        for db_name in result.get('used_databases', []):
+            representative = self.shard_of.get(db_name)
+            if representative is None:
+                continue
+
+            members = self.shard_families[representative]
+            target = db_name
+            for member in sorted(members, key=len, reverse=True):
+                if re.search(rf'(?<!\w){re.escape(member)}(?!\w)', user_query, flags=re.ASCII):
+                    target = member
+                    break
+
+            if target != db_name:
+                result['sql'] = self.map_sql_to_shard(result['sql'], db_name, target)
+                result['used_databases'] = [target if db == db_name else db for db in result['used_databases']]
+                result['priority_used'] = any(db in self.priority_databases for db in result['used_databases'])
+            result['shard_family'] = {
+                'representative': representative,
+                'target': target,
+                'members': len(members)
+            }
+            break
+        return result
+
+    def train_all_databases(self, db_manager, host: str, db_info: Dict, incremental: bool = True,
+                            shard_dedup: bool = True, fetch_workers: int = 8, batch_size: int = 500, queue_size: int = 256,
+                            progress_callback=None, should_stop=None, skip_tables: Set[str] = None,
+                            on_tables_written=None) -> Dict:
+        """一键训练所有数据库
+
+        训练按流水线执行：多个线程并发获取 DDL → 单线程生成模板问题和文档 →
+        主线程按批写入存储。各阶段之间用有界队列连接，下游跟不上时上游会阻塞等待。
+
+        incremental=True 时根据每个表的结构校验和只训练新增或变化的表，
+        并清理已删除表的训练数据；没有任何变化时几乎不访问 MySQL。
+
+        shard_dedup=True 时结构完全相同的数据库（分片族）只训练代表库，
+        其余成员库已有的训练数据会被清理，查询时再把 SQL 映射到具体的成员库。
+
+        在后台任务中运行时通过 progress_callback(已处理, 总数, 说明) 报告进度（否则使用 Streamlit 进度条），
+        should_stop() 返回 True 时尽快停止，skip_tables 为检查点中已完成的 "库.表"，
+        on_tables_written([(库, 表), ...]) 在每批写入成功后回调。
+        """
         results = {
             'success': False,
             'databases_trained': 0,
             'tables_trained': 0,
+            'tables_skipped': 0,
+            'tables_retired': 0,
+            'shard_families': 0,
+            'databases_shared': 0,
+            'tables_shared': 0,
+            'cancelled': False,
             'errors': [],
-            'training_time': None
+            'training_time': None,
+            'dedup': {'new': 0, 'updated': 0, 'unchanged': 0}
         }
 
         if not db_info or 'databases' not in db_info:
@@ -388,134 +979,348 @@ class EnhancedSmartQueryGenerator:
 
         start_time = time.time()
         databases = db_info['databases']
-
-        # 进度显示
-        progress_placeholder = st.empty()
-        status_placeholder = st.empty()
-        progress_bar = st.progress(0)
-
-        total_dbs = len(databases)
-        trained_dbs = 0
-        trained_tables = 0
+        counts_before = dict(self.training_manager.dedup_counts) if self.training_manager else {}
+        store = getattr(self.vn, 'store', None)
+        skip_tables = skip_tables or set()
+        stop_event = threading.Event()
 
         # 如果有优先数据库，先训练优先数据库
-        training_order = []
-        priority_dbs = []
-        other_dbs = []
-
-        for db_name in databases.keys():
-            if db_name in self.priority_databases:
-                priority_dbs.append(db_name)
-            else:
-                other_dbs.append(db_name)
-
+        priority_dbs = [db for db in databases if db in self.priority_databases]
+        other_dbs = [db for db in databases if db not in self.priority_databases]
         training_order = priority_dbs + other_dbs
 
-        for i, db_name in enumerate(training_order):
-            db_data = databases[db_name]
-            db_progress = (i + 1) / total_dbs
-            progress_bar.progress(db_progress)
+        # 同结构的数据库只训练代表库
+        if shard_dedup:
+            results['shard_families'] = len(self.detect_shard_families(databases))
+        else:
+            self.shard_families, self.shard_of = {}, {}
+
+        # 对比已训练的校验和，找出新增、变化和已删除的表
+        trained_checksums = store.get_table_checksums() if (store and incremental) else {}
+        current_keys = set()
+        changed_tables = []
+        db_level_items = []
+        db_level_checksums = []
+        tasks = queue.Queue()
+        remaining_tables = {}
+        table_checksums = {}
+
+        for db_name in training_order:
+            tables = databases[db_name].get('tables', [])
+            tables_info = databases[db_name].get('tables_info', {})
+
+            if self.shard_of.get(db_name, db_name) != db_name:
+                results['databases_shared'] += 1
+                results['tables_shared'] += len(tables)
+                self.trained_items.update(f"{db_name}.{table}" for table in tables)
+                continue
+
+            remaining_tables[db_name] = 0
 
-            # 显示是否是优先数据库
-            priority_mark = "🎯 " if db_name in self.priority_databases else ""
-            status_placeholder.text(f"{priority_mark}正在训练数据库: {db_name} ({i+1}/{total_dbs})")
+            for table in tables:
+                checksum = self._table_checksum(db_name, table, tables_info)
+                current_keys.add((db_name, table))
+                if trained_checksums.get((db_name, table)) == checksum or f"{db_name}.{table}" in skip_tables:
+                    self.trained_items.add(f"{db_name}.{table}")
+                    results['tables_skipped'] += 1
+                    continue
+                if (db_name, table) in trained_checksums:
+                    changed_tables.append((db_name, table))
+                table_checksums[(db_name, table)] = checksum
+                remaining_tables[db_name] += 1
+                tasks.put((db_name, table))
 
-            tables = db_data.get('tables', [])
-            tables_info = db_data.get('tables_info', {})
+            # 训练数据库上下文
+            current_keys.add((db_name, ''))
+            shard_members = self.shard_families.get(db_name)
+            db_checksum = self._database_checksum(db_name, tables, shard_members)
+            if tables and trained_checksums.get((db_name, '')) != db_checksum:
+                if (db_name, '') in trained_checksums:
+                    changed_tables.append((db_name, ''))
+                db_level_items.extend(self._build_database_items(db_name, tables, shard_members))
+                db_level_checksums.append((db_name, '', db_checksum))
+
+        if store and incremental:
+            # 结构变化的表先清理旧的 DDL 和文档；已删除的表清理全部训练数据
+            if changed_tables:
+                store.retire_tables(changed_tables, item_types=('ddl', 'documentation'))
+            dropped_tables = [key for key in trained_checksums if key not in current_keys]
+            if dropped_tables:
+                store.retire_tables(dropped_tables)
+                for db_name, table in dropped_tables:
+                    self.trained_items.discard(f"{db_name}.{table}")
+                results['tables_retired'] = sum(1 for _, table in dropped_tables if table)
+
+        total_tables = tasks.qsize()
+        # 没有需要训练的表的库直接计入已训练；必须在启动流水线之前统计，之后 build_stage 会并发修改 remaining_tables
+        empty_dbs = sum(1 for count in remaining_tables.values() if count == 0)
 
-            for table in tables:
-                try:
-                    # 训练DDL
-                    ddl = db_manager.get_table_ddl(host, db_name, table)
-                    if ddl and self.training_manager:
-                        metadata = {
-                            'database': db_name,
-                            'table': table,
-                            'priority': db_name in self.priority_databases
-                        }
-                        self.training_manager.train_ddl(ddl, metadata)
-
-                    # 训练多种查询模式
-                    if self.training_manager:
-                        metadata = {
-                            'database': db_name,
-                            'table': table,
-                            'priority': db_name in self.priority_databases
-                        }
-
-                        # 1. 训练简单的表名查询
-                        table_query = f"查询表 {table}"
-                        sql = f"SELECT * FROM `{db_name}`.`{table}` LIMIT 10"
-                        self.training_manager.train_question_sql(table_query, sql, metadata)
-
-                        # 2. 训练表详情查询
-                        table_detail_query = f"查看表 {table} 的详情"
-                        detail_sql = f"DESCRIBE `{db_name}`.`{table}`"
-                        self.training_manager.train_question_sql(table_detail_query, detail_sql, metadata)
-
-                        # 3. 训练中文查询
-                        chinese_query = f"帮我查 {table} 表"
-                        self.training_manager.train_question_sql(chinese_query, sql, metadata)
-
-                        # 4. 训练表结构描述
-                        if table in tables_info:
-                            columns = tables_info[table].get('columns', [])
-                            column_types = tables_info[table].get('column_types', [])
-
-                            if columns:
-                                columns_desc = []
-                                for col, col_type in zip(columns, column_types):
-                                    columns_desc.append(f"{col} ({col_type})")
-
-                                priority_note = "（优先数据库）" if db_name in self.priority_databases else ""
-                                table_desc = f"数据库 {db_name} {priority_note}中的表 {table} 包含以下字段: {', '.join(columns_desc)}"
-                                self.training_manager.train_documentation(table_desc, metadata)
+        # 进度显示
+        reporter = ProgressReporter(total_tables, render=progress_callback)
 
-                    self.trained_items.add(f"{db_name}.{table}")
-                    trained_tables += 1
+        fetch_workers = max(1, min(fetch_workers, total_tables))
+        for _ in range(fetch_workers):
+            tasks.put(None)
 
-                except Exception as e:
-                    results['errors'].append(f"表 {db_name}.{table} 训练失败: {str(e)}")
+        fetched = queue.Queue(maxsize=queue_size)
+        built = queue.Queue(maxsize=queue_size)
 
-            # 训练数据库上下文
+        def put(target: queue.Queue, entry) -> bool:
+            """带超时写入下游队列；停止后下游可能不再读取，放弃写入并返回 False"""
+            while True:
+                try:
+                    target.put(entry, timeout=PIPELINE_PUT_TIMEOUT)
+                    return True
+                except queue.Full:
+                    if stop_event.is_set():
+                        return False
+
+        def fetch_stage():
+            """阶段1：并发获取 DDL，每个线程使用独立的数据库连接"""
+            conn = db_manager.create_connection(host)
             try:
-                if tables and self.training_manager:
-                    metadata = {
-                        'database': db_name,
-                        'priority': db_name in self.priority_databases
-                    }
-                    priority_tag = "（优先数据库）" if db_name in self.priority_databases else ""
-                    db_context = f"数据库 {db_name} {priority_tag}包含以下表: {', '.join(tables[:10])}"
-                    if len(tables) > 10:
-                        db_context += f" 等共 {len(tables)} 个表"
-                    self.training_manager.train_documentation(db_context, metadata)
+                while not stop_event.is_set():
+                    task = tasks.get()
+                    if task is None:
+                        break
+                    db_name, table = task
+                    if not conn:
+                        entry = (db_name, table, None, "数据库连接失败")
+                    else:
+                        try:
+                            ddl = db_manager.get_table_ddl(host, db_name, table, conn=conn)
+                            # 获取失败时返回 None，按错误处理，不保存校验和，下次重新训练
+                            entry = (db_name, table, ddl, None if ddl else "获取DDL失败")
+                        except Exception as e:
+                            entry = (db_name, table, None, str(e))
+                    if not put(fetched, entry):
+                        break
+            finally:
+                if conn:
+                    conn.close()
+                put(fetched, None)
+
+        def build_stage():
+            """阶段2：生成模板问题-SQL对和文档"""
+            try:
+                finished_workers = 0
+                while finished_workers < fetch_workers:
+                    try:
+                        entry = fetched.get(timeout=PIPELINE_PUT_TIMEOUT)
+                    except queue.Empty:
+                        if stop_event.is_set():
+                            break
+                        continue
+                    if entry is None:
+                        finished_workers += 1
+                        continue
+
+                    db_name, table, ddl, error = entry
+                    items = []
+                    if error is None and not stop_event.is_set():
+                        try:
+                            tables_info = databases[db_name].get('tables_info', {})
+                            items = self._build_table_items(db_name, table, ddl, tables_info)
+                        except Exception as e:
+                            error = str(e)
+
+                    remaining_tables[db_name] -= 1
+                    if not put(built, (db_name, table, items, error, remaining_tables[db_name] == 0)):
+                        break
+            finally:
+                put(built, None)
+
+        stage_threads = [threading.Thread(target=fetch_stage, daemon=True) for _ in range(fetch_workers)]
+        stage_threads.append(threading.Thread(target=build_stage, daemon=True))
+        if total_tables:
+            for thread in stage_threads:
+                thread.start()
+        else:
+            built.put(None)
 
-                trained_dbs += 1
+        # 阶段3：主线程按批写入（Streamlit 的界面只能在脚本线程中更新）
+        trained_dbs = empty_dbs
+        trained_tables = 0
+        processed = 0
+        batch_items = list(db_level_items)
+        batch_checksums = list(db_level_checksums)
+        batch_tables = []
+        batch_dbs = 0
+
+        def flush():
+            nonlocal trained_tables, trained_dbs, batch_items, batch_tables, batch_checksums, batch_dbs
+            if self.training_manager and batch_items:
+                train_result = self.training_manager.train_many(
+                    batch_items, error_callback=lambda message: reporter.update(processed, message, force=True)
+                )
+                if train_result.get('error'):
+                    results['errors'].append(f"批量写入失败（{len(batch_tables)} 个表）: {train_result['error']}")
+                    batch_items, batch_tables, batch_checksums, batch_dbs = [], [], [], 0
+                    return
+
+            # 写入成功后才记录校验和，失败的表下次会重新训练
+            if store and batch_checksums:
+                store.save_table_checksums(batch_checksums)
+            for db_name, table in batch_tables:
+                self.trained_items.add(f"{db_name}.{table}")
+            if on_tables_written and batch_tables:
+                on_tables_written(batch_tables)
+            trained_tables += len(batch_tables)
+            trained_dbs += batch_dbs
+            batch_items, batch_tables, batch_checksums, batch_dbs = [], [], [], 0
 
-            except Exception as e:
-                results['errors'].append(f"数据库 {db_name} 上下文训练失败: {str(e)}")
+        try:
+            while True:
+                entry = built.get()
+                if entry is None:
+                    break
+
+                db_name, table, items, error, db_finished = entry
+                processed += 1
+
+                # 收到停止请求后，上游不再获取 DDL，已生成的条目照常写入
+                if not stop_event.is_set() and should_stop and should_stop():
+                    stop_event.set()
+                    results['cancelled'] = True
+                if stop_event.is_set() and not items:
+                    continue
+
+                if error:
+                    results['errors'].append(f"表 {db_name}.{table} 训练失败: {error}")
+                else:
+                    batch_tables.append((db_name, table))
+                    batch_checksums.append((db_name, table, table_checksums[(db_name, table)]))
+                batch_items.extend(items)
+                if db_finished:
+                    batch_dbs += 1
+
+                if len(batch_items) >= batch_size:
+                    flush()
+
+                priority_mark = "🎯 " if db_name in self.priority_databases else ""
+                reporter.update(processed, f"{priority_mark}正在训练: {db_name}.{table} ({processed}/{total_tables})")
+
+            flush()
+        finally:
+            # 无论正常结束还是写入时出错，都让上游线程退出：排空队列，解除阻塞的写入
+            stop_event.set()
+            while any(thread.is_alive() for thread in stage_threads):
+                for pipe in (fetched, built):
+                    try:
+                        while True:
+                            pipe.get_nowait()
+                    except queue.Empty:
+                        pass
+                for thread in stage_threads:
+                    thread.join(timeout=PIPELINE_PUT_TIMEOUT)
 
-        progress_bar.empty()
-        status_placeholder.empty()
+        reporter.close()
 
         results['success'] = True
         results['databases_trained'] = trained_dbs
         results['tables_trained'] = trained_tables
         results['training_time'] = time.time() - start_time
+        if self.training_manager:
+            results['dedup'] = {
+                status: count - counts_before.get(status, 0)
+                for status, count in self.training_manager.dedup_counts.items()
+            }
         self.is_trained = True
 
         return results
 
-    def generate_smart_query(self, user_query: str, db_info: Dict) -> Dict:
-        """智能生成查询"""
+    def _build_table_items(self, db_name: str, table: str, ddl: Optional[str], tables_info: Dict) -> List[dict]:
+        """生成单个表的训练条目：DDL、多种查询模式和表结构描述"""
+        metadata = {
+            'database': db_name,
+            'table': table,
+            'priority': db_name in self.priority_databases
+        }
+        items = []
+
+        # 训练DDL
+        if ddl:
+            items.append({'type': 'ddl', 'content': ddl, 'metadata': metadata})
+
+        # 1. 训练简单的表名查询
+        sql = f"SELECT * FROM `{db_name}`.`{table}` LIMIT 10"
+        items.append({'type': 'sql', 'question': f"查询表 {table}", 'sql': sql, 'metadata': metadata})
+
+        # 2. 训练表详情查询
+        detail_sql = f"DESCRIBE `{db_name}`.`{table}`"
+        items.append({'type': 'sql', 'question': f"查看表 {table} 的详情", 'sql': detail_sql, 'metadata': metadata})
+
+        # 3. 训练中文查询
+        items.append({'type': 'sql', 'question': f"帮我查 {table} 表", 'sql': sql, 'metadata': metadata})
+
+        # 4. 训练表结构描述
+        if table in tables_info:
+            columns = tables_info[table].get('columns', [])
+            column_types = tables_info[table].get('column_types', [])
+
+            if columns:
+                columns_desc = []
+                for col, col_type in zip(columns, column_types):
+                    columns_desc.append(f"{col} ({col_type})")
+
+                priority_note = "（优先数据库）" if db_name in self.priority_databases else ""
+                table_desc = f"数据库 {db_name} {priority_note}中的表 {table} 包含以下字段: {', '.join(columns_desc)}"
+                indexes = tables_info[table].get('indexes')
+                if indexes:
+                    table_desc += f"；索引: {format_indexes(indexes)}"
+                if tables_info[table].get('rows'):
+                    table_desc += f"；约 {tables_info[table]['rows']} 行"
+                items.append({'type': 'documentation', 'content': table_desc, 'metadata': metadata})
+
+        return items
+
+    def _build_database_items(self, db_name: str, tables: List[str], shard_members: List[str] = None) -> List[dict]:
+        """生成数据库上下文的训练条目"""
+        metadata = {
+            'database': db_name,
+            'priority': db_name in self.priority_databases
+        }
+        priority_tag = "（优先数据库）" if db_name in self.priority_databases else ""
+        db_context = f"数据库 {db_name} {priority_tag}包含以下表: {', '.join(tables[:10])}"
+        if len(tables) > 10:
+            db_context += f" 等共 {len(tables)} 个表"
+        items = [{'type': 'documentation', 'content': db_context, 'metadata': metadata}]
+
+        if shard_members:
+            others = [member for member in shard_members if member != db_name]
+            shard_context = f"数据库 {db_name} 与 {', '.join(others[:10])}"
+            if len(others) > 10:
+                shard_context += f" 等共 {len(others)} 个库"
+            shard_context += " 的表结构完全相同（分片），查询这些库时使用相同的表和字段，只替换库名"
+            items.append({'type': 'documentation', 'content': shard_context, 'metadata': metadata})
+        return items
+
+    def generate_smart_query(self, user_query: str, db_info: Dict, on_token=None) -> Dict:
+        """智能生成查询
+
+        传入 on_token 时以流式方式调用 Vanna，每收到新的输出就回调一次。
+        """
         try:
             # 首先尝试精确匹配表名
             exact_match_result = self._try_exact_table_match(user_query, db_info)
             if exact_match_result:
-                return exact_match_result
+                return self._resolve_shard_target(user_query, exact_match_result)
 
-            # 如果没有精确匹配，使用Vanna智能查询
-            sql = self.vn.generate_sql(question=user_query)
+            # 如果没有精确匹配，使用Vanna智能查询；问题中提到的大表把索引放进上下文，一次生成即可参考
+            context = {}
+            index_hint = self._build_index_hint(
+                [(ref.database, ref.table) for refs in self.table_index.find_mentions(user_query) for ref in refs[:1]],
+                db_info
+            )
+            if index_hint:
+                context['db_context'] = index_hint
+            if on_token:
+                sql = self.vn.generate_sql(
+                    question=user_query, stream=True, on_token=on_token,
+                    priority_databases=self.priority_databases, **context
+                )
+            else:
+                sql = self.vn.generate_sql(question=user_query, priority_databases=self.priority_databases, **context)
 
             if not sql:
                 return {'success': False, 'error': '无法生成SQL'}
@@ -523,7 +1328,27 @@ class EnhancedSmartQueryGenerator:
             # 分析SQL中使用了哪些数据库
             used_databases = self._analyze_sql_databases(sql, db_info)
 
-            return {
+            # 评估大表的过滤和排序字段能否走索引；问题里没提到的大表导致命中偏低时，带上它们的索引说明再生成一个候选
+            default_db = used_databases[0] if used_databases else None
+            index_score = score_index_usage(sql, db_info, default_db, self.INDEX_HINT_MIN_ROWS)
+            candidates = 1
+            if (index_score['unindexed'] or index_score['wrapped']) and index_score['score'] < self.INDEX_SCORE_THRESHOLD:
+                retry_hint = self._build_index_hint(
+                    [(ref.database or default_db, ref.table) for ref in extract_tables(sql)], db_info
+                )
+                if retry_hint and retry_hint != index_hint:
+                    candidates += 1
+                    retry_sql = self.vn.generate_sql(
+                        question=user_query, priority_databases=self.priority_databases, db_context=retry_hint
+                    )
+                    if retry_sql and not retry_sql.lstrip().startswith('--'):
+                        retry_databases = self._analyze_sql_databases(retry_sql, db_info)
+                        retry_db = retry_databases[0] if retry_databases else None
+                        retry_score = score_index_usage(retry_sql, db_info, retry_db, self.INDEX_HINT_MIN_ROWS)
+                        if retry_score['score'] > index_score['score']:
+                            sql, used_databases, index_score = retry_sql, retry_databases, retry_score
+
+            return self._resolve_shard_target(user_query, {
                 'success': True,
                 'sql': sql,
                 'enhanced_query': user_query,
@@ -531,54 +1356,92 @@ class EnhancedSmartQueryGenerator:
                 'keywords': [],
                 'used_databases': used_databases,
                 'priority_used': any(db in self.priority_databases for db in used_databases),
-                'match_type': 'vanna_generated'
-            }
+                'match_type': 'vanna_generated',
+                'prompt_prefix_hash': getattr(self.vn, 'last_prefix_hash', None),
+                'index_score': index_score,
+                'sql_candidates': candidates
+            })
 
         except Exception as e:
             return {'success': False, 'error': str(e)}
 
+    def _build_index_hint(self, tables: List[Tuple[str, str]], db_info: Dict) -> str:
+        """大表（估算行数不低于 INDEX_HINT_MIN_ROWS）的索引说明，作为生成时的数据库上下文"""
+        databases = (db_info or {}).get('databases', {})
+        lines = []
+        for database, table in tables:
+            info = databases.get(database, {}).get('tables_info', {}).get(table, {})
+            if info.get('indexes') and (info.get('rows') or 0) >= self.INDEX_HINT_MIN_ROWS:
+                line = f"表 {database}.{table} 的索引: {format_indexes(info['indexes'])}"
+                if line not in lines:
+                    lines.append(line)
+        if not lines:
+            return ""
+        return "\n".join(lines) + "\n请尽量使用索引的第一个字段做过滤、关联和排序，不要在这些字段外面包函数。"
+
     def _try_exact_table_match(self, user_query: str, db_info: Dict) -> Optional[Dict]:
         """尝试精确匹配表名"""
         if not db_info or 'databases' not in db_info:
             return None
 
+        self.table_index.update(db_info, self.priority_databases)
+
+        # 一次扫描找出问题中提到的表名或表注释别名（不依赖分词，适用于中文问题）
+        mentions = self.table_index.find_mentions(user_query)
+        if len({ref.table for refs in mentions for ref in refs}) > 1:
+            # 提到了多张表，通常需要关联查询，交给 Vanna 生成
+            return None
+        ref = self.table_index.choose(mentions)
+        if ref:
+            return self._create_exact_match_result(ref.database, ref.table, user_query, db_info)
+
         # 从查询中提取可能的表名
         potential_table_names = self._extract_table_names_from_query(user_query)
 
         if not potential_table_names:
             return None
 
-        # 首先在优先数据库中查找
-        for table_name in potential_table_names:
-            for db_name in self.priority_databases:
-                if db_name in db_info['databases']:
-                    db_data = db_info['databases'][db_name]
-                    tables = db_data.get('tables', [])
-
-                    # 精确匹配
-                    if table_name in tables:
-                        return self._create_exact_match_result(db_name, table_name, user_query)
-
-                    # 忽略大小写匹配
-                    for actual_table in tables:
-                        if actual_table.lower() == table_name.lower():
-                            return self._create_exact_match_result(db_name, actual_table, user_query)
-
-        # 然后在所有数据库中查找
-        for table_name in potential_table_names:
-            for db_name, db_data in db_info['databases'].items():
-                tables = db_data.get('tables', [])
+        # 通过索引查找（先优先库，再所有库；每个候选名只需两次字典访问）
+        ref = self.table_index.match(potential_table_names)
+        if ref:
+            return self._create_exact_match_result(ref.database, ref.table, user_query, db_info)
+
+        # 表名拼写错误或缩写时做模糊匹配
+        return self._try_fuzzy_table_match(user_query, db_info)
+
+    def _try_fuzzy_table_match(self, user_query: str, db_info: Dict = None) -> Optional[Dict]:
+        """用 n-gram 索引模糊匹配表名，相似度不低于 FUZZY_TABLE_THRESHOLD 时仍走模板查询
+
+        只有带表名提示（如 "xxx表"、"查xxx"）的词参与表名匹配，避免普通英文词误匹配到相近的表。
+        """
+        tokens = set(re.findall(r'[A-Za-z][A-Za-z0-9_]{3,}', user_query))
+        best = None
+        for token in tokens:
+            if not re.search(self.FUZZY_TABLE_CUE.format(token=re.escape(token)), user_query, flags=re.IGNORECASE):
+                continue
+            for score, refs in self.table_index.fuzzy_tables(token, k=1, threshold=self.FUZZY_TABLE_THRESHOLD):
+                if best is None or score > best[0]:
+                    best = (score, token, refs)
+        if best is None:
+            return None
 
-                # 精确匹配
-                if table_name in tables:
-                    return self._create_exact_match_result(db_name, table_name, user_query)
+        score, token, refs = best
+        ref = self.table_index.choose([refs])
+        matches = [f"模糊匹配: {token} → {ref.table}（相似度 {score:.2f}）"]
 
-                # 忽略大小写匹配
-                for actual_table in tables:
-                    if actual_table.lower() == table_name.lower():
-                        return self._create_exact_match_result(db_name, actual_table, user_query)
+        # 其余词在该表字段中的模糊匹配，作为提示
+        for other in sorted(tokens - {token}):
+            for column_score, column, column_refs in self.table_index.fuzzy_columns(
+                    other, k=1, threshold=self.FUZZY_TABLE_THRESHOLD):
+                if ref in column_refs:
+                    matches.append(f"字段: {other} → {column}（相似度 {column_score:.2f}）")
 
-        return None
+        result = self._create_exact_match_result(ref.database, ref.table, user_query, db_info)
+        if result is None:
+            return None
+        result['match_type'] = 'fuzzy_table'
+        result['relevant_info']['databases'][ref.database]['tables'][ref.table]['matches'] = matches
+        return result
 
     def _extract_table_names_from_query(self, query: str) -> List[str]:
         """从查询中提取可能的表名"""
@@ -610,14 +1473,18 @@ class EnhancedSmartQueryGenerator:
 
         return potential_table_names
 
-    def _create_exact_match_result(self, db_name: str, table_name: str, user_query: str) -> Dict:
-        """创建精确匹配的结果"""
+    def _create_exact_match_result(self, db_name: str, table_name: str, user_query: str,
+                                   db_info: Dict = None) -> Optional[Dict]:
+        """创建精确匹配的结果；规则无法回答问题时返回 None，交给 Vanna 生成"""
         # 根据查询意图生成SQL
-        sql = self._generate_query_by_intent(db_name, table_name, user_query)
+        table_info = (db_info or {}).get('databases', {}).get(db_name, {}).get('tables_info', {}).get(table_name, {})
+        intent = self._generate_query_by_intent(db_name, table_name, user_query, table_info)
+        if intent is None:
+            return None
 
         return {
             'success': True,
-            'sql': sql,
+            'sql': intent['sql'],
             'enhanced_query': f"查询表 {db_name}.{table_name}",
             'relevant_info': {
                 'databases': {
@@ -633,67 +1500,142 @@ class EnhancedSmartQueryGenerator:
             'keywords': [table_name],
             'used_databases': [db_name],
             'priority_used': db_name in self.priority_databases,
-            'match_type': 'exact_table'
+            'match_type': 'exact_table',
+            'intents': intent['intents']
         }
 
-    def _generate_query_by_intent(self, db_name: str, table_name: str, user_query: str) -> str:
-        """根据查询意图生成SQL"""
-        query_lower = user_query.lower()
+    def _generate_query_by_intent(self, db_name: str, table_name: str, user_query: str,
+                                  table_info: Dict = None) -> Optional[Dict]:
+        """根据查询意图生成SQL，返回 {'sql', 'intents'}，规则无法回答时返回 None
 
-        if any(word in query_lower for word in ['详情', '结构', '字段', '列', 'desc', 'describe']):
-            return f"DESCRIBE `{db_name}`.`{table_name}`;"
-        elif any(word in query_lower for word in ['数量', '计数', 'count', '多少']):
-            return f"SELECT COUNT(*) FROM `{db_name}`.`{table_name}`;"
-        else:
-            return f"SELECT * FROM `{db_name}`.`{table_name}` LIMIT 10;"
+        用表的字段和字段类型识别过滤、前N名、分组计数、日期范围、去重等意图，不调用大模型。
+        """
+        table_info = table_info or {}
+        engine = IntentEngine(db_name, table_name, table_info.get('columns', []), table_info.get('column_types', []))
+        return engine.build(user_query)
 
     def _analyze_sql_databases(self, sql: str, db_info: Dict) -> List[str]:
-        """分析SQL中使用的数据库"""
-        used_dbs = []
-
-        pattern = r'`?(\w+)`?\.`?(\w+)`?'
-        matches = re.findall(pattern, sql)
-
-        for db_match, _ in matches:
-            if db_match in db_info.get('databases', {}):
-                used_dbs.append(db_match)
-
-        return used_dbs
-
-def generate_diverse_qsql_pairs(tables_info, pair_count, diversity_level, training_manager):
-    """生成多样化的问题-SQL对"""
-    try:
-        from openai import OpenAI
-        import os
-
-        # 准备表信息文本
-        tables_text = ""
-        for table_info in tables_info:
-            db_name = table_info['database']
-            table_name = table_info['table']
-            columns = table_info.get('columns', [])
-            columns_info = table_info.get('columns_info', [])
-
-            tables_text += f"数据库: {db_name}\n"
-            tables_text += f"表: {table_name}\n"
-            tables_text += f"字段 ({len(columns)}个): {', '.join(columns_info)}\n\n"
+        """分析SQL中使用的数据库
+
+        解析 SQL 引用的表（忽略别名、公用表表达式和子查询别名）：
+        有未限定库名的表时，返回同时包含这些表的库（优先库在前），SQL 在这些库中执行；
+        否则返回 SQL 中限定的、目录中存在的库。
+        """
+        databases = (db_info or {}).get('databases', {})
+        self.table_index.update(db_info, self.priority_databases)
+
+        qualified = []
+        owners = None
+        for reference in extract_tables(sql):
+            if reference.database is not None:
+                if reference.database in databases and reference.database not in qualified:
+                    qualified.append(reference.database)
+                continue
+            table_owners = []
+            for ref in self.table_index.lookup(reference.table):
+                if ref.database not in table_owners:
+                    table_owners.append(ref.database)
+            owners = table_owners if owners is None else [db for db in owners if db in table_owners]
+
+        return owners if owners is not None else qualified
+
+# 问题-SQL对生成的分组预算
+PAIR_PROMPT_TOKEN_BUDGET = 3000    # 每组提示词中表信息的 token 上限
+PAIR_OUTPUT_TOKEN_BUDGET = 2000    # 每次调用的 max_tokens
+PAIR_TOKENS_PER_PAIR = 60          # 每个问题-SQL对的平均输出 token
+
+# 各分组轮换侧重的查询类型，同一组表拆成多次调用时避免生成重复的对
+PAIR_QUERY_TYPES = [
+    "简单查询（SELECT *）",
+    "表结构查询（DESCRIBE/SHOW COLUMNS）",
+    "统计查询（COUNT, SUM, AVG等）",
+    "条件查询（WHERE子句）",
+    "排序查询（ORDER BY）",
+    "分组查询（GROUP BY）",
+    "多表查询（JOIN，如果涉及多个表）",
+    "字段详情查询",
+]
+
+def _format_pair_table(table_info: dict) -> str:
+    """单个表在提示词中的描述"""
+    columns = table_info.get('columns', [])
+    columns_info = table_info.get('columns_info', [])
+    return (f"数据库: {table_info['database']}\n"
+            f"表: {table_info['table']}\n"
+            f"字段 ({len(columns)}个): {', '.join(columns_info)}\n\n")
+
+def plan_pair_generation(tables_info: List[dict], pair_count: int) -> List[dict]:
+    """把选中的表按 token 预算切分成生成任务，返回 [{'tables', 'tables_text', 'count', 'focus'}]
+
+    同一数据库的表尽量放在同一组（便于生成 JOIN）；每组分到的数量与表数成正比，
+    超过单次调用输出上限的组拆成多次调用，并轮换侧重的查询类型。
+    """
+    if not tables_info or pair_count <= 0:
+        return []
 
-        # 构建Prompt
-        prompt = f"""你是一个SQL专家，需要为以下数据库表生成自然语言问题和对应的SQL查询对。
+    groups = []
+    current, current_text, current_tokens, current_db = [], "", 0, None
+    for table_info in tables_info:
+        block = _format_pair_table(table_info)
+        tokens = estimate_tokens([{'content': block}])
+        if current and (current_tokens + tokens > PAIR_PROMPT_TOKEN_BUDGET or table_info['database'] != current_db):
+            groups.append((current, current_text))
+            current, current_text, current_tokens = [], "", 0
+        current.append(table_info)
+        current_text += block
+        current_tokens += tokens
+        current_db = table_info['database']
+    if current:
+        groups.append((current, current_text))
+
+    # 按表数分配数量，余数给前面的组
+    total_tables = sum(len(tables) for tables, _ in groups)
+    allocations = [max(1, pair_count * len(tables) // total_tables) for tables, _ in groups]
+    for index in range(max(0, pair_count - sum(allocations))):
+        allocations[index % len(allocations)] += 1
+
+    per_call = max(1, PAIR_OUTPUT_TOKEN_BUDGET // PAIR_TOKENS_PER_PAIR)
+    tasks = []
+    for (tables, tables_text), count in zip(groups, allocations):
+        calls = (count + per_call - 1) // per_call
+        for call in range(calls):
+            tasks.append({
+                'tables': tables,
+                'tables_text': tables_text,
+                'count': count // calls + (1 if call < count % calls else 0),
+                'focus': PAIR_QUERY_TYPES[call % len(PAIR_QUERY_TYPES)] if calls > 1 else None
+            })
+    return tasks
+
+def _parse_pair_lines(content: str) -> List[Tuple[str, str]]:
+    """解析 "问题###SQL" 格式的模型输出"""
+    pairs = []
+    for line in content.strip().split('\n'):
+        line = line.strip()
+        if '###' in line:
+            question, sql = line.split('###', 1)
+            question = question.strip()
+            sql = sql.strip()
+
+            # 验证SQL语法
+            if sql.upper().startswith(('SELECT', 'DESCRIBE', 'SHOW', 'COUNT', 'SUM', 'AVG', 'MIN', 'MAX')):
+                pairs.append((question, sql))
+    return pairs
+
+def _generate_pair_group(task: dict, diversity_level: str, model: str) -> List[Tuple[str, str]]:
+    """为一组表调用一次模型生成问题-SQL对"""
+    query_types = "\n        ".join(f"{i}. {query_type}" for i, query_type in enumerate(PAIR_QUERY_TYPES, 1))
+    focus = f"\n        本次请侧重：{task['focus']}\n" if task['focus'] else ""
+
+    # 构建Prompt
+    prompt = f"""你是一个SQL专家，需要为以下数据库表生成自然语言问题和对应的SQL查询对。
 
         表信息：
-        {tables_text}
-
-        请生成{pair_count}个多样化的问题-SQL对，涵盖以下类型：
-        1. 简单查询（SELECT *）
-        2. 表结构查询（DESCRIBE/SHOW COLUMNS）
-        3. 统计查询（COUNT, SUM, AVG等）
-        4. 条件查询（WHERE子句）
-        5. 排序查询（ORDER BY）
-        6. 分组查询（GROUP BY）
-        7. 多表查询（JOIN，如果涉及多个表）
-        8. 字段详情查询
+        {task['tables_text']}
 
+        请生成{task['count']}个多样化的问题-SQL对，涵盖以下类型：
+        {query_types}
+        {focus}
         多样性要求：{diversity_level}级别
 
         格式要求：每个对占一行，问题和SQL之间用"###"分隔
@@ -705,46 +1647,137 @@ def generate_diverse_qsql_pairs(tables_info, pair_count, diversity_level, traini
 
         现在开始生成："""
 
+    # 调用阿里云API（共享客户端，复用连接池）
+    response = get_llm_client().chat(
+        [
+            {"role": "system", "content": "你是一个专业的SQL查询生成助手。"},
+            {"role": "user", "content": prompt}
+        ],
+        model=model,
+        priority=PRIORITY_BATCH,
+        temperature=0.7 if diversity_level == "高" else 0.5,
+        max_tokens=min(PAIR_OUTPUT_TOKEN_BUDGET, task['count'] * PAIR_TOKENS_PER_PAIR + 200)
+    )
+    return _parse_pair_lines(response.choices[0].message.content)
+
+def _pair_task_key(task: dict) -> str:
+    """生成任务的标识：组内的表、数量和侧重类型，用于恢复时识别已完成的组"""
+    tables = ",".join(f"{table_info['database']}.{table_info['table']}" for table_info in task['tables'])
+    return f"{tables}#{task['count']}#{task['focus'] or ''}"
+
+def _pair_table_fingerprint(table_info: dict) -> str:
+    """生成结果缓存使用的表结构指纹：库名、表名以及字段名和类型"""
+    payload = json.dumps([table_info['database'], table_info['table'], table_info.get('columns_info', [])],
+                         ensure_ascii=False)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+def _pair_primary_table(sql: str, tables: List[dict]) -> dict:
+    """生成结果归属的表：SQL 中第一个出现的表，都没有出现时取组内第一个表"""
+    positions = []
+    for table_info in tables:
+        match = re.search(rf'(?<![\w]){re.escape(table_info["table"])}(?!\w)', sql, flags=re.ASCII)
+        if match:
+            positions.append((match.start(), table_info))
+    return min(positions, key=lambda item: item[0])[1] if positions else tables[0]
+
+def _report_error(message: str, progress_callback=None):
+    """报告错误：后台任务通过进度回调写入任务状态（线程中不能调用 st.error），否则显示在页面上"""
+    if progress_callback:
+        progress_callback(0, 1, message)
+    else:
+        st.error(message)
+
+def get_pair_cache(training_manager):
+    """生成结果缓存（与训练数据共用 SQLite 存储），不可用时返回 None"""
+    return getattr(getattr(training_manager, 'vn', None), 'store', None)
+
+def generate_diverse_qsql_pairs(tables_info, pair_count, diversity_level, training_manager,
+                                progress_callback=None, max_workers: int = None, use_cache: bool = True,
+                                completed_groups: Dict[str, list] = None, on_group_done=None):
+    """生成多样化的问题-SQL对
+
+    use_cache=True 时先从缓存中取结构未变化的表的已有结果（按 表结构指纹、多样性、模型 缓存），
+    只为不足的数量调用模型。调用时按 token 预算把表分组，各组并发调用模型
+    （并发数受共享 LLM 客户端限制），再合并去重。
+    progress_callback(已完成组数, 总组数, 说明) 在每组完成后回调，为空时使用 Streamlit 进度条。
+    completed_groups 为 {任务标识: 结果} 时直接使用这些组上次的结果，不再调用模型；
+    on_group_done(任务标识, 结果) 在每组生成成功后回调，用于记录检查点。
+    """
+    try:
         # 使用.env配置文件中的阿里云API配置
         api_key = os.getenv('ALI_API_KEY')
-        base_url = os.getenv('ALI_BASE_URL')
         model = os.getenv('VANNA_MODEL', 'qwen3-max')
 
-        if not api_key:
-            st.error("❌ 未配置阿里云API密钥，请在.env文件中设置ALI_API_KEY")
-            return []
+        # 缓存中已有的结果，各表轮流取
+        cache = get_pair_cache(training_manager) if use_cache else None
+        fingerprints = [_pair_table_fingerprint(table_info) for table_info in tables_info]
+        cached_pairs = []
+        if cache:
+            cached = cache.get_cached_pairs(set(fingerprints), diversity_level, model)
+            for round_pairs in zip_longest(*[cached.get(fingerprint, []) for fingerprint in fingerprints]):
+                cached_pairs.extend(pair for pair in round_pairs if pair)
+            cached_pairs = list(dict.fromkeys(cached_pairs))
 
-        # 调用阿里云API
-        client = OpenAI(
-            api_key=api_key,
-            base_url=base_url
-        )
+        missing = pair_count - len(cached_pairs)
+        if missing <= 0:
+            return cached_pairs[:pair_count]
 
-        response = client.chat.completions.create(
-            model=model,
-            messages=[
-                {"role": "system", "content": "你是一个专业的SQL查询生成助手。"},
-                {"role": "user", "content": prompt}
-            ],
-            temperature=0.7 if diversity_level == "高" else 0.5,
-            max_tokens=2000
-        )
-
-        # 解析响应
-        content = response.choices[0].message.content
-        lines = content.strip().split('\n')
-
-        pairs = []
-        for line in lines:
-            line = line.strip()
-            if '###' in line:
-                question, sql = line.split('###', 1)
-                question = question.strip()
-                sql = sql.strip()
-
-                # 验证SQL语法
-                if sql.upper().startswith(('SELECT', 'DESCRIBE', 'SHOW', 'COUNT', 'SUM', 'AVG', 'MIN', 'MAX')):
-                    pairs.append((question, sql))
+        if not api_key:
+            _report_error("❌ 未配置阿里云API密钥，请在.env文件中设置ALI_API_KEY", progress_callback)
+            return cached_pairs
+
+        tasks = plan_pair_generation(tables_info, missing)
+        if not tasks:
+            return cached_pairs
+        keys = [_pair_task_key(task) for task in tasks]
+        completed_groups = completed_groups or {}
+        group_pairs = [[tuple(pair) for pair in completed_groups.get(key, [])] for key in keys]
+        pending = [index for index, key in enumerate(keys) if key not in completed_groups]
+        restored = len(tasks) - len(pending)
+
+        llm = get_llm_client()
+        max_workers = max(1, min(max_workers or llm.max_concurrency, len(pending) or 1))
+        reporter = ProgressReporter(len(tasks), render=progress_callback, min_interval=0)
+        if restored:
+            reporter.update(restored, f"已从检查点恢复 {restored}/{len(tasks)} 组")
+
+        failed_groups = 0
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = {executor.submit(_generate_pair_group, tasks[index], diversity_level, model): index
+                       for index in pending}
+            for done, future in enumerate(as_completed(futures), restored + 1):
+                index = futures[future]
+                tables = tasks[index]['tables']
+                try:
+                    group_pairs[index] = future.result()
+                except Exception as e:
+                    failed_groups += 1
+                    print(f"生成问题-SQL对失败（{tables[0]['database']} 等 {len(tables)} 个表）: {str(e)}")
+                else:
+                    if on_group_done:
+                        on_group_done(keys[index], group_pairs[index])
+                reporter.update(done, f"已完成 {done}/{len(tasks)} 组（{tables[0]['database']} 等 {len(tables)} 个表）")
+        reporter.close()
+
+        if failed_groups == len(tasks) and not cached_pairs:
+            raise RuntimeError("所有分组生成失败")
+
+        # 写入缓存，每个对归属于 SQL 中第一个出现的表
+        if cache:
+            fingerprint_of = {(table_info['database'], table_info['table']): fingerprint
+                              for table_info, fingerprint in zip(tables_info, fingerprints)}
+            rows = []
+            for task, new_pairs in zip(tasks, group_pairs):
+                for question, sql in new_pairs:
+                    table_info = _pair_primary_table(sql, task['tables'])
+                    rows.append((fingerprint_of[(table_info['database'], table_info['table'])],
+                                 diversity_level, model, question, sql))
+            cache.add_cached_pairs(rows)
+
+        # 缓存结果在前；新结果各组轮流取，截断到目标数量时每组都有结果
+        pairs = list(cached_pairs)
+        for round_pairs in zip_longest(*group_pairs):
+            pairs.extend(pair for pair in round_pairs if pair)
 
         # 如果AI生成的不够，补充一些基础查询
         if len(pairs) < pair_count:
@@ -769,18 +1802,19 @@ def generate_diverse_qsql_pairs(tables_info, pair_count, diversity_level, traini
 
                 pairs.extend(base_queries)
 
-        # 去重并限制数量
+        # 去重并限制数量（忽略SQL中的空白、大小写和结尾分号）
         unique_pairs = []
         seen = set()
         for question, sql in pairs:
-            if (question, sql) not in seen and len(unique_pairs) < pair_count:
-                seen.add((question, sql))
+            key = (question, re.sub(r'\s+', ' ', sql).rstrip(';').strip().lower())
+            if key not in seen and len(unique_pairs) < pair_count:
+                seen.add(key)
                 unique_pairs.append((question, sql))
 
         return unique_pairs
 
     except ImportError:
-        st.error("❌ 未安装openai库，请运行: pip install openai")
+        _report_error("❌ 未安装openai库，请运行: pip install openai", progress_callback)
         return []
     except Exception as e:
         print(f"生成问题-SQL对失败: {str(e)}")
@@ -810,7 +1844,58 @@ def generate_diverse_qsql_pairs(tables_info, pair_count, diversity_level, traini
         # 限制数量
         return backup_pairs[:pair_count]
 
+# 估算扫描行数超过该值的问题-SQL对会被标记为代价过高
+PAIR_MAX_ESTIMATED_ROWS = int(os.getenv('PAIR_MAX_ESTIMATED_ROWS', 1000000))
+
+def _guess_pair_database(sql: str, tables_info: List[dict]) -> Optional[str]:
+    """推断 SQL 所属的数据库：优先使用库名限定，其次按表名匹配选中的表"""
+    for table_info in tables_info:
+        if re.search(rf'(?<![\w$])`?{re.escape(table_info["database"])}`?\s*\.', sql, flags=re.ASCII):
+            return table_info['database']
+    for table_info in tables_info:
+        if re.search(rf'(?<![\w$.]){re.escape(table_info["table"])}(?![\w$])', sql, flags=re.ASCII):
+            return table_info['database']
+    return tables_info[0]['database'] if tables_info else None
+
+def validate_qsql_pairs(db_manager, host: str, pairs: List[Tuple[str, str]], tables_info: List[dict],
+                        max_rows: int = PAIR_MAX_ESTIMATED_ROWS, progress_callback=None) -> tuple:
+    """用 EXPLAIN 并发校验问题-SQL对
+
+    返回 (保留的对, {对: 校验结果}, [(无法执行的对, 错误)])。校验结果包含 database、
+    estimated_rows（EXPLAIN 估算的扫描行数）和 expensive（超过 max_rows）；
+    因连接问题无法校验的对会保留，checked 为 False。
+    """
+    statements = [(_guess_pair_database(sql, tables_info), sql) for _, sql in pairs]
+    results = db_manager.explain_many(host, statements, progress_callback=progress_callback)
+
+    kept, checks, failed = [], {}, []
+    for pair, (database, _), result in zip(pairs, statements, results):
+        if result['valid'] is False:
+            failed.append((pair, result['error']))
+            continue
+        kept.append(pair)
+        estimated_rows = result['estimated_rows']
+        checks[pair] = {
+            'database': database,
+            'checked': result['valid'] is True,
+            'estimated_rows': estimated_rows,
+            'expensive': estimated_rows is not None and estimated_rows > max_rows
+        }
+    return kept, checks, failed
+
 # 手动训练界面
+# 快照和服务器文件只允许读写该目录下的文件
+DATA_DIR = os.getenv('DATA_DIR', 'data')
+
+def resolve_data_path(path: str) -> Optional[str]:
+    """把输入的路径解析到 DATA_DIR 下，越出该目录（含经符号链接越出）时提示错误并返回 None"""
+    root = os.path.realpath(DATA_DIR)
+    resolved = os.path.realpath(os.path.join(root, path))
+    if os.path.commonpath([root, resolved]) != root:
+        st.error(f"❌ 只能访问数据目录 {root} 下的文件: {path}")
+        return None
+    return resolved
+
 def show_manual_training_interface(training_manager, db_manager, host, db_info):
     """显示手动训练界面"""
     st.markdown("### 🎓 手动训练")
@@ -929,6 +2014,10 @@ def show_manual_training_interface(training_manager, db_manager, host, db_info):
             st.session_state.generated_pairs = []
         if 'selected_pairs' not in st.session_state:
             st.session_state.selected_pairs = []
+        if 'pair_checks' not in st.session_state:
+            st.session_state.pair_checks = {}
+        if 'dropped_pairs' not in st.session_state:
+            st.session_state.dropped_pairs = []
 
         # 创建两个主要区域
         tab1, tab2 = st.tabs(["🔧 手动训练", "🤖 智能批量生成"])
@@ -1090,54 +2179,122 @@ def show_manual_training_interface(training_manager, db_manager, host, db_info):
                         help="高多样性会生成更多类型的查询"
                     )
 
+                    background_generation = st.checkbox("后台生成", value=False,
+                                                        help="在后台任务中生成，刷新页面不会中断")
+                    validate_pairs = st.checkbox("EXPLAIN校验SQL", value=True,
+                                                 help="丢弃无法执行的SQL，估算扫描行数过多的对默认不选中")
+                    use_pair_cache = st.checkbox("使用已缓存的结果", value=True,
+                                                 help="表结构未变化时复用之前生成的对，只为不足的数量调用AI")
+
                 # 生成按钮
                 if st.button("🎯 开始智能生成", type="primary", use_container_width=True):
                     if not selected_tables:
                         st.warning("请至少选择一个表")
                     else:
-                        with st.spinner("🤖 AI正在生成多样化的问题-SQL对..."):
-                            # 准备表信息
-                            tables_info = []
-                            for db_name, table_name in selected_tables:
-                                if db_name in db_info['databases']:
-                                    db_data = db_info['databases'][db_name]
-                                    if table_name in db_data['tables_info']:
-                                        table_info = db_data['tables_info'][table_name]
-                                        columns = table_info.get('columns', [])
-                                        columns_info = []
-                                        for i, col in enumerate(columns):
-                                            col_type = table_info.get('column_types', [])[i] if i < len(table_info.get('column_types', [])) else "未知类型"
-                                            columns_info.append(f"{col} ({col_type})")
-
-                                        tables_info.append({
-                                            'database': db_name,
-                                            'table': table_name,
-                                            'columns': columns,
-                                            'columns_info': columns_info,
-                                            'column_count': len(columns)
-                                        })
-
-                            # 生成多样化的问题-SQL对
-                            generated_pairs = generate_diverse_qsql_pairs(
-                                tables_info,
-                                pair_count,
-                                diversity,
-                                training_manager
+                        # 准备表信息
+                        tables_info = []
+                        for db_name, table_name in selected_tables:
+                            if db_name in db_info['databases']:
+                                db_data = db_info['databases'][db_name]
+                                if table_name in db_data['tables_info']:
+                                    table_info = db_data['tables_info'][table_name]
+                                    columns = table_info.get('columns', [])
+                                    columns_info = []
+                                    for i, col in enumerate(columns):
+                                        col_type = table_info.get('column_types', [])[i] if i < len(table_info.get('column_types', [])) else "未知类型"
+                                        columns_info.append(f"{col} ({col_type})")
+
+                                    tables_info.append({
+                                        'database': db_name,
+                                        'table': table_name,
+                                        'columns': columns,
+                                        'columns_info': columns_info,
+                                        'column_count': len(columns)
+                                    })
+
+                        if background_generation:
+                            job_id = get_job_registry().submit(
+                                'generate_pairs',
+                                {'tables_info': tables_info, 'pair_count': pair_count, 'diversity_level': diversity,
+                                 'host': host, 'validate': validate_pairs, 'use_cache': use_pair_cache},
+                                training_manager=training_manager,
+                                db_manager=db_manager
                             )
+                            st.info(f"已提交后台生成任务 {job_id}，完成后可在下方载入结果")
+                        else:
+                            with st.spinner("🤖 AI正在生成多样化的问题-SQL对..."):
+                                # 生成多样化的问题-SQL对
+                                generated_pairs = generate_diverse_qsql_pairs(
+                                    tables_info,
+                                    pair_count,
+                                    diversity,
+                                    training_manager,
+                                    use_cache=use_pair_cache
+                                )
 
+                            pair_checks, dropped_pairs = {}, []
+                            if validate_pairs and generated_pairs:
+                                try:
+                                    reporter = ProgressReporter(len(generated_pairs))
+                                    generated_pairs, pair_checks, dropped_pairs = validate_qsql_pairs(
+                                        db_manager, host, generated_pairs, tables_info,
+                                        progress_callback=lambda done, total, message: reporter.update(done, message)
+                                    )
+                                    reporter.close()
+                                    pair_cache = get_pair_cache(training_manager)
+                                    if pair_cache and dropped_pairs:
+                                        pair_cache.delete_cached_pairs(pair for pair, _ in dropped_pairs)
+                                except Error as e:
+                                    st.warning(f"无法连接数据库，跳过SQL校验: {str(e)}")
+
+                            st.session_state.pair_checks = pair_checks
+                            st.session_state.dropped_pairs = dropped_pairs
                             if generated_pairs:
                                 st.session_state.generated_pairs = generated_pairs
-                                st.session_state.selected_pairs = [True] * len(generated_pairs)  # 默认全选
+                                # 默认全选，代价过高的对不选中
+                                st.session_state.selected_pairs = [
+                                    not pair_checks.get(pair, {}).get('expensive', False) for pair in generated_pairs
+                                ]
                                 st.success(f"✅ 成功生成 {len(generated_pairs)} 个问题-SQL对")
                                 st.rerun()
                             else:
                                 st.error("生成失败，请重试")
 
+                # 后台生成任务
+                job_registry = get_job_registry()
+                generation_jobs = job_registry.list_jobs('generate_pairs')
+                if generation_jobs:
+                    with st.expander("🗂️ 后台生成任务", expanded=any(job['status'] == RUNNING for job in generation_jobs)):
+                        show_job_panel(job_registry, 'generate_pairs',
+                                       {'training_manager': training_manager, 'db_manager': db_manager},
+                                       key_prefix="pair_job")
+                        for job in generation_jobs[:3]:
+                            if job['status'] == 'completed' and job['result']:
+                                if st.button(f"📥 载入任务 {job['id']} 的结果（{len(job['result'])} 对）",
+                                             key=f"load_pairs_{job['id']}"):
+                                    st.session_state.generated_pairs = [tuple(pair[:2]) for pair in job['result']]
+                                    st.session_state.pair_checks = {
+                                        tuple(pair[:2]): pair[2] for pair in job['result'] if len(pair) > 2 and pair[2]
+                                    }
+                                    st.session_state.dropped_pairs = []
+                                    st.session_state.selected_pairs = [
+                                        not st.session_state.pair_checks.get(pair, {}).get('expensive', False)
+                                        for pair in st.session_state.generated_pairs
+                                    ]
+                                    st.rerun()
+
                 # 显示生成的训练对
                 if st.session_state.generated_pairs:
                     st.markdown("---")
                     st.markdown(f"#### 📋 生成结果 ({len(st.session_state.generated_pairs)} 对)")
 
+                    if st.session_state.dropped_pairs:
+                        with st.expander(f"⚠️ 已丢弃 {len(st.session_state.dropped_pairs)} 个无法执行的对"):
+                            for (question, sql), error in st.session_state.dropped_pairs:
+                                st.write(f"**{question}**")
+                                st.code(sql, language="sql")
+                                st.caption(error)
+
                     # 批量操作
                     col_batch1, col_batch2, col_batch3 = st.columns(3)
                     with col_batch1:
@@ -1154,6 +2311,8 @@ def show_manual_training_interface(training_manager, db_manager, host, db_info):
                         if st.button("🔄 重新生成", use_container_width=True):
                             st.session_state.generated_pairs = []
                             st.session_state.selected_pairs = []
+                            st.session_state.pair_checks = {}
+                            st.session_state.dropped_pairs = []
                             st.rerun()
 
                     # 显示所有生成的对
@@ -1164,6 +2323,14 @@ def show_manual_training_interface(training_manager, db_manager, host, db_info):
                             with col_display1:
                                 st.markdown(f"**问题**: {question}")
                                 st.code(sql, language="sql")
+                                check = st.session_state.pair_checks.get((question, sql))
+                                if check and check['checked']:
+                                    if check['expensive']:
+                                        st.caption(f"⚠️ EXPLAIN估算扫描 {check['estimated_rows']} 行，代价较高")
+                                    else:
+                                        st.caption(f"✅ EXPLAIN通过，估算扫描 {check['estimated_rows']} 行")
+                                elif check:
+                                    st.caption("未能校验（数据库连接失败）")
 
                             with col_display2:
                                 # 编辑按钮
@@ -1189,26 +2356,25 @@ def show_manual_training_interface(training_manager, db_manager, host, db_info):
                         if selected_count == 0:
                             st.warning("请至少选择一对进行训练")
                         else:
-                            success_count = 0
-                            progress_bar = st.progress(0)
-                            status_text = st.empty()
-
+                            items = []
                             for i, selected in enumerate(st.session_state.selected_pairs):
                                 if selected and i < len(st.session_state.generated_pairs):
                                     question, sql = st.session_state.generated_pairs[i]
-                                    status_text.text(f"正在训练第 {i+1}/{selected_count} 对...")
-                                    progress_bar.progress((i + 1) / selected_count)
-
-                                    metadata = {
-                                        'database': 'auto_generated',
-                                        'table': 'multiple',
-                                        'batch_idx': i
-                                    }
-                                    if training_manager.train_question_sql(question, sql, metadata):
-                                        success_count += 1
-
-                            progress_bar.empty()
-                            status_text.empty()
+                                    check = st.session_state.pair_checks.get((question, sql)) or {}
+                                    items.append({
+                                        'type': 'sql',
+                                        'question': question,
+                                        'sql': sql,
+                                        'metadata': {
+                                            'database': check.get('database') or 'auto_generated',
+                                            'table': 'multiple',
+                                            'batch_idx': i
+                                        }
+                                    })
+
+                            with st.spinner(f"正在训练 {len(items)} 对..."):
+                                result = training_manager.train_many(items)
+                            success_count = 0 if result.get('error') else result['valid']
 
                             if success_count > 0:
                                 st.success(f"✅ 批量训练完成！成功训练 {success_count}/{selected_count} 对")
@@ -1308,58 +2474,103 @@ def show_manual_training_interface(training_manager, db_manager, host, db_info):
 
         st.code(json.dumps(example_data, indent=2, ensure_ascii=False), language="json")
 
-        batch_data = st.text_area(
-            "批量训练数据（JSON格式）",
-            height=200,
-            placeholder="粘贴JSON数据..."
+        source = st.radio(
+            "数据来源",
+            ["粘贴JSON", "上传文件", "服务器文件路径"],
+            horizontal=True,
+            key="batch_source"
         )
 
-        col1, col2 = st.columns(2)
-        with col1:
-            if st.button("验证JSON格式", key="validate_json"):
-                try:
-                    data = json.loads(batch_data)
-                    st.success(f"✅ JSON格式正确，共{len(data)}条记录")
-                except Exception as e:
-                    st.error(f"❌ JSON格式错误: {str(e)}")
+        if source != "粘贴JSON":
+            st.caption("支持 JSON 数组或 JSONL（每行一条）文件，逐条流式解析并分批写入，坏记录会被跳过并列出")
+            if source == "上传文件":
+                uploaded_file = st.file_uploader("训练数据文件", type=["json", "jsonl"], key="batch_file")
+                file_path = None
+            else:
+                uploaded_file = None
+                file_path = st.text_input(f"文件路径（相对数据目录 {DATA_DIR}）", placeholder="training.jsonl",
+                                          key="batch_file_path")
+
+            if st.button("开始导入", type="primary", key="batch_import"):
+                resolved_path = resolve_data_path(file_path) if file_path else None
+                if uploaded_file is None and not resolved_path:
+                    # 路径越出数据目录时 resolve_data_path 已提示错误
+                    if not file_path:
+                        st.warning("请选择要导入的文件")
+                elif resolved_path and not os.path.isfile(resolved_path):
+                    st.error(f"文件不存在: {resolved_path}")
+                elif not training_manager:
+                    st.error("训练管理器未初始化")
+                else:
+                    expected_type = {"问题-SQL对": "sql", "DDL列表": "ddl", "文档列表": "documentation"}[train_format]
+                    file_size = uploaded_file.size if uploaded_file is not None else os.path.getsize(resolved_path)
+                    reporter = ProgressReporter(max(1, file_size // 1024), unit="KB")
+
+                    def on_progress(imported, bytes_read):
+                        reporter.update(bytes_read // 1024, f"已导入 {imported} 条")
 
-        with col2:
-            if st.button("执行批量训练", type="primary", key="batch_train"):
-                if batch_data:
                     try:
-                        data = json.loads(batch_data)
-                        success_count = 0
-                        total_count = len(data)
-
-                        progress_bar = st.progress(0)
-                        status_text = st.empty()
-
-                        for i, item in enumerate(data):
-                            status_text.text(f"正在训练第 {i+1}/{total_count} 条...")
-                            progress_bar.progress((i + 1) / total_count)
-
-                            if train_format == "问题-SQL对":
-                                if 'question' in item and 'sql' in item:
-                                    if training_manager.train_question_sql(item['question'], item['sql']):
-                                        success_count += 1
-                            elif train_format == "DDL列表":
-                                if 'ddl' in item:
-                                    if training_manager.train_ddl(item['ddl']):
-                                        success_count += 1
-                            elif train_format == "文档列表":
-                                if 'documentation' in item:
-                                    if training_manager.train_documentation(item['documentation']):
-                                        success_count += 1
-
-                        progress_bar.empty()
-                        status_text.empty()
-
-                        st.success(f"✅ 批量训练完成！成功: {success_count}/{total_count}")
+                        if uploaded_file is not None:
+                            stats = import_training_file(uploaded_file, training_manager, expected_type,
+                                                         progress=on_progress)
+                        else:
+                            with open(resolved_path, 'rb') as f:
+                                stats = import_training_file(f, training_manager, expected_type,
+                                                             progress=on_progress)
+                        reporter.close()
+
+                        st.success(
+                            f"✅ 导入完成！读取 {stats['total']} 条，写入 {stats['imported']} 条"
+                            f"（新增 {stats['new']}，更新 {stats['updated']}，未变化 {stats['unchanged']}）"
+                        )
+                        if stats['bad']:
+                            st.warning(f"跳过 {stats['bad']} 条无效记录")
+                            with st.expander(f"无效记录（显示前 {len(stats['errors'])} 条）"):
+                                st.text("\n".join(stats['errors']))
+                    except Exception as e:
+                        reporter.close()
+                        st.error(f"导入失败: {str(e)}")
+        else:
+            batch_data = st.text_area(
+                "批量训练数据（JSON格式）",
+                height=200,
+                placeholder="粘贴JSON数据..."
+            )
 
+            col1, col2 = st.columns(2)
+            with col1:
+                if st.button("验证JSON格式", key="validate_json"):
+                    try:
+                        data = json.loads(batch_data)
+                        st.success(f"✅ JSON格式正确，共{len(data)}条记录")
                     except Exception as e:
-                        st.error(f"批量训练失败: {str(e)}")
-                else:
-                    st.warning("请输入批量训练数据")
+                        st.error(f"❌ JSON格式错误: {str(e)}")
+
+            with col2:
+                if st.button("执行批量训练", type="primary", key="batch_train"):
+                    if batch_data:
+                        try:
+                            data = json.loads(batch_data)
+                            total_count = len(data)
+
+                            # 只保留与所选格式对应的条目，一次性校验并写入
+                            required_key = {"问题-SQL对": 'sql', "DDL列表": 'ddl', "文档列表": 'documentation'}[train_format]
+                            items = [item for item in data if isinstance(item, dict) and required_key in item]
+
+                            with st.spinner(f"正在训练 {len(items)} 条..."):
+                                result = training_manager.train_many(items)
+                            if not result.get('error'):
+                                st.success(
+                                    f"✅ 批量训练完成！成功: {result['valid']}/{total_count}"
+                                    f"（新增 {result['new']}，更新 {result['updated']}，未变化 {result['unchanged']}）"
+                                )
+                            if result['invalid']:
+                                st.warning(f"跳过 {len(result['invalid'])} 条无效记录")
+
+                        except Exception as e:
+                            st.error(f"批量训练失败: {str(e)}")
+                    else:
+                        st.warning("请输入批量训练数据")
 
     elif train_type == "训练历史":
         st.markdown("#### 📜 训练历史")
@@ -1389,6 +2600,35 @@ def show_manual_training_interface(training_manager, db_manager, host, db_info):
             else:
                 st.info("暂无训练历史")
 
+            # 训练快照：在不同实例之间迁移训练数据，或在部署后快速恢复
+            st.markdown("##### 📦 训练快照")
+            snapshot_path = st.text_input(
+                f"快照文件路径（相对数据目录 {DATA_DIR}）",
+                value=os.getenv('VANNA_SNAPSHOT_PATH', 'vanna_training.arrow'),
+                key="snapshot_path"
+            )
+            snap_col1, snap_col2 = st.columns(2)
+            with snap_col1:
+                if st.button("导出快照", key="export_snapshot"):
+                    export_path = resolve_data_path(snapshot_path)
+                    if export_path:
+                        os.makedirs(os.path.dirname(export_path), exist_ok=True)
+                        with st.spinner("正在导出..."):
+                            count = training_manager.export_snapshot(export_path)
+                        if count is not None:
+                            st.success(f"✅ 已导出 {count} 条训练数据到 {export_path}")
+            with snap_col2:
+                replace_existing = st.checkbox("替换现有训练数据", value=True, key="snapshot_replace")
+                if st.button("导入快照", key="import_snapshot"):
+                    import_path = resolve_data_path(snapshot_path)
+                    if import_path and not os.path.isfile(import_path):
+                        st.error(f"文件不存在: {import_path}")
+                    elif import_path:
+                        with st.spinner("正在导入..."):
+                            counts = training_manager.import_snapshot(import_path, replace_existing)
+                        if counts is not None:
+                            st.success(f"✅ 导入完成！新增 {counts['new']} 条，已存在 {counts['unchanged']} 条")
+
     # 快速训练区域
     st.markdown("---")
     st.markdown("#### ⚡ 快速训练")
@@ -1511,6 +2751,9 @@ def main():
         st.session_state.db_manager = IntelligentDBAssistant()
     if 'priority_databases' not in st.session_state:
         st.session_state.priority_databases = set()
+    if 'rewrite_stats' not in st.session_state:
+        # SQL改写规则的效果统计：规则 -> {'fired', 'rows_before', 'rows_after'}
+        st.session_state.rewrite_stats = {}
 
     db_manager = st.session_state.db_manager
 
@@ -1560,6 +2803,12 @@ def main():
                 st.success(f"已设置 {len(selected_priority_dbs)} 个优先数据库")
 
         # 一键训练所有数据库
+        incremental_training = st.checkbox("仅训练有变化的表", value=True,
+                                           help="根据表结构校验和跳过未变化的表，并清理已删除表的训练数据")
+        shard_dedup = st.checkbox("同结构库只训练一次", value=True,
+                                  help="表结构完全相同的数据库（分片）只训练一个代表库，查询时再映射到具体的库")
+        background_training = st.checkbox("后台运行", value=False,
+                                          help="在后台任务中训练，刷新页面不会中断，可随时取消或从检查点恢复")
         if st.button("🎯 一键训练所有数据库", type="primary", use_container_width=True):
             if 'db_info' not in st.session_state or st.session_state.db_info is None:
                 st.warning("请先发现数据库")
@@ -1575,35 +2824,75 @@ def main():
                 # 设置优先数据库
                 query_generator.set_priority_databases(st.session_state.priority_databases)
 
-                with st.spinner("正在训练所有数据库表结构（优先数据库会优先训练）..."):
-                    training_result = query_generator.train_all_databases(
-                        db_manager, host, st.session_state.db_info
+                if background_training:
+                    job_id = get_job_registry().submit(
+                        'train_all_databases',
+                        {
+                            'host': host,
+                            'databases': sorted(st.session_state.db_info['databases']),
+                            'incremental': incremental_training,
+                            'shard_dedup': shard_dedup,
+                            'priority_databases': sorted(st.session_state.priority_databases)
+                        },
+                        query_generator=query_generator,
+                        db_manager=db_manager,
+                        db_info=st.session_state.db_info
                     )
+                    st.info(f"已提交后台训练任务 {job_id}")
+                else:
+                    with st.spinner("正在训练所有数据库表结构（优先数据库会优先训练）..."):
+                        training_result = query_generator.train_all_databases(
+                            db_manager, host, st.session_state.db_info,
+                            incremental=incremental_training,
+                            shard_dedup=shard_dedup
+                        )
 
-                st.session_state.training_result = training_result
-
-                if training_result['success']:
-                    # 显示统计
-                    priority_count = len(st.session_state.priority_databases)
-                    normal_count = training_result['databases_trained'] - priority_count
-
-                    st.success("✅ 训练完成!")
-
-                    col_train1, col_train2 = st.columns(2)
-                    with col_train1:
-                        st.metric("总训练数据库", training_result['databases_trained'])
-                        st.caption(f"优先: {priority_count} | 普通: {normal_count}")
-                    with col_train2:
-                        st.metric("训练表", training_result['tables_trained'])
-
-                    st.info(f"训练耗时: {training_result['training_time']:.1f}秒")
+                    st.session_state.training_result = training_result
+
+                    if training_result['success']:
+                        # 显示统计
+                        priority_count = len(st.session_state.priority_databases)
+                        normal_count = training_result['databases_trained'] - priority_count
+
+                        st.success("✅ 训练完成!")
+
+                        col_train1, col_train2 = st.columns(2)
+                        with col_train1:
+                            st.metric("总训练数据库", training_result['databases_trained'])
+                            st.caption(f"优先: {priority_count} | 普通: {normal_count}")
+                        with col_train2:
+                            st.metric("训练表", training_result['tables_trained'])
+                            st.caption(f"未变化跳过: {training_result.get('tables_skipped', 0)} | "
+                                       f"已删除清理: {training_result.get('tables_retired', 0)}")
+
+                        if training_result.get('shard_families'):
+                            st.caption(f"分片族: {training_result['shard_families']} 个 | "
+                                       f"共享训练的库: {training_result['databases_shared']} 个"
+                                       f"（{training_result['tables_shared']} 个表）")
+
+                        st.info(f"训练耗时: {training_result['training_time']:.1f}秒")
+                        dedup = training_result.get('dedup', {})
+                        st.caption(f"新增 {dedup.get('new', 0)} | 更新 {dedup.get('updated', 0)} | 未变化 {dedup.get('unchanged', 0)}")
+
+                        if training_result['errors']:
+                            with st.expander("⚠️ 查看错误详情"):
+                                for error in training_result['errors'][:5]:
+                                    st.error(error)
+                    else:
+                        st.error("训练失败")
 
-                    if training_result['errors']:
-                        with st.expander("⚠️ 查看错误详情"):
-                            for error in training_result['errors'][:5]:
-                                st.error(error)
-                else:
-                    st.error("训练失败")
+        # 后台训练任务
+        job_registry = get_job_registry()
+        if job_registry.list_jobs('train_all_databases') and vn:
+            st.markdown("#### 🗂️ 后台训练任务")
+            if st.session_state.query_generator is None:
+                st.session_state.query_generator = EnhancedSmartQueryGenerator(vn)
+            show_job_panel(
+                job_registry, 'train_all_databases',
+                {'query_generator': st.session_state.query_generator, 'db_manager': db_manager,
+                 'db_info': st.session_state.db_info},
+                key_prefix="train_job"
+            )
 
         # 显示当前状态
         st.markdown("---")
@@ -1628,6 +2917,15 @@ def main():
             st.write("**已训练**: 未训练")
             st.write("**训练状态**: ❌ 未训练")
 
+        # LLM 限流队列
+        limiter_stats = get_llm_client().limiter.get_stats()
+        queue_depth = limiter_stats['queue_by_priority']
+        st.write(f"**LLM队列**: 交互 {queue_depth.get(PRIORITY_INTERACTIVE, 0)} | 批量 {queue_depth.get(PRIORITY_BATCH, 0)}")
+        for priority, label in [(PRIORITY_INTERACTIVE, "交互"), (PRIORITY_BATCH, "批量")]:
+            wait_stats = limiter_stats['by_priority'].get(priority)
+            if wait_stats:
+                st.caption(f"{label}等待: 平均 {wait_stats['avg_wait']:.2f}秒 / 最长 {wait_stats['max_wait']:.2f}秒（{wait_stats['granted']}次）")
+
     # 主界面 - 创建标签页
     tab1, tab2 = st.tabs(["💬 智能查询", "🎓 手动训练"])
 
@@ -1676,6 +2974,13 @@ def main():
         with col_opt3:
             show_sql = st.checkbox("显示原始SQL", value=True)
             explain_query = st.checkbox("解释查询", value=False)
+            stream_output = st.checkbox("流式输出", value=True, help="边生成边显示SQL，解析到完整语句后立即停止")
+            optimize_sql = st.checkbox("优化SQL", value=True,
+                                       help="执行前改写SQL：日期函数条件改为范围、删除计数查询中多余的排序、"
+                                            "LIMIT下推到子查询，改写不改变查询结果")
+            narrow_columns = st.checkbox("只返回问题要求的字段", value=False,
+                                         help="单表 SELECT * 改为主键和问题要求输出的字段，"
+                                              "执行前在每个目标库上用 EXPLAIN 校验")
 
         # 执行查询按钮
         if st.button("🚀 开始智能查询", type="primary", use_container_width=True) and user_query:
@@ -1691,8 +2996,18 @@ def main():
             db_info = st.session_state.db_info
 
             # 步骤1: 智能生成查询
+            stream_placeholder = st.empty()
+
+            def render_stream(text):
+                stream_placeholder.code(text, language="sql")
+
             with st.spinner("🔍 正在分析查询需求..."):
-                query_result = query_generator.generate_smart_query(user_query, db_info)
+                query_result = query_generator.generate_smart_query(
+                    user_query, db_info,
+                    on_token=render_stream if stream_output else None
+                )
+
+            stream_placeholder.empty()
 
             if not query_result['success']:
                 st.error(f"生成查询失败: {query_result.get('error', '未知错误')}")
@@ -1702,8 +3017,45 @@ def main():
             match_type = query_result.get('match_type', 'unknown')
             if match_type == 'exact_table':
                 st.success("🎯 已精确匹配到表名!")
-            elif match_type == 'vanna_generated':
+            elif match_type == 'fuzzy_table':
+                table_matches = [
+                    match
+                    for db_data in query_result['relevant_info']['databases'].values()
+                    for table_info in db_data['tables'].values()
+                    for match in table_info['matches']
+                ]
+                st.success(f"🔎 已模糊匹配到表名：{table_matches[0]}" if table_matches else "🔎 已模糊匹配到表名")
+            if query_result.get('intents'):
+                intent_names = {'filter': '条件过滤', 'date_range': '日期范围', 'group_count': '分组计数',
+                                'distinct': '去重取值', 'top_n': '前N名', 'count': '计数', 'describe': '表结构',
+                                'select': '预览数据'}
+                st.caption("规则识别的意图（未调用大模型）: " +
+                           "、".join(intent_names.get(intent, intent) for intent in query_result['intents']))
+            if match_type == 'vanna_generated':
                 st.info("🤖 使用Vanna智能生成")
+                if hasattr(vn, 'get_prefix_cache_stats'):
+                    cache_stats = vn.get_prefix_cache_stats()
+                    st.caption(
+                        f"提示词前缀: {query_result.get('prompt_prefix_hash')} | "
+                        f"前缀复用率: {cache_stats['repeat_rate']:.0%} | "
+                        f"缓存命中token: {cache_stats['cached_tokens']}/{cache_stats['prompt_tokens']}"
+                    )
+                index_score = query_result.get('index_score')
+                if index_score and (index_score['indexed'] or index_score['unindexed'] or index_score['wrapped']):
+                    index_note = f"索引命中: {index_score['score']:.0%}（候选SQL {query_result.get('sql_candidates', 1)} 个）"
+                    if index_score['unindexed']:
+                        index_note += f" | 无索引字段: {', '.join(index_score['unindexed'])}"
+                    if index_score['wrapped']:
+                        index_note += f" | 被函数包裹的字段: {', '.join(index_score['wrapped'])}"
+                    st.caption(index_note)
+
+            shard_family = query_result.get('shard_family')
+            if shard_family:
+                if shard_family['target'] != shard_family['representative']:
+                    st.caption(f"🧩 已将 {shard_family['representative']} 上训练的SQL映射到分片 {shard_family['target']}")
+                else:
+                    st.caption(f"🧩 {shard_family['target']} 属于 {shard_family['members']} 个同结构分片，"
+                               f"在问题中写明库名即可在指定分片上执行")
 
             # 显示相关信息
             if show_relevant and query_result['relevant_info']['total_matches'] > 0:
@@ -1733,7 +3085,19 @@ def main():
                 else:
                     sql += f" LIMIT {limit_results}"
 
+            # 改写SQL，记录生效的规则
+            original_sql = sql
+            rewrite_rules = []
+            enabled_rules = (list(SAFE_REWRITE_RULES) if optimize_sql else []) + (['select_columns'] if narrow_columns else [])
+            if enabled_rules:
+                default_db = (query_result.get('used_databases') or [None])[0]
+                sql, rewrite_rules = rewrite_sql(sql, user_query, db_info, default_db, rules=enabled_rules)
+
             st.markdown(f'<div class="sql-container">{sql}</div>', unsafe_allow_html=True)
+            if rewrite_rules:
+                st.caption("🛠️ SQL改写: " + "、".join(REWRITE_RULES[rule] for rule in rewrite_rules))
+                with st.expander("查看改写前的SQL"):
+                    st.code(original_sql, language="sql")
 
             # 执行查询
             if action == "生成并执行":
@@ -1741,14 +3105,9 @@ def main():
                     # 确定查询的数据库
                     databases_to_query = query_result.get('used_databases', [])
 
-                    # 如果没有指定数据库，从SQL中提取
+                    # 如果没有指定数据库，从SQL引用的表解析
                     if not databases_to_query:
-                        # 从SQL中提取数据库名
-                        pattern = r'`?(\w+)`?\.`?(\w+)`?'
-                        matches = re.findall(pattern, sql)
-                        for db_match, _ in matches:
-                            if db_match in db_info.get('databases', {}):
-                                databases_to_query.append(db_match)
+                        databases_to_query = query_generator._analyze_sql_databases(sql, db_info)
 
                     # 如果还是没有，在所有数据库中尝试
                     if not databases_to_query:
@@ -1757,6 +3116,30 @@ def main():
                         else:
                             databases_to_query = list(db_info['databases'].keys())[:3]
 
+                    # 在每个目标库上用 EXPLAIN 对比改写前后的预估扫描行数；任一库上改写后的SQL无法执行时退回原SQL
+                    if rewrite_rules:
+                        checks = db_manager.explain_many(
+                            host, [(db, statement) for db in databases_to_query for statement in (original_sql, sql)]
+                        )
+                        pairs = list(zip(checks[0::2], checks[1::2]))
+                        broken = [(db, after) for db, (before, after) in zip(databases_to_query, pairs)
+                                  if after['valid'] is False and before['valid']]
+                        if broken:
+                            db, after = broken[0]
+                            st.warning(f"⚠️ 改写后的SQL在 {db} 上校验失败，使用原SQL执行: {after['error']}")
+                            sql = original_sql
+                        elif all(before['estimated_rows'] is not None and after['estimated_rows'] is not None
+                                 for before, after in pairs):
+                            rows_before = sum(before['estimated_rows'] for before, _ in pairs)
+                            rows_after = sum(after['estimated_rows'] for _, after in pairs)
+                            st.caption(f"预估扫描行数: {rows_before} → {rows_after}")
+                            for rule in rewrite_rules:
+                                stats = st.session_state.rewrite_stats.setdefault(
+                                    rule, {'fired': 0, 'rows_before': 0, 'rows_after': 0})
+                                stats['fired'] += 1
+                                stats['rows_before'] += rows_before
+                                stats['rows_after'] += rows_after
+
                     all_results = {}
                     errors = []
 
@@ -1824,6 +3207,20 @@ def main():
                     else:
                         st.info("ℹ️ 查询成功，但未找到匹配的数据")
 
+        # SQL改写效果统计
+        if st.session_state.rewrite_stats:
+            with st.expander("📉 SQL改写效果"):
+                st.dataframe(pd.DataFrame([
+                    {
+                        '规则': REWRITE_RULES.get(rule, rule),
+                        '生效次数': stats['fired'],
+                        '改写前预估行数': stats['rows_before'],
+                        '改写后预估行数': stats['rows_after'],
+                        '减少': f"{1 - stats['rows_after'] / stats['rows_before']:.0%}" if stats['rows_before'] else "-"
+                    }
+                    for rule, stats in st.session_state.rewrite_stats.items()
+                ]), use_container_width=True)
+
         # 数据库概览
         if st.session_state.db_info is not None:
             st.markdown("---")
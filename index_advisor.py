@@ -0,0 +1,147 @@
+from typing import Dict, List, Optional
+
+from sql_tables import extract_tables, tokenize
+
+# 进入这些子句后，出现的字段分别视为 过滤 / 排序 条件
+FILTER_CLAUSES = {'WHERE', 'ON', 'HAVING'}
+CLAUSE_STARTS = {'SELECT', 'FROM', 'WHERE', 'ON', 'HAVING', 'ORDER', 'GROUP', 'LIMIT', 'SET', 'VALUES',
+                 'UNION', 'JOIN', 'STRAIGHT_JOIN', 'USING', 'WINDOW', 'INTO'}
+# 不破坏索引使用的括号（子查询、IN 列表、普通分组）
+_PLAIN_PAREN = {'', 'IN', 'EXISTS', 'AND', 'OR', 'NOT', 'ON', 'WHERE', 'HAVING', 'BY'}
+
+MAX_INDEXES_IN_DOC = 8
+
+
+def format_indexes(indexes: List[Dict]) -> str:
+    """索引的紧凑描述，如 "PRIMARY(id), UNIQUE uk_no(order_no), idx_user(user_id,created_at)" """
+    parts = []
+    for index in indexes[:MAX_INDEXES_IN_DOC]:
+        prefix = 'UNIQUE ' if index.get('unique') and index.get('name') != 'PRIMARY' else ''
+        parts.append(f"{prefix}{index.get('name')}({','.join(index.get('columns', []))})")
+    if len(indexes) > MAX_INDEXES_IN_DOC:
+        parts.append(f"等共 {len(indexes)} 个索引")
+    return ', '.join(parts)
+
+
+def usable_index_columns(indexes: List[Dict], filter_columns: set) -> set:
+    """可以走索引的字段（小写）：索引的第一个字段，以及前面各字段都出现在过滤条件中的后续字段"""
+    usable = set()
+    for index in indexes or []:
+        for column in index.get('columns', []):
+            usable.add(column.lower())
+            if column.lower() not in filter_columns:
+                break
+    return usable
+
+
+def _predicate_columns(sql: str, tables: Dict[str, Dict]) -> List[Dict]:
+    """找出 WHERE / ON / HAVING 和 ORDER BY 中用到的字段
+
+    tables 为 {表名或别名(小写): 表信息}。字段被函数包裹（如 YEAR(col)）时记为 wrapped，
+    这种写法无法使用该字段上的索引。
+    """
+    tokens = tokenize(sql)
+    column_owner = {}
+    for info in tables.values():
+        for column in info['columns']:
+            column_owner.setdefault(column.lower(), info)
+
+    clause = None
+    paren_stack = []
+    found = []
+    position = 0
+    while position < len(tokens):
+        token = tokens[position]
+        previous = tokens[position - 1] if position else None
+
+        if token.kind == 'symbol' and token.text == '(':
+            opener = previous.upper if previous is not None and previous.kind == 'word' else ''
+            paren_stack.append((clause, opener not in _PLAIN_PAREN))
+            position += 1
+            continue
+        if token.kind == 'symbol' and token.text == ')':
+            if paren_stack:
+                clause = paren_stack.pop()[0]
+            position += 1
+            continue
+        if token.kind == 'word' and token.upper in CLAUSE_STARTS:
+            if token.upper == 'ORDER' and position + 1 < len(tokens) and tokens[position + 1].upper == 'BY':
+                clause = 'order'
+            elif token.upper in FILTER_CLAUSES:
+                clause = 'filter'
+            else:
+                clause = None
+            position += 1
+            continue
+
+        if clause and token.kind in ('word', 'quoted') and not (position + 1 < len(tokens)
+                                                                 and tokens[position + 1].text == '('):
+            # 取 [表.]字段 的最后两段
+            parts = [token.text]
+            while (position + 2 < len(tokens) and tokens[position + 1].text == '.'
+                   and tokens[position + 2].kind in ('word', 'quoted')):
+                parts.append(tokens[position + 2].text)
+                position += 2
+            column = parts[-1].lower()
+            owner = tables.get(parts[-2].lower()) if len(parts) >= 2 else column_owner.get(column)
+            if owner is not None and column in {name.lower() for name in owner['columns']}:
+                wrapped = any(is_function for _, is_function in paren_stack)
+                found.append({'table': owner, 'column': column, 'clause': clause, 'wrapped': wrapped})
+        position += 1
+    return found
+
+
+def score_index_usage(sql: str, db_info: Dict, default_database: Optional[str] = None,
+                      min_rows: int = 0) -> Dict:
+    """评估 SQL 的过滤和排序条件能否使用索引
+
+    返回 {'score', 'indexed', 'unindexed', 'wrapped'}：score 为按表估算行数加权的
+    索引命中比例（没有过滤和排序条件时为 1.0），后三项为 "表.字段" 列表。
+    只统计估算行数不低于 min_rows 的表。
+    """
+    databases = (db_info or {}).get('databases', {})
+    tables = {}
+    for reference in extract_tables(sql):
+        database = reference.database or default_database
+        info = databases.get(database, {}).get('tables_info', {}).get(reference.table)
+        if not info or not info.get('columns'):
+            continue
+        entry = {
+            'name': reference.table,
+            'columns': info['columns'],
+            'rows': info.get('rows') or 0,
+            'indexes': info.get('indexes') or [],
+        }
+        tables.setdefault(reference.table.lower(), entry)
+        if reference.alias:
+            tables[reference.alias.lower()] = entry
+
+    predicates = _predicate_columns(sql, tables)
+    usable = {}
+    for entry in tables.values():
+        filter_columns = {item['column'] for item in predicates
+                          if item['table'] is entry and item['clause'] == 'filter' and not item['wrapped']}
+        usable[id(entry)] = usable_index_columns(entry['indexes'], filter_columns)
+
+    result = {'score': 1.0, 'indexed': [], 'unindexed': [], 'wrapped': []}
+    total = backed = 0.0
+    for item in predicates:
+        table = item['table']
+        if table['rows'] < min_rows:
+            continue
+        name = f"{table['name']}.{item['column']}"
+        weight = max(table['rows'], 1)
+        total += weight
+        if item['wrapped']:
+            bucket = 'wrapped'
+        elif item['column'] in usable[id(table)]:
+            bucket = 'indexed'
+            backed += weight
+        else:
+            bucket = 'unindexed'
+        if name not in result[bucket]:
+            result[bucket].append(name)
+
+    if total:
+        result['score'] = backed / total
+    return result
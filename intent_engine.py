@@ -0,0 +1,288 @@
+import re
+from datetime import date, timedelta
+from typing import Dict, List, Optional, Tuple
+
+# 字段类型分类（按 DESCRIBE 返回的类型前缀判断）
+NUMERIC_TYPES = ('tinyint', 'smallint', 'mediumint', 'int', 'integer', 'bigint',
+                 'decimal', 'numeric', 'float', 'double', 'real', 'bit')
+DATE_TYPES = ('date', 'datetime', 'timestamp')
+
+# 意图关键词
+DESCRIBE_WORDS = ['详情', '结构', '字段', '列', 'desc', 'describe']
+COUNT_WORDS = ['数量', '计数', 'count', '多少']
+DISTINCT_WORDS = ['去重', '不同的', '不重复', '有哪些', '哪几种', '枚举', 'distinct']
+GROUP_PATTERNS = [r'按(?:照)?\s*{col}', r'每(?:个|种|一)?\s*{col}', r'各(?:个)?\s*{col}', r'group\s+by\s+{col}',
+                  r'{col}\s*(?:的\s*)?分组', r'{col}\s*(?:的\s*)?分布']
+TOP_DESC_WORDS = ['最大', '最高', '最多', '最贵', '最新', '最晚', '降序', 'top']
+TOP_ASC_WORDS = ['最小', '最低', '最少', '最便宜', '最早', '升序']
+
+# 过滤条件的比较词，较长的写法放在前面
+OPERATORS = [
+    ('>=', '>='), ('<=', '<='), ('!=', '!='), ('<>', '!='),
+    ('不小于', '>='), ('至少', '>='), ('不低于', '>='),
+    ('不大于', '<='), ('不超过', '<='), ('至多', '<='), ('不高于', '<='),
+    ('不等于', '!='), ('不是', '!='), ('不为', '!='),
+    ('大于', '>'), ('超过', '>'), ('高于', '>'), ('多于', '>'), ('>', '>'),
+    ('小于', '<'), ('低于', '<'), ('少于', '<'), ('不到', '<'), ('<', '<'),
+    ('包含', 'LIKE'), ('含有', 'LIKE'), ('like', 'LIKE'),
+    ('等于', '='), ('==', '='), ('=', '='), ('是', '='), ('为', '='),
+]
+# 常量中出现疑问词时是在提问而不是过滤，如 "status是什么意思"，交给大模型处理
+QUESTION_WORDS = ('什么', '多少', '哪', '几', '吗', '呢', '啥', '怎', '如何', '为何', '意思')
+# 表示空值的常量，生成 IS NULL / IS NOT NULL
+NULL_WORDS = {'空', '空值', 'null', 'none'}
+
+CHINESE_DIGITS = {'零': 0, '一': 1, '二': 2, '两': 2, '三': 3, '四': 4, '五': 5,
+                  '六': 6, '七': 7, '八': 8, '九': 9}
+
+DEFAULT_LIMIT = 10
+MAX_LIMIT = 1000
+
+
+def _type_kind(column_type) -> str:
+    """字段类型分类：number / date / text"""
+    if isinstance(column_type, bytes):
+        column_type = column_type.decode('utf-8', 'replace')
+    base = re.split(r'[\s(]', str(column_type or '').lower(), 1)[0]
+    if base in NUMERIC_TYPES:
+        return 'number'
+    if base in DATE_TYPES:
+        return 'date'
+    return 'text'
+
+
+def _parse_number(text: str) -> Optional[int]:
+    """解析阿拉伯数字或一百以内的中文数字"""
+    if not text:
+        return None
+    if text.isdigit():
+        return int(text)
+    if '十' in text:
+        tens, _, ones = text.partition('十')
+        value = (CHINESE_DIGITS.get(tens, 1) if tens else 1) * 10
+        return value + CHINESE_DIGITS.get(ones, 0) if ones else value
+    return CHINESE_DIGITS.get(text)
+
+
+def _quote_literal(value: str) -> str:
+    return "'" + value.replace('\\', '\\\\').replace("'", "''") + "'"
+
+
+def _month_start(day: date, offset: int = 0) -> date:
+    month_index = day.year * 12 + day.month - 1 + offset
+    return date(month_index // 12, month_index % 12 + 1, 1)
+
+
+def parse_date_range(question: str, today: date = None) -> Optional[Tuple[date, date]]:
+    """从问题中解析日期范围，返回左闭右开的 (开始, 结束)"""
+    today = today or date.today()
+
+    match = re.search(r'(\d{4})[-/.年](\d{1,2})[-/.月](\d{1,2})日?\s*(?:到|至|~|－|—)\s*'
+                      r'(\d{4})[-/.年](\d{1,2})[-/.月](\d{1,2})日?', question)
+    if match:
+        values = [int(value) for value in match.groups()]
+        try:
+            return date(*values[:3]), date(*values[3:]) + timedelta(days=1)
+        except ValueError:
+            return None
+
+    match = re.search(r'(?:最近|近|过去)\s*(\d+|[一二两三四五六七八九十]+)\s*(天|日|周|个?月)', question)
+    if match:
+        count = _parse_number(match.group(1)) or 1
+        unit = match.group(2)
+        if unit in ('天', '日'):
+            start = today - timedelta(days=count - 1)
+        elif unit == '周':
+            start = today - timedelta(weeks=count)
+        else:
+            start = _month_start(today, -count).replace(day=min(today.day, 28))
+        return start, today + timedelta(days=1)
+
+    if '今天' in question or '今日' in question:
+        return today, today + timedelta(days=1)
+    if '昨天' in question or '昨日' in question:
+        return today - timedelta(days=1), today
+    if '本周' in question or '这周' in question:
+        start = today - timedelta(days=today.weekday())
+        return start, start + timedelta(days=7)
+    if '上周' in question:
+        start = today - timedelta(days=today.weekday() + 7)
+        return start, start + timedelta(days=7)
+    if '本月' in question or '这个月' in question:
+        return _month_start(today), _month_start(today, 1)
+    if '上月' in question or '上个月' in question:
+        return _month_start(today, -1), _month_start(today)
+    if '今年' in question:
+        return date(today.year, 1, 1), date(today.year + 1, 1, 1)
+    if '去年' in question:
+        return date(today.year - 1, 1, 1), date(today.year, 1, 1)
+
+    match = re.search(r'(\d{4})\s*年\s*(\d{1,2})\s*月', question)
+    if match:
+        year, month = int(match.group(1)), int(match.group(2))
+        if 1 <= month <= 12:
+            start = date(year, month, 1)
+            return start, _month_start(start, 1)
+    match = re.search(r'(\d{4})\s*年', question)
+    if match:
+        year = int(match.group(1))
+        return date(year, 1, 1), date(year + 1, 1, 1)
+    return None
+
+
+class IntentEngine:
+    """基于规则的单表查询意图识别
+
+    识别过滤条件、前 N 名、分组计数、日期范围、去重取值、计数、表结构等常见问题，
+    根据目录中的字段类型填充字段和常量，生成 SQL 时不需要调用大模型。
+    """
+
+    def __init__(self, db_name: str, table_name: str, columns: List[str], column_types: List[str]):
+        self.db_name = db_name
+        self.table_name = table_name
+        self.columns = list(columns or [])
+        self.kinds = {column: _type_kind(column_type)
+                      for column, column_type in zip(self.columns, list(column_types or []) + [''] * len(self.columns))}
+
+    def _table(self) -> str:
+        return f"`{self.db_name}`.`{self.table_name}`"
+
+    def _mentioned_columns(self, question: str) -> List[Tuple[int, int, str]]:
+        """问题中提到的字段 (起始, 结束, 字段)，按出现顺序，重叠时取较长的字段名"""
+        folded = question.lower()
+        found = []
+        for column in sorted(self.columns, key=len, reverse=True):
+            if column.lower() == self.table_name.lower():
+                continue
+            pattern = rf'(?<![A-Za-z0-9_]){re.escape(column.lower())}(?![A-Za-z0-9_])'
+            for match in re.finditer(pattern, folded):
+                if not any(start < match.end() and match.start() < end for start, end, _ in found):
+                    found.append((match.start(), match.end(), column))
+        return sorted(found)
+
+    def _parse_filters(self, question: str, mentions) -> Optional[List[str]]:
+        """字段 + 比较词 + 常量，例如 "status 等于 paid"、"amount大于100"、"status为空"
+
+        常量中含有疑问词时（如 "status是什么意思"）返回 None，表示规则无法回答。
+        """
+        filters = []
+        for _, end, column in mentions:
+            rest = question[end:].lstrip()
+            rest = re.sub(r'^(?:字段|列)\s*', '', rest)
+            for word, operator in OPERATORS:
+                if not rest.lower().startswith(word):
+                    continue
+                literal = rest[len(word):].lstrip()
+                quoted = re.match(r"'([^']*)'|\"([^\"]*)\"|“([^”]*)”|‘([^’]*)’", literal)
+                match = (quoted
+                         or re.match(r'(-?\d+(?:\.\d+)?)', literal)
+                         or re.match(r'([A-Za-z0-9_\-.@:]+|[^\s，,。；;的和且并]+)', literal))
+                if not match:
+                    break
+                value = next(group for group in match.groups() if group is not None)
+                # 常量本身或紧跟在常量后面的是疑问词，如 "status是什么意思"、"status是paid吗"
+                following = literal[match.end():].lstrip()
+                if ((not quoted and any(question_word in value for question_word in QUESTION_WORDS))
+                        or following.startswith(QUESTION_WORDS)):
+                    return None
+                kind = self.kinds.get(column, 'text')
+                if not quoted and value.lower() in NULL_WORDS:
+                    if operator in ('=', '!='):
+                        filters.append(f"`{column}` IS {'NOT ' if operator == '!=' else ''}NULL")
+                    break
+                if kind == 'number':
+                    if not re.fullmatch(r'-?\d+(?:\.\d+)?', value) or operator == 'LIKE':
+                        break
+                    filters.append(f"`{column}` {operator} {value}")
+                elif operator == 'LIKE':
+                    filters.append(f"`{column}` LIKE {_quote_literal('%' + value + '%')}")
+                else:
+                    filters.append(f"`{column}` {operator} {_quote_literal(value)}")
+                break
+        return filters
+
+    def _date_filter(self, question: str, mentions) -> Optional[str]:
+        """日期范围条件：优先使用问题中提到的日期字段，其次使用名称像创建时间的日期字段"""
+        date_range = parse_date_range(question)
+        date_columns = [column for column in self.columns if self.kinds.get(column) == 'date']
+        if not date_range or not date_columns:
+            return None
+
+        mentioned = [column for _, _, column in mentions if column in date_columns]
+        if mentioned:
+            column = mentioned[0]
+        else:
+            preferred = [column for column in date_columns if re.search(r'creat|add|insert', column, re.IGNORECASE)]
+            column = (preferred or date_columns)[0]
+        start, end = date_range
+        return f"`{column}` >= '{start.isoformat()}' AND `{column}` < '{end.isoformat()}'"
+
+    def _group_column(self, question: str) -> Optional[str]:
+        for column in sorted(self.columns, key=len, reverse=True):
+            col = re.escape(column)
+            for pattern in GROUP_PATTERNS:
+                if re.search(pattern.format(col=col) + r'(?![A-Za-z0-9_])', question, re.IGNORECASE):
+                    return column
+        return None
+
+    def _top_n(self, question: str, mentions) -> Optional[Tuple[str, str, int]]:
+        """前 N 名：返回 (排序字段, 方向, N)"""
+        folded = question.lower()
+        match = re.search(r'(?:前|top\s*)(\d+|[一二两三四五六七八九十]+)', folded)
+        descending = any(word in folded for word in TOP_DESC_WORDS)
+        ascending = any(word in folded for word in TOP_ASC_WORDS)
+        if not (match or descending or ascending):
+            return None
+
+        numeric = [column for _, _, column in mentions if self.kinds.get(column) in ('number', 'date')]
+        limit = _parse_number(match.group(1)) if match else None
+        limit = min(limit or DEFAULT_LIMIT, MAX_LIMIT)
+        if not numeric:
+            # 只有 "前N条" 没有排序字段时只限制行数
+            return (None, None, limit) if match else None
+        return numeric[0], 'ASC' if ascending and not descending else 'DESC', limit
+
+    def build(self, question: str) -> Optional[Dict]:
+        """识别意图并生成 SQL，返回 {'sql', 'intents'}；规则无法可靠回答时返回 None"""
+        folded = question.lower()
+        mentions = self._mentioned_columns(question)
+        intents = []
+
+        conditions = self._parse_filters(question, mentions)
+        if conditions is None:
+            return None
+        if conditions:
+            intents.append('filter')
+        date_condition = self._date_filter(question, mentions)
+        if date_condition:
+            conditions.append(date_condition)
+            intents.append('date_range')
+        where = f" WHERE {' AND '.join(conditions)}" if conditions else ""
+
+        group_column = self._group_column(question)
+        if group_column:
+            intents.append('group_count')
+            sql = (f"SELECT `{group_column}`, COUNT(*) AS `count` FROM {self._table()}{where} "
+                   f"GROUP BY `{group_column}` ORDER BY `count` DESC LIMIT 100;")
+            return {'sql': sql, 'intents': intents}
+
+        if mentions and any(word in folded for word in DISTINCT_WORDS):
+            column = mentions[0][2]
+            intents.append('distinct')
+            return {'sql': f"SELECT DISTINCT `{column}` FROM {self._table()}{where} LIMIT 100;", 'intents': intents}
+
+        top = self._top_n(question, mentions)
+        if top:
+            column, direction, limit = top
+            order = f" ORDER BY `{column}` {direction}" if column else ""
+            intents.append('top_n')
+            return {'sql': f"SELECT * FROM {self._table()}{where}{order} LIMIT {limit};", 'intents': intents}
+
+        if any(word in folded for word in COUNT_WORDS):
+            intents.append('count')
+            return {'sql': f"SELECT COUNT(*) FROM {self._table()}{where};", 'intents': intents}
+
+        if not conditions and any(word in folded for word in DESCRIBE_WORDS):
+            return {'sql': f"DESCRIBE {self._table()};", 'intents': ['describe']}
+
+        return {'sql': f"SELECT * FROM {self._table()}{where} LIMIT {DEFAULT_LIMIT};", 'intents': intents or ['select']}
@@ -0,0 +1,228 @@
+import os
+import json
+import time
+import uuid
+import tempfile
+import threading
+from datetime import datetime
+from typing import Callable, Dict, List, Optional
+
+# 任务状态
+PENDING = 'pending'
+RUNNING = 'running'
+COMPLETED = 'completed'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+INTERRUPTED = 'interrupted'
+
+# 可以从检查点恢复的状态
+RESUMABLE = (FAILED, CANCELLED, INTERRUPTED)
+
+
+class JobCancelled(Exception):
+    """任务被取消"""
+
+
+class Job:
+    """一个后台任务：参数、进度、检查点和结果都会持久化到任务目录下的 JSON 文件"""
+
+    def __init__(self, registry, kind: str, params: dict, job_id: str = None):
+        self.registry = registry
+        self.id = job_id or uuid.uuid4().hex[:12]
+        self.kind = kind
+        self.params = params
+        self.status = PENDING
+        self.done = 0
+        self.total = 0
+        self.message = ""
+        self.result = None
+        self.error = None
+        self.checkpoint_data = {}
+        self.created_at = datetime.now().isoformat()
+        self.updated_at = self.created_at
+        self.cancel_event = threading.Event()
+        self._lock = threading.Lock()
+        # 串行化同一任务的落盘，保证最后写入的是最新状态
+        self._save_lock = threading.Lock()
+        self._last_saved = 0.0
+
+    def report(self, done: int, total: int, message: str = ""):
+        """更新进度（每秒最多落盘一次）"""
+        with self._lock:
+            self.done, self.total, self.message = done, total, message
+            self.updated_at = datetime.now().isoformat()
+        if time.monotonic() - self._last_saved >= 1.0:
+            self.save()
+
+    def checkpoint(self, force: bool = False, **data):
+        """合并检查点数据并落盘（每秒最多一次，force=True 时立即保存）
+
+        任务结束时总会保存一次；进程崩溃时最多丢失最近一秒的检查点，恢复后这部分会重新执行。
+        """
+        with self._lock:
+            self.checkpoint_data.update(data)
+        if force or time.monotonic() - self._last_saved >= 1.0:
+            self.save()
+
+    def check_cancelled(self):
+        """在任务循环中调用，收到取消请求时抛出 JobCancelled"""
+        if self.cancel_event.is_set():
+            raise JobCancelled()
+
+    def snapshot(self) -> dict:
+        """任务的当前状态（可序列化）"""
+        with self._lock:
+            return {
+                'id': self.id,
+                'kind': self.kind,
+                'params': self.params,
+                'status': self.status,
+                'done': self.done,
+                'total': self.total,
+                'progress': self.done / self.total if self.total else 0.0,
+                'message': self.message,
+                'result': self.result,
+                'error': self.error,
+                'checkpoint': self.checkpoint_data,
+                'created_at': self.created_at,
+                'updated_at': self.updated_at,
+            }
+
+    def save(self):
+        with self._save_lock:
+            self._last_saved = time.monotonic()
+            self.registry.save(self)
+
+    @classmethod
+    def from_snapshot(cls, registry, data: dict) -> 'Job':
+        job = cls(registry, data['kind'], data.get('params') or {}, data['id'])
+        job.status = data.get('status', PENDING)
+        job.done = data.get('done', 0)
+        job.total = data.get('total', 0)
+        job.message = data.get('message', "")
+        job.result = data.get('result')
+        job.error = data.get('error')
+        job.checkpoint_data = data.get('checkpoint') or {}
+        job.created_at = data.get('created_at', job.created_at)
+        job.updated_at = data.get('updated_at', job.updated_at)
+        return job
+
+
+class JobRegistry:
+    """后台任务注册表
+
+    任务在独立线程中运行，不依赖 Streamlit 的脚本执行，页面刷新或重跑不会中断任务。
+    任务状态保存在 state_dir 下，进程崩溃后未完成的任务标记为 interrupted，可以从检查点恢复。
+    处理函数签名为 handler(job, **params, **runtime)：params 会持久化，应只保存引用等小数据，
+    runtime 是不可序列化或较大的运行时对象（如数据库管理器），恢复时需要重新提供。
+    """
+
+    def __init__(self, state_dir: str = '.jobs'):
+        self.state_dir = state_dir
+        self.handlers: Dict[str, Callable] = {}
+        self.jobs: Dict[str, Job] = {}
+        self._lock = threading.Lock()
+        os.makedirs(state_dir, exist_ok=True)
+        self._recover()
+
+    def _path(self, job_id: str) -> str:
+        return os.path.join(self.state_dir, f"{job_id}.json")
+
+    def _recover(self):
+        """加载历史任务，上次进程退出时仍在运行的任务标记为 interrupted"""
+        for name in os.listdir(self.state_dir):
+            if name.endswith('.tmp'):
+                # 上次写入中途退出留下的临时文件
+                try:
+                    os.remove(os.path.join(self.state_dir, name))
+                except OSError:
+                    pass
+                continue
+            if not name.endswith('.json'):
+                continue
+            try:
+                with open(os.path.join(self.state_dir, name), encoding='utf-8') as f:
+                    job = Job.from_snapshot(self, json.load(f))
+            except (OSError, ValueError, KeyError) as e:
+                print(f"加载任务失败 {name}: {str(e)}")
+                continue
+            if job.status in (PENDING, RUNNING):
+                job.status = INTERRUPTED
+                job.save()
+            self.jobs[job.id] = job
+
+    def save(self, job: Job):
+        """原子地写入任务状态文件（每次写入使用独立的临时文件）"""
+        fd, tmp_path = tempfile.mkstemp(dir=self.state_dir, prefix=f"{job.id}.", suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(job.snapshot(), f, ensure_ascii=False, default=str)
+            os.replace(tmp_path, self._path(job.id))
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+
+    def register_handler(self, kind: str, handler: Callable):
+        """注册任务类型的处理函数"""
+        self.handlers[kind] = handler
+
+    def submit(self, kind: str, params: dict = None, **runtime) -> str:
+        """提交新任务，返回任务 ID"""
+        if kind not in self.handlers:
+            raise ValueError(f"未注册的任务类型: {kind}")
+        job = Job(self, kind, params or {})
+        job.status = RUNNING
+        with self._lock:
+            self.jobs[job.id] = job
+        self._start(job, runtime)
+        return job.id
+
+    def resume(self, job_id: str, **runtime) -> bool:
+        """从检查点恢复失败、取消或中断的任务"""
+        # 检查和设置状态在同一把锁内，重复点击恢复时只会启动一个线程
+        with self._lock:
+            job = self.jobs.get(job_id)
+            if job is None or job.status not in RESUMABLE:
+                return False
+            job.status = RUNNING
+            job.cancel_event.clear()
+            job.error = None
+        self._start(job, runtime)
+        return True
+
+    def cancel(self, job_id: str) -> bool:
+        """请求取消任务，任务会在下一个检查点停止"""
+        job = self.jobs.get(job_id)
+        if job is None or job.status not in (PENDING, RUNNING):
+            return False
+        job.cancel_event.set()
+        return True
+
+    def get(self, job_id: str) -> Optional[dict]:
+        """获取任务进度"""
+        job = self.jobs.get(job_id)
+        return job.snapshot() if job else None
+
+    def list_jobs(self, kind: str = None) -> List[dict]:
+        """按创建时间倒序列出任务"""
+        jobs = [job.snapshot() for job in self.jobs.values() if kind is None or job.kind == kind]
+        return sorted(jobs, key=lambda job: job['created_at'], reverse=True)
+
+    def _start(self, job: Job, runtime: dict):
+        """保存 RUNNING 状态并启动任务线程（调用方已在锁内设置状态）"""
+        job.save()
+        thread = threading.Thread(target=self._run, args=(job, runtime), daemon=True, name=f"job-{job.id}")
+        thread.start()
+
+    def _run(self, job: Job, runtime: dict):
+        try:
+            # 运行时对象优先于持久化的参数（兼容旧任务参数中保存的同名字段）
+            job.result = self.handlers[job.kind](job, **{**job.params, **runtime})
+            job.status = COMPLETED
+        except JobCancelled:
+            job.status = CANCELLED
+        except Exception as e:
+            job.error = str(e)
+            job.status = FAILED
+        job.updated_at = datetime.now().isoformat()
+        job.save()
@@ -0,0 +1,413 @@
+import os
+import time
+import heapq
+import itertools
+import random
+import asyncio
+import threading
+import weakref
+from collections import defaultdict
+from typing import Optional
+
+import httpx
+from dotenv import load_dotenv
+from openai import OpenAI, AsyncOpenAI, APIStatusError, APIConnectionError
+
+# 加载环境变量
+load_dotenv()
+
+
+# 调度优先级：数值越小越先执行，交互式查询优先于批量任务
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BATCH = 10
+
+
+class LLMDeadlineExceeded(TimeoutError):
+    """调用超过了截止时间"""
+
+
+def estimate_tokens(messages: list) -> int:
+    """粗略估算消息的 token 数：中文约 1 字 1 token，其余约 4 字符 1 token"""
+    total = 0
+    for message in messages:
+        content = message.get('content') or ''
+        non_ascii = sum(1 for ch in content if ord(ch) > 127)
+        total += non_ascii + (len(content) - non_ascii) // 4 + 4
+    return total
+
+
+class _TokenBucket:
+    """按分钟配额匀速补充的令牌桶"""
+
+    def __init__(self, per_minute: float):
+        self.capacity = float(per_minute)
+        self.rate = self.capacity / 60.0
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float) -> float:
+        """还需要等待多久才能取出 amount 个令牌（超过容量的请求按满桶处理）"""
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.rate
+
+
+class RateLimiter:
+    """进程级的 LLM 限流器
+
+    同时限制每分钟请求数（RPM）和每分钟 token 数（TPM）。等待中的调用按优先级排队，
+    只有队首可以取令牌，因此后到的交互式查询会排在已排队的批量任务之前。
+    """
+
+    def __init__(self, requests_per_minute: float = 600, tokens_per_minute: float = 1000000):
+        self._requests = _TokenBucket(requests_per_minute)
+        self._tokens = _TokenBucket(tokens_per_minute)
+        self._condition = threading.Condition()
+        self._queue = []
+        self._counter = itertools.count()
+        self._stats = defaultdict(lambda: {'granted': 0, 'total_wait': 0.0, 'max_wait': 0.0})
+
+    def acquire(self, tokens: int, priority: int = PRIORITY_INTERACTIVE, timeout: float = None) -> float:
+        """排队获取 1 个请求配额和 tokens 个 token 配额，返回等待的秒数，超时返回 None"""
+        start = time.monotonic()
+        entry = (priority, next(self._counter))
+
+        with self._condition:
+            heapq.heappush(self._queue, entry)
+            try:
+                while True:
+                    now = time.monotonic()
+                    if timeout is not None and now - start >= timeout:
+                        return None
+
+                    wait = None
+                    if self._queue[0] == entry:
+                        self._requests.refill(now)
+                        self._tokens.refill(now)
+                        wait = max(self._requests.wait_time(1), self._tokens.wait_time(tokens))
+                        if wait == 0:
+                            self._requests.tokens -= 1
+                            self._tokens.tokens -= min(tokens, self._tokens.capacity)
+                            break
+
+                    if timeout is not None:
+                        remaining = timeout - (now - start)
+                        wait = remaining if wait is None else min(wait, remaining)
+                    self._condition.wait(wait)
+            finally:
+                self._queue.remove(entry)
+                heapq.heapify(self._queue)
+                self._condition.notify_all()
+
+            waited = time.monotonic() - start
+            stats = self._stats[priority]
+            stats['granted'] += 1
+            stats['total_wait'] += waited
+            stats['max_wait'] = max(stats['max_wait'], waited)
+            return waited
+
+    def settle(self, estimated: int, actual: int):
+        """用实际消耗的 token 数修正预估值"""
+        with self._condition:
+            self._tokens.refill(time.monotonic())
+            self._tokens.tokens = min(self._tokens.capacity, self._tokens.tokens + estimated - actual)
+            self._condition.notify_all()
+
+    def get_stats(self) -> dict:
+        """获取排队深度与各优先级的等待时间统计"""
+        with self._condition:
+            depth = defaultdict(int)
+            for priority, _ in self._queue:
+                depth[priority] += 1
+
+            by_priority = {}
+            for priority, stats in self._stats.items():
+                by_priority[priority] = {
+                    'granted': stats['granted'],
+                    'avg_wait': stats['total_wait'] / stats['granted'] if stats['granted'] else 0.0,
+                    'max_wait': stats['max_wait'],
+                }
+
+            return {
+                'queue_depth': len(self._queue),
+                'queue_by_priority': dict(depth),
+                'by_priority': by_priority,
+            }
+
+
+def _is_retryable(error: Exception) -> bool:
+    """429 / 5xx / 连接错误（含超时）可以重试"""
+    if isinstance(error, APIStatusError):
+        return error.status_code == 429 or error.status_code >= 500
+    return isinstance(error, APIConnectionError)
+
+
+def _retry_after(error: Exception) -> Optional[float]:
+    """读取服务端返回的 Retry-After 秒数"""
+    response = getattr(error, 'response', None)
+    if response is None:
+        return None
+    try:
+        return float(response.headers.get('retry-after'))
+    except (TypeError, ValueError):
+        return None
+
+
+class _GuardedStream:
+    """包装流式响应，在读完或关闭时释放并发名额，并按实际输出修正限流器
+
+    服务端在最后一块返回用量时使用实际值；提前关闭拿不到用量时按已收到的输出估算。
+    """
+
+    def __init__(self, stream, release, settle, prompt_tokens: int):
+        self._stream = stream
+        self._release = release
+        self._settle = settle
+        self._prompt_tokens = prompt_tokens
+        self._text = []
+        self._usage = None
+        self._released = False
+
+    def __iter__(self):
+        try:
+            for chunk in self._stream:
+                usage = getattr(chunk, 'usage', None)
+                if usage is not None and getattr(usage, 'total_tokens', None):
+                    self._usage = usage.total_tokens
+                for choice in getattr(chunk, 'choices', None) or []:
+                    content = getattr(getattr(choice, 'delta', None), 'content', None)
+                    if content:
+                        self._text.append(content)
+                yield chunk
+        finally:
+            self.close()
+
+    def close(self):
+        if not self._released:
+            self._released = True
+            try:
+                self._stream.close()
+            finally:
+                self._release()
+                actual = self._usage
+                if actual is None:
+                    actual = self._prompt_tokens + estimate_tokens([{'content': ''.join(self._text)}])
+                self._settle(actual)
+
+
+class LLMClient:
+    """共享的大模型客户端
+
+    - 同步与异步客户端各自复用一个 keep-alive 连接池
+    - 所有调用共用一个进程级并发信号量和 RPM/TPM 限流器（按优先级排队）
+    - 429 / 5xx / 网络错误按带抖动的指数退避重试
+    - 每次调用可以指定截止时间（deadline，单位秒，包含所有重试）
+    """
+
+    def __init__(self, api_key: str = None, base_url: str = None, model: str = None,
+                 max_concurrency: int = 8, max_connections: int = 20, timeout: float = 60.0,
+                 max_retries: int = 4, backoff_base: float = 0.5, backoff_max: float = 20.0,
+                 default_deadline: float = 120.0, limiter: RateLimiter = None):
+        self.api_key = api_key or os.getenv('ALI_API_KEY')
+        self.base_url = base_url or os.getenv('ALI_BASE_URL')
+        self.model = model or os.getenv('VANNA_MODEL', 'qwen-plus')
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.default_deadline = default_deadline
+        self.max_concurrency = max_concurrency
+        self.limiter = limiter or RateLimiter()
+
+        self._limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_connections,
+            keepalive_expiry=60.0
+        )
+        # 重试由本类负责，关闭 SDK 自带的重试
+        self.client = OpenAI(
+            api_key=self.api_key,
+            base_url=self.base_url,
+            max_retries=0,
+            http_client=httpx.Client(limits=self._limits, timeout=timeout)
+        )
+        # httpx.AsyncClient 绑定事件循环，每个循环各持有一个连接池
+        self._async_clients = weakref.WeakKeyDictionary()
+        self._async_lock = threading.Lock()
+        self._semaphore = threading.BoundedSemaphore(max_concurrency)
+
+    def _get_async_client(self) -> AsyncOpenAI:
+        """获取当前事件循环对应的异步客户端"""
+        loop = asyncio.get_running_loop()
+        with self._async_lock:
+            client = self._async_clients.get(loop)
+            if client is None:
+                client = AsyncOpenAI(
+                    api_key=self.api_key,
+                    base_url=self.base_url,
+                    max_retries=0,
+                    http_client=httpx.AsyncClient(limits=self._limits, timeout=self.timeout)
+                )
+                self._async_clients[loop] = client
+            return client
+
+    def _remaining(self, deadline_at: float) -> float:
+        remaining = deadline_at - time.monotonic()
+        if remaining <= 0:
+            raise LLMDeadlineExceeded("LLM 调用超过截止时间")
+        return remaining
+
+    def _acquire_quota(self, messages: list, params: dict, priority: int, deadline_at: float) -> int:
+        """从限流器获取本次调用的配额，返回预估的 token 数"""
+        estimated = estimate_tokens(messages) + int(params.get('max_tokens') or 0)
+        waited = self.limiter.acquire(estimated, priority, timeout=self._remaining(deadline_at))
+        if waited is None:
+            raise LLMDeadlineExceeded("等待 LLM 限流配额超时")
+        return estimated
+
+    def _settle_quota(self, estimated: int, response):
+        """按响应中的实际用量修正限流器"""
+        usage = getattr(response, 'usage', None)
+        if usage is not None and getattr(usage, 'total_tokens', None):
+            self.limiter.settle(estimated, usage.total_tokens)
+
+    def _backoff(self, attempt: int, error: Exception) -> float:
+        """计算第 attempt 次重试前的等待时间（full jitter）"""
+        delay = random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+        retry_after = _retry_after(error)
+        if retry_after is not None:
+            delay = max(delay, retry_after)
+        return delay
+
+    def chat(self, messages: list, model: str = None, deadline: float = None,
+             priority: int = PRIORITY_INTERACTIVE, **params):
+        """同步调用 chat.completions.create，stream=True 时返回可迭代的流"""
+        deadline_at = time.monotonic() + (deadline or self.default_deadline)
+        stream = params.get('stream', False)
+        if stream:
+            # 请求在最后一块中返回用量，用于修正限流器
+            params.setdefault('stream_options', {'include_usage': True})
+        attempt = 0
+
+        while True:
+            estimated = self._acquire_quota(messages, params, priority, deadline_at)
+            if not self._semaphore.acquire(timeout=self._remaining(deadline_at)):
+                raise LLMDeadlineExceeded("等待 LLM 并发名额超时")
+
+            try:
+                response = self.client.chat.completions.create(
+                    model=model or self.model,
+                    messages=messages,
+                    timeout=min(self.timeout, self._remaining(deadline_at)),
+                    **params
+                )
+            except Exception as e:
+                self._semaphore.release()
+                if not _is_retryable(e) or attempt >= self.max_retries:
+                    raise
+                delay = self._backoff(attempt, e)
+                if delay >= self._remaining(deadline_at):
+                    raise LLMDeadlineExceeded(f"LLM 调用超过截止时间: {e}") from e
+                time.sleep(delay)
+                attempt += 1
+                continue
+
+            if stream:
+                return _GuardedStream(response, self._semaphore.release,
+                                      lambda actual: self.limiter.settle(estimated, actual),
+                                      estimate_tokens(messages))
+
+            self._semaphore.release()
+            self._settle_quota(estimated, response)
+            return response
+
+    @staticmethod
+    async def _acquire_in_executor(acquire, undo):
+        """在线程池中执行阻塞的获取操作，不阻塞事件循环
+
+        任务被取消时线程仍会继续等待，之后拿到的配额或名额通过 undo(结果) 归还，不会泄漏。
+        """
+        future = asyncio.get_running_loop().run_in_executor(None, acquire)
+        try:
+            return await asyncio.shield(future)
+        except asyncio.CancelledError:
+            def rollback(done):
+                if not done.cancelled() and done.exception() is None:
+                    undo(done.result())
+            future.add_done_callback(rollback)
+            raise
+
+    async def achat(self, messages: list, model: str = None, deadline: float = None,
+                    priority: int = PRIORITY_INTERACTIVE, **params):
+        """异步调用 chat.completions.create（不支持 stream）
+
+        与同步调用共用并发信号量和限流器；任务在任何阶段被取消都会归还已获取的名额。
+        """
+        if params.get('stream'):
+            raise ValueError("achat 不支持 stream，请使用 chat")
+        deadline_at = time.monotonic() + (deadline or self.default_deadline)
+        client = self._get_async_client()
+        attempt = 0
+
+        while True:
+            estimated = await self._acquire_in_executor(
+                lambda: self._acquire_quota(messages, params, priority, deadline_at),
+                lambda granted: self.limiter.settle(granted, 0)
+            )
+            acquired = await self._acquire_in_executor(
+                lambda: self._semaphore.acquire(timeout=self._remaining(deadline_at)),
+                lambda granted: granted and self._semaphore.release()
+            )
+            if not acquired:
+                self.limiter.settle(estimated, 0)
+                raise LLMDeadlineExceeded("等待 LLM 并发名额超时")
+
+            try:
+                response = await client.chat.completions.create(
+                    model=model or self.model,
+                    messages=messages,
+                    timeout=min(self.timeout, self._remaining(deadline_at)),
+                    **params
+                )
+            except Exception as e:
+                if not _is_retryable(e) or attempt >= self.max_retries:
+                    raise
+                delay = self._backoff(attempt, e)
+                if delay >= self._remaining(deadline_at):
+                    raise LLMDeadlineExceeded(f"LLM 调用超过截止时间: {e}") from e
+            else:
+                self._settle_quota(estimated, response)
+                return response
+            finally:
+                self._semaphore.release()
+
+            await asyncio.sleep(delay)
+            attempt += 1
+
+
+_shared_client = None
+_shared_lock = threading.Lock()
+
+
+def get_llm_client() -> LLMClient:
+    """获取进程内共享的 LLM 客户端"""
+    global _shared_client
+    with _shared_lock:
+        if _shared_client is None:
+            _shared_client = LLMClient(
+                max_concurrency=int(os.getenv('LLM_MAX_CONCURRENCY', 8)),
+                max_connections=int(os.getenv('LLM_MAX_CONNECTIONS', 20)),
+                timeout=float(os.getenv('LLM_TIMEOUT', 60)),
+                max_retries=int(os.getenv('LLM_MAX_RETRIES', 4)),
+                default_deadline=float(os.getenv('LLM_DEADLINE', 120)),
+                limiter=RateLimiter(
+                    requests_per_minute=float(os.getenv('LLM_RPM', 600)),
+                    tokens_per_minute=float(os.getenv('LLM_TPM', 1000000)),
+                ),
+            )
+        return _shared_client
@@ -0,0 +1,398 @@
+import re
+from datetime import date, timedelta
+from typing import Dict, List, Optional, Tuple
+
+from sql_tables import TOKEN_PATTERN, tokenize
+
+# 规则名称 -> 说明
+REWRITE_RULES = {
+    'sargable_date': '日期函数条件改写为范围条件',
+    'count_order_by': '删除计数查询中多余的ORDER BY',
+    'limit_pushdown': 'LIMIT下推到子查询',
+    'select_columns': 'SELECT * 改为问题需要的字段',
+}
+# 结果不变的改写，默认启用；select_columns 会改变返回的列，需要显式开启
+SAFE_REWRITE_RULES = ('sargable_date', 'count_order_by', 'limit_pushdown')
+
+AGGREGATE_FUNCTIONS = {'COUNT', 'SUM', 'AVG', 'MIN', 'MAX', 'GROUP_CONCAT', 'STD', 'STDDEV', 'VARIANCE',
+                       'BIT_AND', 'BIT_OR', 'BIT_XOR', 'JSON_ARRAYAGG', 'JSON_OBJECTAGG'}
+# 集合运算，出现后同一层的 ORDER BY / LIMIT 作用于整个集合运算的结果
+SET_OPERATORS = {'UNION', 'EXCEPT', 'INTERSECT'}
+# 查询块中结束 ORDER BY 子句的关键字
+ORDER_BY_ENDS = {'LIMIT', 'FOR', 'LOCK', 'INTO'} | SET_OPERATORS
+
+_IDENT = r'(?:`[^`]+`|[A-Za-z_][\w$]*)'
+_COLUMN = rf'{_IDENT}(?:\s*\.\s*{_IDENT}){{0,2}}'
+# 条件必须是完整的布尔项：后面紧跟 AND / OR / ) / 子句关键字或结尾，不能是 + - * / 等运算符
+_END = (r'(?=\s*(?:$|[);]|\b(?:AND|OR|XOR|ORDER|GROUP|LIMIT|HAVING|WINDOW|UNION|EXCEPT|INTERSECT'
+        r'|THEN|ELSE|END)\b))')
+# 条件前面必须是 ( / WHERE / AND / OR / NOT 等，如 1 + YEAR(col) = 2024 不改写
+_START = re.compile(r'(?:^|\(|\b(?:WHERE|ON|HAVING|AND|OR|XOR|NOT|WHEN))$', re.IGNORECASE)
+_YEAR_MONTH = re.compile(
+    rf'\bYEAR\s*\(\s*(?P<col>{_COLUMN})\s*\)\s*=\s*(?P<year>\d{{4}})\s+AND\s+'
+    rf'MONTH\s*\(\s*(?P=col)\s*\)\s*=\s*(?P<month>\d{{1,2}}){_END}', re.IGNORECASE)
+_YEAR_BETWEEN = re.compile(
+    rf'\bYEAR\s*\(\s*(?P<col>{_COLUMN})\s*\)\s*BETWEEN\s+(?P<start>\d{{4}})\s+AND\s+(?P<end>\d{{4}}){_END}',
+    re.IGNORECASE)
+_YEAR = re.compile(rf'\bYEAR\s*\(\s*(?P<col>{_COLUMN})\s*\)\s*=\s*(?P<year>\d{{4}}){_END}', re.IGNORECASE)
+_DATE = re.compile(rf"\bDATE\s*\(\s*(?P<col>{_COLUMN})\s*\)\s*=\s*'(?P<day>\d{{4}}-\d{{2}}-\d{{2}})'{_END}",
+                   re.IGNORECASE)
+
+
+def _date_range(column: str, start: date, end: date) -> str:
+    return f"({column} >= '{start.isoformat()}' AND {column} < '{end.isoformat()}')"
+
+
+def _next_month(day: date) -> date:
+    return date(day.year + day.month // 12, day.month % 12 + 1, 1)
+
+
+def _protected_spans(sql: str) -> List[Tuple[int, int]]:
+    """字符串和注释的位置，改写时跳过其中的内容"""
+    return [match.span() for match in TOKEN_PATTERN.finditer(sql)
+            if match.lastgroup in ('string', 'comment')]
+
+
+def _rewrite_sargable_dates(sql: str, context: Dict) -> Optional[str]:
+    """YEAR(col) = 2024、DATE(col) = '2024-01-01' 等改写为 col >= ... AND col < ...，以便使用字段上的索引"""
+    def year_month(match):
+        year, month = int(match.group('year')), int(match.group('month'))
+        if not 1 <= month <= 12:
+            return None
+        start = date(year, month, 1)
+        return _date_range(match.group('col'), start, _next_month(start))
+
+    def year_between(match):
+        start, end = int(match.group('start')), int(match.group('end'))
+        if start > end:
+            return None
+        return _date_range(match.group('col'), date(start, 1, 1), date(end + 1, 1, 1))
+
+    def year(match):
+        value = int(match.group('year'))
+        return _date_range(match.group('col'), date(value, 1, 1), date(value + 1, 1, 1))
+
+    def day(match):
+        try:
+            value = date.fromisoformat(match.group('day'))
+        except ValueError:
+            return None
+        return _date_range(match.group('col'), value, value + timedelta(days=1))
+
+    changed = False
+    for pattern, replace in ((_YEAR_MONTH, year_month), (_YEAR_BETWEEN, year_between), (_YEAR, year), (_DATE, day)):
+        spans = _protected_spans(sql)
+        pieces = []
+        last = 0
+        for match in pattern.finditer(sql):
+            if any(start <= match.start() < end for start, end in spans):
+                continue
+            # 关键字最长 6 个字符，取前 8 个字符足以判断，并保留关键字前面的一个字符
+            if not _START.search(sql[:match.start()].rstrip()[-8:]):
+                continue
+            replacement = replace(match)
+            if replacement is None:
+                continue
+            pieces.append(sql[last:match.start()])
+            pieces.append(replacement)
+            last = match.end()
+        if pieces:
+            sql = ''.join(pieces) + sql[last:]
+            changed = True
+    return sql if changed else None
+
+
+def _depths(tokens) -> List[int]:
+    """每个词所在的括号深度（括号本身记为外层深度）"""
+    depths = []
+    depth = 0
+    for token in tokens:
+        if token.kind == 'symbol' and token.text == ')':
+            depth -= 1
+        depths.append(depth)
+        if token.kind == 'symbol' and token.text == '(':
+            depth += 1
+    return depths
+
+
+def _query_blocks(tokens, depths) -> List[Dict]:
+    """按 SELECT 切分查询块，返回 {'start', 'end', 'depth', 'from'}，end 为块后第一个词的位置"""
+    blocks = []
+    for index, token in enumerate(tokens):
+        if token.upper != 'SELECT' or token.kind != 'word':
+            continue
+        depth = depths[index]
+        end = index + 1
+        from_index = None
+        while end < len(tokens):
+            if depths[end] < depth:
+                break
+            if depths[end] == depth:
+                if tokens[end].text == ';' or tokens[end].upper in SET_OPERATORS:
+                    break
+                if tokens[end].upper == 'FROM' and from_index is None:
+                    from_index = end
+            end += 1
+        blocks.append({'start': index, 'end': end, 'depth': depth, 'from': from_index})
+    return blocks
+
+
+def _level_tokens(tokens, depths, block, start=None, end=None) -> List[int]:
+    """块内与块同一层的词的位置"""
+    start = block['start'] if start is None else start
+    end = block['end'] if end is None else end
+    return [index for index in range(start, end) if depths[index] == block['depth']]
+
+
+def _is_single_row_aggregate(tokens, depths, block) -> bool:
+    """没有 GROUP BY、选择列表中有聚合函数且没有窗口函数：结果只有一行"""
+    if block['from'] is None:
+        return False
+    level = _level_tokens(tokens, depths, block)
+    if any(tokens[index].upper == 'GROUP' for index in level):
+        return False
+    select_list = range(block['start'] + 1, block['from'])
+    if any(tokens[index].upper == 'OVER' for index in select_list):
+        return False
+    return any(tokens[index].upper in AGGREGATE_FUNCTIONS and depths[index] == block['depth']
+               and index + 1 < len(tokens) and tokens[index + 1].text == '(' for index in select_list)
+
+
+def _order_by_span(sql: str, tokens, depths, block) -> Optional[Tuple[int, int]]:
+    """块内同一层 ORDER BY 子句在 SQL 中的位置"""
+    level = _level_tokens(tokens, depths, block)
+    for position, index in enumerate(level):
+        if tokens[index].upper == 'ORDER' and index + 1 < len(tokens) and tokens[index + 1].upper == 'BY':
+            end = len(sql) if block['end'] >= len(tokens) else tokens[block['end']].start
+            for later in level[position + 1:]:
+                if tokens[later].upper in ORDER_BY_ENDS:
+                    end = tokens[later].start
+                    break
+            return tokens[index].start, end
+    return None
+
+
+def _cut(sql: str, start: int, end: int) -> str:
+    """删除 sql[start:end]，并整理两侧的空白"""
+    head, tail = sql[:start].rstrip(), sql[end:].lstrip()
+    if not tail or tail[0] in ';)':
+        return head + tail
+    return f"{head} {tail}"
+
+
+def _has_limit(tokens, depths, block) -> bool:
+    return any(tokens[index].upper == 'LIMIT' for index in _level_tokens(tokens, depths, block))
+
+
+def _in_set_operation(tokens, depths, block) -> bool:
+    """块是否属于 UNION / EXCEPT / INTERSECT：检查块所在括号（或整条语句）内同一层的词"""
+    depth = block['depth']
+    start = block['start']
+    while start > 0 and depths[start - 1] >= depth:
+        start -= 1
+    end = block['end']
+    while end < len(tokens) and depths[end] >= depth:
+        end += 1
+    return any(depths[index] == depth and tokens[index].upper in SET_OPERATORS and tokens[index].kind == 'word'
+               for index in range(start, end))
+
+
+def _rewrite_count_order_by(sql: str, context: Dict) -> Optional[str]:
+    """只返回一行的聚合查询（如 COUNT）中的 ORDER BY 没有作用，其 FROM 中派生表不带 LIMIT 的 ORDER BY 同样多余
+
+    集合运算中的 ORDER BY 作用于整个结果，不删除：
+
+    >>> _rewrite_count_order_by("SELECT COUNT(*) FROM a ORDER BY id", {})
+    'SELECT COUNT(*) FROM a'
+    >>> _rewrite_count_order_by(
+    ...     "SELECT COUNT(*) FROM a UNION ALL SELECT COUNT(*) FROM b ORDER BY 1 DESC LIMIT 1", {}) is None
+    True
+    """
+    tokens = tokenize(sql)
+    depths = _depths(tokens)
+    blocks = _query_blocks(tokens, depths)
+    for block in blocks:
+        if not _is_single_row_aggregate(tokens, depths, block) or _in_set_operation(tokens, depths, block):
+            continue
+        span = _order_by_span(sql, tokens, depths, block)
+        if span:
+            return _cut(sql, *span)
+
+        # FROM (SELECT ... ORDER BY ...) t
+        for inner in blocks:
+            if (inner['depth'] == block['depth'] + 1 and block['from'] is not None
+                    and block['from'] < inner['start'] < block['end']
+                    and tokens[inner['start'] - 1].text == '(' and tokens[inner['start'] - 2].upper in ('FROM', 'JOIN', 'STRAIGHT_JOIN')
+                    and not _has_limit(tokens, depths, inner)
+                    and not _in_set_operation(tokens, depths, inner)):
+                span = _order_by_span(sql, tokens, depths, inner)
+                if span:
+                    return _cut(sql, *span)
+    return None
+
+
+def _rewrite_limit_pushdown(sql: str, context: Dict) -> Optional[str]:
+    """SELECT 列 FROM (子查询) t LIMIT n：外层只截取行数时，把 LIMIT 下推到子查询，减少派生表物化的行数"""
+    tokens = tokenize(sql)
+    depths = _depths(tokens)
+    blocks = _query_blocks(tokens, depths)
+    if not blocks or blocks[0]['depth'] != 0 or blocks[0]['from'] is None:
+        return None
+    outer = blocks[0]
+    if outer['end'] < len(tokens) and tokens[outer['end']].upper in SET_OPERATORS:
+        return None
+
+    select_list = range(outer['start'] + 1, outer['from'])
+    if any(tokens[index].upper in AGGREGATE_FUNCTIONS | {'DISTINCT', 'OVER', 'SQL_CALC_FOUND_ROWS'}
+           for index in select_list):
+        return None
+
+    open_index = outer['from'] + 1
+    if open_index >= len(tokens) or tokens[open_index].text != '(':
+        return None
+    inner = next((block for block in blocks if block['start'] == open_index + 1), None)
+    if inner is None:
+        return None
+    close_index = next((index for index in range(inner['start'], len(tokens))
+                        if depths[index] == 0 and tokens[index].text == ')'), None)
+    if close_index is None or any(_has_limit(tokens, depths, block) for block in blocks
+                                  if block['depth'] == 1 and open_index < block['start'] < close_index):
+        return None
+
+    # 外层在派生表之后只能有别名和 LIMIT
+    rest = [index for index in range(close_index + 1, outer['end']) if depths[index] == 0]
+    position = 0
+    if position < len(rest) and tokens[rest[position]].upper == 'AS':
+        position += 1
+    if position < len(rest) and tokens[rest[position]].kind in ('word', 'quoted') \
+            and tokens[rest[position]].upper != 'LIMIT':
+        position += 1
+    limit_tokens = [tokens[index] for index in rest[position:]]
+    if not limit_tokens or limit_tokens[0].upper != 'LIMIT':
+        return None
+    values = [token.text for token in limit_tokens[1:]]
+    if len(values) == 1 and values[0].isdigit():
+        rows = int(values[0])
+    elif len(values) == 3 and values[1] == ',' and values[0].isdigit() and values[2].isdigit():
+        rows = int(values[0]) + int(values[2])
+    elif len(values) == 3 and values[1].upper() == 'OFFSET' and values[0].isdigit() and values[2].isdigit():
+        rows = int(values[0]) + int(values[2])
+    else:
+        return None
+
+    close_at = tokens[close_index].start
+    return f"{sql[:close_at].rstrip()} LIMIT {rows}{sql[close_at:]}"
+
+
+def _mentioned_columns(question: str, columns: List[str], table: str) -> List[str]:
+    """问题中提到的字段，按表中字段的顺序"""
+    folded = (question or '').lower()
+    found = []
+    covered = []
+    for column in sorted(columns, key=len, reverse=True):
+        if column.lower() == table.lower():
+            continue
+        for match in re.finditer(rf'(?<![A-Za-z0-9_]){re.escape(column.lower())}(?![A-Za-z0-9_])', folded):
+            if not any(start < match.end() and match.start() < end for start, end in covered):
+                covered.append(match.span())
+                found.append(column)
+                break
+    return [column for column in columns if column in found]
+
+
+def _rewrite_select_columns(sql: str, context: Dict) -> Optional[str]:
+    """单表 SELECT * 改为主键 + 问题要求输出的字段；问题没有要求任何字段时保持不变
+
+    问题中提到、但在 WHERE 中作为过滤条件的字段（如 "status 为 paid 的订单"）不算要求输出的字段。
+    """
+    question = context.get('question')
+    databases = (context.get('db_info') or {}).get('databases', {})
+    if not question or not databases:
+        return None
+
+    tokens = tokenize(sql)
+    depths = _depths(tokens)
+    blocks = _query_blocks(tokens, depths)
+    if not blocks or blocks[0]['depth'] != 0 or blocks[0]['start'] != 0 or blocks[0]['from'] is None:
+        return None
+    outer = blocks[0]
+    if outer['from'] != 2 or tokens[1].text != '*':
+        return None
+
+    # FROM [库.]表 [[AS] 别名]，后面不能再有其他表
+    level = _level_tokens(tokens, depths, outer, start=outer['from'] + 1)
+    names = []
+    position = 0
+    while position < len(level) and tokens[level[position]].kind in ('word', 'quoted'):
+        names.append(tokens[level[position]].text)
+        if position + 1 < len(level) and tokens[level[position + 1]].text == '.':
+            position += 2
+            continue
+        position += 1
+        break
+    if not names or len(names) > 2:
+        return None
+    if position < len(level) and tokens[level[position]].upper == 'AS':
+        position += 2
+    elif position < len(level) and tokens[level[position]].kind in ('word', 'quoted') \
+            and tokens[level[position]].upper not in ('WHERE', 'ORDER', 'LIMIT'):
+        position += 1
+    if position < len(level) and tokens[level[position]].upper not in ('WHERE', 'ORDER', 'LIMIT'):
+        return None
+
+    table = names[-1]
+    database = names[0] if len(names) == 2 else context.get('default_database')
+    info = databases.get(database, {}).get('tables_info', {}).get(table, {})
+    columns = info.get('columns', [])
+    where = next((index for index in level if tokens[index].upper == 'WHERE'), None)
+    filtered = set()
+    if where is not None:
+        filtered = {tokens[index].text.lower() for index in range(where + 1, len(tokens))
+                    if tokens[index].kind in ('word', 'quoted')}
+    mentioned = [column for column in _mentioned_columns(question, columns, table)
+                 if column.lower() not in filtered]
+    if not mentioned:
+        return None
+
+    primary = next((index['columns'] for index in info.get('indexes', []) if index.get('name') == 'PRIMARY'), [])
+    selected = [column for column in primary if column in columns]
+    selected += [column for column in mentioned if column not in selected]
+    if len(selected) >= len(columns):
+        return None
+
+    column_list = ', '.join(f"`{column}`" for column in selected)
+    return f"{sql[:tokens[1].start]}{column_list}{sql[tokens[1].end:]}"
+
+
+# 按顺序执行的改写规则
+_RULES = [
+    ('sargable_date', _rewrite_sargable_dates),
+    ('count_order_by', _rewrite_count_order_by),
+    ('limit_pushdown', _rewrite_limit_pushdown),
+    ('select_columns', _rewrite_select_columns),
+]
+
+
+def rewrite_sql(sql: str, question: str = None, db_info: Dict = None,
+                default_database: str = None, rules=SAFE_REWRITE_RULES) -> Tuple[str, List[str]]:
+    """执行前改写 SQL，返回 (改写后的SQL, 生效的规则名列表)
+
+    rules 为启用的规则名，默认只启用结果不变的 SAFE_REWRITE_RULES；
+    一条规则可以多次生效（如多个派生表），最多重复 10 次。
+    """
+    context = {'question': question, 'db_info': db_info, 'default_database': default_database}
+    fired = []
+    for name, rule in _RULES:
+        if name not in rules:
+            continue
+        for _ in range(10):
+            try:
+                rewritten = rule(sql, context)
+            except (ValueError, IndexError):
+                rewritten = None
+            if not rewritten or rewritten == sql:
+                break
+            sql = rewritten
+            if name not in fired:
+                fired.append(name)
+    return sql, fired
@@ -0,0 +1,119 @@
+import re
+from typing import Optional
+
+# 说明文字之后，以这些关键字（全大写或全小写）或注释开头的行视为 SQL 的开始
+SQL_LINE_START = re.compile(
+    r'(?:SELECT|WITH|SHOW|DESCRIBE|DESC|EXPLAIN|select|with|show|describe|desc|explain)\b|--|/\*|#'
+)
+FENCE = '```'
+
+
+class SqlStreamScanner:
+    """增量扫描模型的流式输出，找出第一条完整的 SQL 语句
+
+    SQL 从第一个代码块（可以出现在任意位置）开始；没有代码块时，从第一行以 SQL 关键字
+    或注释开头的行开始，之前的说明文字不参与引号判断。以代码块结束标记或引号、注释之外的
+    分号作为语句结束。引号和注释的状态保存在扫描器中，每次 feed 只扫描新到的文本。
+    """
+
+    def __init__(self):
+        self.text = ""
+        self.sql = None
+        self._pos = 0          # 下一个待扫描的位置
+        self._start = None     # SQL 开始的位置，None 表示仍在说明文字中
+        self._fenced = False
+        self._state = None     # 所在的引号字符，或 '--'（行注释）、'/*'（块注释）
+
+    def feed(self, delta: str) -> Optional[str]:
+        """追加一段输出，解析出完整的语句后返回它，否则返回 None"""
+        if self.sql is None:
+            self.text += delta
+            if self._start is None:
+                self._find_start()
+            if self._start is not None:
+                self._scan()
+        return self.sql
+
+    def _find_start(self):
+        text = self.text
+        while True:
+            newline = text.find('\n', self._pos)
+            line_end = len(text) if newline == -1 else newline
+            fence = text.find(FENCE, self._pos, line_end)
+            if fence != -1:
+                if newline == -1:
+                    # 等待 ```sql 这一行结束
+                    return
+                self._fenced = True
+                self._start = self._pos = newline + 1
+                return
+            line = text[self._pos:line_end]
+            stripped = line.lstrip()
+            if SQL_LINE_START.match(stripped):
+                self._start = self._pos = self._pos + len(line) - len(stripped)
+                return
+            if newline == -1:
+                # 行还没结束，可能随后出现代码块标记或关键字
+                return
+            self._pos = newline + 1
+
+    def _scan(self):
+        text = self.text
+        i = self._pos
+        while i < len(text):
+            ch = text[i]
+            state = self._state
+            if state in ("'", '"', '`'):
+                if ch == '\\' and state != '`':
+                    if i + 1 >= len(text):
+                        break
+                    i += 2
+                    continue
+                if ch == state:
+                    self._state = None
+            elif state == '--':
+                if ch == '\n':
+                    self._state = None
+            elif state == '/*':
+                if ch == '*':
+                    if i + 1 >= len(text):
+                        break
+                    if text[i + 1] == '/':
+                        self._state = None
+                        i += 2
+                        continue
+            elif self._fenced and ch == '`' and FENCE.startswith(text[i:i + 3]):
+                if len(text) - i < 3:
+                    # 可能是代码块结束标记的一部分
+                    break
+                self.sql = text[self._start:i].strip() or None
+                if self.sql is None:
+                    # 空代码块，继续找下一个
+                    self._fenced = False
+                    self._start = None
+                    self._pos = i + 3
+                    self._find_start()
+                    if self._start is not None:
+                        self._scan()
+                return
+            elif ch in ("'", '"', '`'):
+                self._state = ch
+            elif ch in ('-', '/'):
+                if i + 1 >= len(text):
+                    break
+                if text[i:i + 2] in ('--', '/*'):
+                    self._state = text[i:i + 2]
+                    i += 2
+                    continue
+            elif ch == '#':
+                self._state = '--'
+            elif ch == ';':
+                self.sql = text[self._start:i + 1].strip()
+                return
+            i += 1
+        self._pos = i
+
+
+def extract_complete_sql(text: str) -> Optional[str]:
+    """从（可能未完成的）模型输出中提取第一条完整的 SQL 语句，尚未完整时返回 None"""
+    return SqlStreamScanner().feed(text)
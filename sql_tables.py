@@ -0,0 +1,301 @@
+import re
+from functools import lru_cache
+from typing import List, NamedTuple, Optional, Tuple
+
+# 分词：注释、字符串、反引号标识符、数字、单词、符号
+TOKEN_PATTERN = re.compile(r"""
+    (?P<comment>--[^\n]*|\#[^\n]*|/\*.*?(?:\*/|$))
+  | (?P<string>'(?:[^'\\]|\\.|'')*(?:'|$)|"(?:[^"\\]|\\.|"")*(?:"|$))
+  | (?P<quoted>`(?:[^`]|``)*(?:`|$))
+  | (?P<number>\d+(?:\.\d*)?(?:[eE][-+]?\d+)?|\.\d+(?:[eE][-+]?\d+)?)
+  | (?P<word>[A-Za-z_$@][\w$@]*)
+  | (?P<symbol>[(),;.])
+  | (?P<other>\S)
+""", re.VERBOSE | re.DOTALL)
+
+# 后面紧跟表名的关键字
+TABLE_KEYWORDS = {'FROM', 'JOIN', 'STRAIGHT_JOIN', 'UPDATE', 'INTO', 'TABLE', 'DESCRIBE', 'DESC', 'USING'}
+# 表名列表可以用逗号分隔、可以是派生表的关键字
+TABLE_LIST_KEYWORDS = {'FROM', 'USING'}
+# 连接关键字，后面可以是派生表或括号括起的连接列表
+JOIN_KEYWORDS = {'JOIN', 'STRAIGHT_JOIN'}
+# SELECT 与 STRAIGHT_JOIN 之间可能出现的修饰词；此时 STRAIGHT_JOIN 是优化器提示，不是连接
+SELECT_MODIFIERS = {'SELECT', 'ALL', 'DISTINCT', 'DISTINCTROW', 'HIGH_PRIORITY'}
+# 括号内以这些关键字开头时是子查询，否则是表列表，如 JOIN (b JOIN c ON ...)
+SUBQUERY_STARTS = {'SELECT', 'WITH', 'VALUES', 'TABLE'}
+# 关键字和表名之间可能出现的修饰词
+TABLE_MODIFIERS = {'LOW_PRIORITY', 'HIGH_PRIORITY', 'DELAYED', 'IGNORE', 'QUICK', 'ONLY', 'LATERAL'}
+# SHOW 语句中 FROM / IN 后面是表名的类型，其余（SHOW TABLES FROM db 等）后面是库名
+SHOW_TABLE_OBJECTS = {'COLUMNS', 'FIELDS', 'INDEX', 'INDEXES', 'KEYS'}
+# 括号内出现 FROM 但不是表引用的函数，如 EXTRACT(YEAR FROM col)
+FROM_FUNCTIONS = {'EXTRACT', 'TRIM', 'SUBSTRING', 'SUBSTR', 'POSITION', 'OVERLAY'}
+# 表名后面不可能是别名的关键字
+CLAUSE_KEYWORDS = {
+    'WHERE', 'GROUP', 'ORDER', 'HAVING', 'LIMIT', 'ON', 'USING', 'JOIN', 'INNER', 'LEFT', 'RIGHT', 'CROSS',
+    'FULL', 'OUTER', 'NATURAL', 'STRAIGHT_JOIN', 'UNION', 'EXCEPT', 'INTERSECT', 'SET', 'VALUES', 'VALUE',
+    'SELECT', 'WINDOW', 'FOR', 'LOCK', 'PARTITION', 'USE', 'IGNORE', 'FORCE', 'INTO', 'AS', 'WITH',
+    'LATERAL', 'OUTFILE', 'DUMPFILE', 'IF', 'LIKE',
+}
+
+# 函数栈中标记派生表的括号；派生表结束后可能还有别名和逗号分隔的下一张表
+_DERIVED_TABLE = '(derived)'
+
+
+class TableReference(NamedTuple):
+    """SQL 中引用的一张表；database 为 None 表示未限定库名，使用执行时的默认库"""
+    database: Optional[str]
+    table: str
+    alias: Optional[str]
+
+
+class _Token(NamedTuple):
+    kind: str       # word / quoted / symbol / string / number / other
+    text: str       # 标识符去掉反引号后的文本
+    upper: str      # 未加引号的单词为大写，其余与 text 相同
+    start: int = 0  # 在原 SQL 中的起止位置
+    end: int = 0
+
+
+def tokenize(sql: str) -> List[_Token]:
+    """切分 SQL，去掉注释；反引号标识符去掉引号"""
+    tokens = []
+    for match in TOKEN_PATTERN.finditer(sql or ''):
+        kind = match.lastgroup
+        text = match.group()
+        if kind == 'comment':
+            continue
+        if kind == 'quoted':
+            text = text[1:-1].replace('``', '`') if text.endswith('`') and len(text) > 1 else text[1:]
+            tokens.append(_Token(kind, text, text, match.start(), match.end()))
+        elif kind == 'word':
+            tokens.append(_Token(kind, text, text.upper(), match.start(), match.end()))
+        else:
+            tokens.append(_Token(kind, text, text, match.start(), match.end()))
+    return tokens
+
+
+def _is_identifier(token: _Token) -> bool:
+    return token.kind == 'quoted' or (token.kind == 'word' and not token.text.startswith('@'))
+
+
+def _skip_parens(tokens: List[_Token], position: int) -> int:
+    """position 指向 '('，返回匹配的 ')' 之后的位置"""
+    depth = 0
+    while position < len(tokens):
+        if tokens[position].text == '(' and tokens[position].kind == 'symbol':
+            depth += 1
+        elif tokens[position].text == ')' and tokens[position].kind == 'symbol':
+            depth -= 1
+            if depth == 0:
+                return position + 1
+        position += 1
+    return position
+
+
+def _scope_end(tokens: List[_Token], position: int) -> int:
+    """从 position 起到所在括号结束或语句结束（顶层 ';'）的位置"""
+    depth = 0
+    while position < len(tokens):
+        token = tokens[position]
+        if token.kind == 'symbol':
+            if token.text == '(':
+                depth += 1
+            elif token.text == ')':
+                depth -= 1
+                if depth < 0:
+                    return position
+            elif token.text == ';' and depth == 0:
+                return position
+        position += 1
+    return position
+
+
+def _cte_scopes(tokens: List[_Token]) -> List[Tuple[str, int, int]]:
+    """WITH [RECURSIVE] name [(cols)] AS (...), ... 中定义的公用表表达式
+
+    返回 (小写名称, 起始位置, 结束位置)：名称只在 WITH 所在的语句或括号内有效。
+    """
+    scopes = []
+    for index, token in enumerate(tokens):
+        if token.kind != 'word' or token.upper != 'WITH':
+            continue
+        end = _scope_end(tokens, index)
+        names = set()
+        position = index + 1
+        if position < len(tokens) and tokens[position].upper == 'RECURSIVE':
+            position += 1
+        while position < len(tokens) and _is_identifier(tokens[position]):
+            name = tokens[position].text
+            position += 1
+            if position < len(tokens) and tokens[position].text == '(':
+                position = _skip_parens(tokens, position)
+            if position >= len(tokens) or tokens[position].upper != 'AS':
+                break
+            position += 1
+            if position >= len(tokens) or tokens[position].text != '(':
+                break
+            names.add(name.lower())
+            position = _skip_parens(tokens, position)
+            if position < len(tokens) and tokens[position].text == ',':
+                position += 1
+            else:
+                break
+        scopes.extend((name, index, end) for name in names)
+    return scopes
+
+
+def _read_table_factor(tokens: List[_Token], position: int,
+                       allow_function: bool) -> Tuple[Optional[TableReference], int]:
+    """从 position 读取 [库.]表 [[AS] 别名]，返回 (表引用, 下一个位置)；不是表名时返回 (None, position)"""
+    if position >= len(tokens) or not _is_identifier(tokens[position]):
+        return None, position
+    if tokens[position].kind == 'word' and tokens[position].upper in CLAUSE_KEYWORDS:
+        return None, position
+
+    start = position
+    parts = [tokens[position].text]
+    position += 1
+    while (position + 1 < len(tokens) and tokens[position].text == '.' and tokens[position].kind == 'symbol'
+           and _is_identifier(tokens[position + 1])):
+        parts.append(tokens[position + 1].text)
+        position += 2
+    if allow_function and position < len(tokens) and tokens[position].text == '(':
+        # 表函数，如 JSON_TABLE(...)
+        return None, start
+
+    return TableReference(parts[-2] if len(parts) >= 2 else None, parts[-1], None), position
+
+
+def _read_alias(tokens: List[_Token], position: int) -> Tuple[Optional[str], int]:
+    """读取可选的 [AS] 别名"""
+    if position < len(tokens) and tokens[position].upper == 'AS':
+        position += 1
+        if position < len(tokens) and _is_identifier(tokens[position]):
+            return tokens[position].text, position + 1
+        return None, position
+    if (position < len(tokens) and _is_identifier(tokens[position])
+            and not (tokens[position].kind == 'word' and tokens[position].upper in CLAUSE_KEYWORDS)):
+        return tokens[position].text, position + 1
+    return None, position
+
+
+@lru_cache(maxsize=1024)
+def extract_tables(sql: str) -> Tuple[TableReference, ...]:
+    """解析 SQL 中引用的物理表（按 SQL 文本缓存）
+
+    识别 FROM / JOIN / STRAIGHT_JOIN / UPDATE / INSERT INTO / DESCRIBE 等位置的表名和别名，
+    支持逗号连接、括号括起的连接列表、子查询和派生表；WITH 定义的公用表表达式、
+    字符串和注释中的内容、t.col 这类别名引用和小数都不会被当成表；
+    SHOW TABLES FROM db 这类语句中的库名也不会被当成表。
+    """
+    tokens = tokenize(sql)
+    ctes = _cte_scopes(tokens)
+    references = []
+    stack = []
+
+    def is_cte(reference: TableReference, position: int) -> bool:
+        name = reference.table.lower()
+        return reference.database is None and any(
+            cte == name and start <= position < end for cte, start, end in ctes
+        )
+
+    def read_show(position: int) -> int:
+        """SHOW 语句：只有 SHOW COLUMNS/INDEX ... FROM 表 [FROM 库] 和 SHOW CREATE TABLE 表 引用表"""
+        words = set()
+        while position < len(tokens) and tokens[position].text != ';':
+            token = tokens[position]
+            if token.kind == 'word' and token.upper in ('FROM', 'IN') and words & SHOW_TABLE_OBJECTS:
+                reference, position = _read_table_factor(tokens, position + 1, False)
+                if reference is not None:
+                    if (reference.database is None and position + 1 < len(tokens)
+                            and tokens[position].upper in ('FROM', 'IN') and _is_identifier(tokens[position + 1])):
+                        reference = reference._replace(database=tokens[position + 1].text)
+                    references.append(reference)
+                break
+            if token.kind == 'word' and token.upper in ('TABLE', 'VIEW') and 'CREATE' in words:
+                reference, position = _read_table_factor(tokens, position + 1, False)
+                if reference is not None:
+                    references.append(reference)
+                break
+            words.add(token.upper)
+            position += 1
+        while position < len(tokens) and tokens[position].text != ';':
+            position += 1
+        return position
+
+    def read_table_list(position: int, keyword: str) -> int:
+        while position < len(tokens) and tokens[position].upper in TABLE_MODIFIERS:
+            position += 1
+        while position < len(tokens):
+            if tokens[position].kind == 'symbol' and tokens[position].text == '(':
+                if keyword in TABLE_LIST_KEYWORDS or keyword in JOIN_KEYWORDS:
+                    stack.append(_DERIVED_TABLE if keyword in TABLE_LIST_KEYWORDS else '')
+                    following = tokens[position + 1] if position + 1 < len(tokens) else None
+                    if following is not None and following.upper not in SUBQUERY_STARTS:
+                        # 括号括起的表列表，括号内的第一张表按 FROM 读取，后续的 JOIN 由主循环解析
+                        return read_table_list(position + 1, 'FROM')
+                    # 派生表，括号内容由主循环解析
+                    return position + 1
+                return position
+
+            start = position
+            reference, position = _read_table_factor(tokens, position, keyword in TABLE_LIST_KEYWORDS | JOIN_KEYWORDS)
+            if reference is None:
+                return position
+            alias = None
+            if keyword not in ('INTO', 'TABLE', 'DESCRIBE', 'DESC'):
+                alias, position = _read_alias(tokens, position)
+            if not is_cte(reference, start) and reference.table.upper() != 'DUAL':
+                references.append(reference._replace(alias=alias))
+
+            if keyword in TABLE_LIST_KEYWORDS and position < len(tokens) and tokens[position].text == ',':
+                position += 1
+                continue
+            return position
+        return position
+
+    position = 0
+    while position < len(tokens):
+        token = tokens[position]
+        previous = tokens[position - 1] if position else None
+
+        if token.kind == 'symbol' and token.text == '(':
+            stack.append(previous.upper if previous is not None and previous.kind == 'word' else '')
+            position += 1
+            continue
+        if token.kind == 'symbol' and token.text == ')':
+            position += 1
+            if stack and stack.pop() == _DERIVED_TABLE:
+                _, position = _read_alias(tokens, position)
+                if position < len(tokens) and tokens[position].text == ',':
+                    position = read_table_list(position + 1, 'FROM')
+            continue
+        if token.kind == 'word' and token.upper == 'SHOW' and (previous is None or previous.text == ';'):
+            position = read_show(position + 1)
+            continue
+        if token.kind != 'word' or token.upper not in TABLE_KEYWORDS:
+            position += 1
+            continue
+
+        keyword = token.upper
+        position += 1
+        if keyword == 'FROM' and stack and stack[-1] in FROM_FUNCTIONS:
+            continue
+        if keyword in ('DESCRIBE', 'DESC') and previous is not None and previous.text != ';':
+            # ORDER BY x DESC
+            continue
+        if keyword == 'UPDATE' and previous is not None and previous.upper in ('KEY', 'FOR'):
+            # ON DUPLICATE KEY UPDATE / SELECT ... FOR UPDATE
+            continue
+        if keyword == 'STRAIGHT_JOIN' and previous is not None and previous.upper in SELECT_MODIFIERS:
+            # SELECT STRAIGHT_JOIN ...
+            continue
+        if keyword == 'USING' and position < len(tokens) and tokens[position].text == '(':
+            # JOIN ... USING (col)
+            continue
+        if keyword == 'TABLE' and position < len(tokens) and tokens[position].upper == 'IF':
+            while position < len(tokens) and tokens[position].upper in ('IF', 'NOT', 'EXISTS'):
+                position += 1
+        position = read_table_list(position, keyword)
+
+    return tuple(references)
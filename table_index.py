@@ -0,0 +1,288 @@
+import re
+import heapq
+from collections import deque, namedtuple
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+# 索引中的一张表；priority 表示所在库是否为优先数据库
+TableRef = namedtuple('TableRef', ['database', 'table', 'priority'])
+
+# 表注释中可以作为别名的部分：第一个分隔符之前的内容
+ALIAS_SEPARATORS = re.compile(r'[，,。；;：:（(\s/|]')
+MIN_ALIAS_LENGTH = 2
+MAX_ALIAS_LENGTH = 20
+
+
+def comment_aliases(comment: str) -> List[str]:
+    """从表注释中提取别名，如 "订单明细表（按天分区）" -> ["订单明细表", "订单明细"]"""
+    head = ALIAS_SEPARATORS.split((comment or '').strip(), 1)[0].strip()
+    if not MIN_ALIAS_LENGTH <= len(head) <= MAX_ALIAS_LENGTH:
+        return []
+    aliases = [head]
+    if head.endswith('表') and len(head) - 1 >= MIN_ALIAS_LENGTH:
+        aliases.append(head[:-1])
+    return aliases
+
+
+def _is_word_char(ch: str) -> bool:
+    return ch.isascii() and (ch.isalnum() or ch == '_')
+
+
+class AhoCorasick:
+    """多模式匹配自动机：一次线性扫描找出文本中出现的所有模式"""
+
+    def __init__(self, patterns: Iterable[str]):
+        self.goto: List[Dict[str, int]] = [{}]
+        self.fail: List[int] = [0]
+        self.output: List[List[str]] = [[]]
+
+        for pattern in patterns:
+            if not pattern:
+                continue
+            node = 0
+            for ch in pattern:
+                next_node = self.goto[node].get(ch)
+                if next_node is None:
+                    next_node = len(self.goto)
+                    self.goto[node][ch] = next_node
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.output.append([])
+                node = next_node
+            self.output[node].append(pattern)
+
+        # 按层构建失败指针，并合并失败链上的输出
+        pending = deque(self.goto[0].values())
+        while pending:
+            node = pending.popleft()
+            for ch, child in self.goto[node].items():
+                pending.append(child)
+                fallback = self.fail[node]
+                while fallback and ch not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[child] = self.goto[fallback].get(ch, 0)
+                self.output[child] = self.output[child] + self.output[self.fail[child]]
+
+    def iter_matches(self, text: str) -> Iterator[Tuple[int, int, str]]:
+        """返回 (起始位置, 结束位置, 模式)"""
+        node = 0
+        for position, ch in enumerate(text):
+            while node and ch not in self.goto[node]:
+                node = self.fail[node]
+            node = self.goto[node].get(ch, 0)
+            for pattern in self.output[node]:
+                yield position + 1 - len(pattern), position + 1, pattern
+
+
+class NGramIndex:
+    """字符 n-gram 倒排索引，用于表名、字段名的模糊匹配
+
+    名称两端补空格后切分为 n-gram，相似度为 Dice 系数 2|A∩B| / (|A|+|B|)。
+    查询时只遍历与查询词共享 n-gram 的名称，不需要逐个比较。
+    """
+
+    def __init__(self, names: Iterable[str], n: int = 3):
+        self.n = n
+        self.names: List[str] = []
+        self.gram_counts: List[int] = []
+        self.postings: Dict[str, List[int]] = {}
+        for name in names:
+            grams = self._grams(name)
+            if not grams:
+                continue
+            name_id = len(self.names)
+            self.names.append(name)
+            self.gram_counts.append(len(grams))
+            for gram in grams:
+                self.postings.setdefault(gram, []).append(name_id)
+
+    def _grams(self, text: str) -> Set[str]:
+        padded = f" {text.lower()} "
+        return {padded[i:i + self.n] for i in range(len(padded) - self.n + 1)}
+
+    def search(self, text: str, k: int = 5, threshold: float = 0.0) -> List[Tuple[float, str]]:
+        """返回相似度不低于 threshold 的前 k 个 (相似度, 名称)"""
+        grams = self._grams(text)
+        if not grams:
+            return []
+        shared: Dict[int, int] = {}
+        for gram in grams:
+            for name_id in self.postings.get(gram, ()):
+                shared[name_id] = shared.get(name_id, 0) + 1
+
+        scored = (
+            (2 * count / (len(grams) + self.gram_counts[name_id]), self.names[name_id])
+            for name_id, count in shared.items()
+        )
+        return heapq.nlargest(k, (item for item in scored if item[0] >= threshold))
+
+
+class TableIndex:
+    """表名查找索引
+
+    精确表名和小写表名各建一个哈希表，值为 TableRef 列表（优先库的表排在前面），
+    查找一个候选词只需要两次字典访问。索引按数据库增量维护：目录版本变化时
+    只重建表列表、表注释或优先标记发生变化的库。
+
+    表名和表注释中的别名（小写）另外构建 Aho-Corasick 自动机，
+    用于在没有空格分词的中文问题中一次扫描找出所有提到的表。
+    表名和字段名还各有一个 n-gram 索引，用于拼写错误或缩写的模糊匹配。
+    自动机和 n-gram 索引在索引版本变化后第一次使用时重建。
+    """
+
+    def __init__(self):
+        self.exact: Dict[str, List[TableRef]] = {}
+        self.folded: Dict[str, List[TableRef]] = {}
+        self.aliases: Dict[str, List[TableRef]] = {}
+        self.columns: Dict[str, List[TableRef]] = {}
+        self.version = 0
+        self._db_signatures: Dict[str, tuple] = {}
+        self._catalog_key = None
+        self._automaton = None
+        self._automaton_version = -1
+        self._fuzzy = None
+        self._fuzzy_version = -1
+
+    @staticmethod
+    def _insert(index: Dict[str, List[TableRef]], key: str, ref: TableRef):
+        refs = index.setdefault(key, [])
+        if ref.priority:
+            # 插到最后一个优先库条目之后，保持 优先库 → 普通库 的顺序
+            position = sum(1 for existing in refs if existing.priority)
+            refs.insert(position, ref)
+        else:
+            refs.append(ref)
+
+    @staticmethod
+    def _remove(index: Dict[str, List[TableRef]], key: str, database: str):
+        refs = [ref for ref in index.get(key, []) if ref.database != database]
+        if refs:
+            index[key] = refs
+        else:
+            index.pop(key, None)
+
+    def _add_database(self, db_name: str, signature: tuple):
+        priority, tables, aliases, columns = signature
+        for table, table_aliases, table_columns in zip(tables, aliases, columns):
+            ref = TableRef(db_name, table, priority)
+            self._insert(self.exact, table, ref)
+            self._insert(self.folded, table.lower(), ref)
+            for alias in table_aliases:
+                self._insert(self.aliases, alias.lower(), ref)
+            for column in table_columns:
+                self._insert(self.columns, column.lower(), ref)
+
+    def _remove_database(self, db_name: str, signature: tuple):
+        _, tables, aliases, columns = signature
+        for table, table_aliases, table_columns in zip(tables, aliases, columns):
+            self._remove(self.exact, table, db_name)
+            self._remove(self.folded, table.lower(), db_name)
+            for alias in table_aliases:
+                self._remove(self.aliases, alias.lower(), db_name)
+            for column in table_columns:
+                self._remove(self.columns, column.lower(), db_name)
+
+    def update(self, db_info: Dict, priority_databases: Set[str]) -> bool:
+        """按目录同步索引，返回索引是否发生了变化
+
+        同一份目录（发现时间相同）且优先库未变化时直接返回，不遍历表。
+        """
+        databases = (db_info or {}).get('databases', {})
+        catalog_key = (id(db_info), (db_info or {}).get('discovery_time'), frozenset(priority_databases))
+        if catalog_key == self._catalog_key:
+            return False
+
+        changed = False
+        for db_name in list(self._db_signatures):
+            if db_name not in databases:
+                self._remove_database(db_name, self._db_signatures.pop(db_name))
+                changed = True
+
+        for db_name, db_data in databases.items():
+            tables = tuple(db_data.get('tables', []))
+            tables_info = db_data.get('tables_info', {})
+            aliases = tuple(tuple(comment_aliases(tables_info.get(table, {}).get('comment'))) for table in tables)
+            columns = tuple(tuple(tables_info.get(table, {}).get('columns', [])) for table in tables)
+            signature = (db_name in priority_databases, tables, aliases, columns)
+            previous = self._db_signatures.get(db_name)
+            if previous == signature:
+                continue
+            if previous is not None:
+                self._remove_database(db_name, previous)
+            self._add_database(db_name, signature)
+            self._db_signatures[db_name] = signature
+            changed = True
+
+        self._catalog_key = catalog_key
+        if changed:
+            self.version += 1
+        return changed
+
+    def lookup(self, name: str) -> List[TableRef]:
+        """查找表名：精确匹配优先，其次忽略大小写匹配"""
+        refs = self.exact.get(name, [])
+        folded = [ref for ref in self.folded.get(name.lower(), []) if ref not in refs]
+        return refs + folded
+
+    def find_mentions(self, text: str) -> List[List[TableRef]]:
+        """找出文本中提到的所有表名或别名，按出现顺序返回
+
+        重叠的匹配取最靠左、最长的一个；由字母数字组成的名称两侧不能紧挨字母数字，
+        避免 user 匹配到 users 中。
+        """
+        if self._automaton_version != self.version:
+            self._automaton = AhoCorasick(set(self.folded) | set(self.aliases))
+            self._automaton_version = self.version
+        if self._automaton is None:
+            return []
+
+        folded_text = text.lower()
+        matches = []
+        for start, end, pattern in self._automaton.iter_matches(folded_text):
+            if _is_word_char(pattern[0]) and start > 0 and _is_word_char(folded_text[start - 1]):
+                continue
+            if _is_word_char(pattern[-1]) and end < len(folded_text) and _is_word_char(folded_text[end]):
+                continue
+            matches.append((start, -(end - start), pattern))
+
+        mentions = []
+        covered_until = 0
+        for start, negative_length, pattern in sorted(matches):
+            if start < covered_until:
+                continue
+            covered_until = start - negative_length
+            refs = list(self.folded.get(pattern, []))
+            refs += [ref for ref in self.aliases.get(pattern, []) if ref not in refs]
+            mentions.append(refs)
+        return mentions
+
+    def _fuzzy_indexes(self) -> Tuple[NGramIndex, NGramIndex]:
+        if self._fuzzy_version != self.version:
+            self._fuzzy = (NGramIndex(self.folded), NGramIndex(self.columns))
+            self._fuzzy_version = self.version
+        return self._fuzzy
+
+    def fuzzy_tables(self, text: str, k: int = 5, threshold: float = 0.7) -> List[Tuple[float, List[TableRef]]]:
+        """模糊匹配表名，返回前 k 个 (相似度, 表列表)"""
+        table_index, _ = self._fuzzy_indexes()
+        return [(score, self.folded[name]) for score, name in table_index.search(text, k, threshold)]
+
+    def fuzzy_columns(self, text: str, k: int = 5, threshold: float = 0.7) -> List[Tuple[float, str, List[TableRef]]]:
+        """模糊匹配字段名，返回前 k 个 (相似度, 字段名(小写), 包含该字段的表)"""
+        _, column_index = self._fuzzy_indexes()
+        return [(score, name, self.columns[name]) for score, name in column_index.search(text, k, threshold)]
+
+    def match(self, names: Iterable[str]) -> Optional[TableRef]:
+        """在候选名中找到第一张表：先在优先库中找，再在所有库中找"""
+        return self.choose([self.lookup(name) for name in names])
+
+    @staticmethod
+    def choose(candidates: List[List[TableRef]]) -> Optional[TableRef]:
+        """从候选表列表中选一张表：先在优先库中找，再按候选顺序取第一个"""
+        for refs in candidates:
+            for ref in refs:
+                if ref.priority:
+                    return ref
+        for refs in candidates:
+            if refs:
+                return refs[0]
+        return None
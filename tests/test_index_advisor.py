@@ -0,0 +1,56 @@
+import pytest
+
+from index_advisor import format_indexes, score_index_usage, usable_index_columns
+
+INDEXES = [
+    {'name': 'PRIMARY', 'unique': True, 'columns': ['id']},
+    {'name': 'uk_no', 'unique': True, 'columns': ['order_no']},
+    {'name': 'idx_user', 'unique': False, 'columns': ['user_id', 'created_at']},
+]
+
+DB_INFO = {'databases': {'shop': {'tables_info': {
+    'orders': {'columns': ['id', 'order_no', 'user_id', 'created_at', 'status'], 'indexes': INDEXES,
+               'rows': 5000000},
+    'users': {'columns': ['id', 'name'], 'indexes': INDEXES[:1], 'rows': 1000},
+}}}}
+
+
+def score(sql, min_rows=100000):
+    return score_index_usage(sql, DB_INFO, 'shop', min_rows)
+
+
+def test_format_indexes():
+    assert format_indexes(INDEXES) == "PRIMARY(id), UNIQUE uk_no(order_no), idx_user(user_id,created_at)"
+    many = [{'name': f"i{n}", 'columns': ['c']} for n in range(10)]
+    assert format_indexes(many).endswith("等共 10 个索引")
+
+
+def test_usable_columns_follow_leftmost_prefix():
+    assert usable_index_columns(INDEXES, set()) == {'id', 'order_no', 'user_id'}
+    assert usable_index_columns(INDEXES, {'user_id'}) == {'id', 'order_no', 'user_id', 'created_at'}
+
+
+def test_indexed_filter_and_sort():
+    result = score("SELECT * FROM shop.orders o WHERE o.user_id = 3 ORDER BY o.created_at")
+    assert result == {'score': 1.0, 'indexed': ['orders.user_id', 'orders.created_at'],
+                      'unindexed': [], 'wrapped': []}
+
+
+def test_wrapped_and_unindexed_columns():
+    result = score("SELECT * FROM orders WHERE YEAR(created_at) = 2024 AND status = 'paid'")
+    assert result['score'] == 0.0
+    assert result['wrapped'] == ['orders.created_at']
+    assert result['unindexed'] == ['orders.status']
+
+
+def test_small_tables_and_plain_parens_are_ignored():
+    result = score("SELECT * FROM orders o JOIN users u ON u.id = o.user_id "
+                   "WHERE (o.id IN (SELECT id FROM users WHERE name = 'a'))")
+    assert result['indexed'] == ['orders.user_id', 'orders.id']
+    assert result['unindexed'] == []
+    assert score("SELECT * FROM users WHERE name = 'a'", min_rows=0)['unindexed'] == ['users.name']
+
+
+@pytest.mark.parametrize('sql', ["SELECT COUNT(*) FROM orders", "SELECT * FROM unknown WHERE x = 1"])
+def test_no_predicates_scores_full(sql):
+    assert score(sql)['score'] == 1.0
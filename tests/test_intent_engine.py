@@ -0,0 +1,67 @@
+from datetime import date
+
+import pytest
+
+from intent_engine import IntentEngine, parse_date_range
+
+
+@pytest.fixture
+def engine():
+    return IntentEngine('shop', 'orders',
+                        ['id', 'status', 'amount', 'created_at'],
+                        ['int(11)', 'varchar(20)', 'decimal(10,2)', 'datetime'])
+
+
+def test_text_filter(engine):
+    result = engine.build('orders表里status是paid的数据')
+    assert result['sql'] == "SELECT * FROM `shop`.`orders` WHERE `status` = 'paid' LIMIT 10;"
+    assert result['intents'] == ['filter']
+
+
+def test_numeric_filter_with_count(engine):
+    result = engine.build('amount大于100的订单有多少')
+    assert result['sql'] == "SELECT COUNT(*) FROM `shop`.`orders` WHERE `amount` > 100;"
+
+
+@pytest.mark.parametrize('question', [
+    'orders表里status是什么意思',
+    'status为多少',
+    'status是哪种',
+    'amount是几',
+    'status是paid吗',
+    'status是啥',
+])
+def test_question_literal_falls_back(engine, question):
+    assert engine.build(question) is None
+
+
+def test_quoted_literal_is_kept(engine):
+    result = engine.build("status是'什么'的订单")
+    assert "`status` = '什么'" in result['sql']
+
+
+@pytest.mark.parametrize('question, condition', [
+    ('status为空', '`status` IS NULL'),
+    ('status是空的订单', '`status` IS NULL'),
+    ('status不为空', '`status` IS NOT NULL'),
+    ('amount是null', '`amount` IS NULL'),
+])
+def test_null_literal(engine, question, condition):
+    assert f"WHERE {condition}" in engine.build(question)['sql']
+
+
+@pytest.mark.parametrize('question', ['amount的分布', 'amount分布', '按status统计', '每个status的数量'])
+def test_group_count(engine, question):
+    result = engine.build(question)
+    assert 'group_count' in result['intents']
+    assert 'GROUP BY' in result['sql']
+
+
+def test_top_n(engine):
+    result = engine.build('amount最高的前5条')
+    assert result['sql'] == "SELECT * FROM `shop`.`orders` ORDER BY `amount` DESC LIMIT 5;"
+
+
+def test_date_range():
+    assert parse_date_range('2024年3月的订单') == (date(2024, 3, 1), date(2024, 4, 1))
+    assert parse_date_range('最近7天', today=date(2024, 3, 10)) == (date(2024, 3, 4), date(2024, 3, 11))
@@ -0,0 +1,79 @@
+import json
+import os
+import threading
+
+import pytest
+
+from jobs import COMPLETED, FAILED, INTERRUPTED, RUNNING, JobRegistry
+
+
+def wait_for(registry, job_id, status):
+    for _ in range(200):
+        if registry.get(job_id)['status'] == status:
+            return
+        threading.Event().wait(0.01)
+    pytest.fail(f"任务未进入 {status} 状态: {registry.get(job_id)}")
+
+
+def test_concurrent_saves_leave_latest_state(tmp_path):
+    registry = JobRegistry(str(tmp_path))
+
+    def handler(job):
+        def worker(offset):
+            for index in range(50):
+                job.checkpoint(force=True, **{f"k{offset}": index})
+        threads = [threading.Thread(target=worker, args=(offset,)) for offset in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return 'ok'
+
+    registry.register_handler('work', handler)
+    job_id = registry.submit('work')
+    wait_for(registry, job_id, COMPLETED)
+
+    with open(tmp_path / f"{job_id}.json", encoding='utf-8') as f:
+        saved = json.load(f)
+    assert saved['status'] == COMPLETED
+    assert saved['checkpoint'] == {f"k{offset}": 49 for offset in range(8)}
+    assert not [name for name in os.listdir(tmp_path) if name.endswith('.tmp')]
+
+
+def test_resume_starts_only_once(tmp_path):
+    registry = JobRegistry(str(tmp_path))
+    release = threading.Event()
+    runs = []
+
+    def handler(job):
+        runs.append(dict(job.checkpoint_data))
+        if job.checkpoint_data.get('step'):
+            release.wait(5)
+            return 'done'
+        job.checkpoint(step=1)
+        raise RuntimeError('boom')
+
+    registry.register_handler('flaky', handler)
+    job_id = registry.submit('flaky')
+    wait_for(registry, job_id, FAILED)
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(registry.resume(job_id))) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert results.count(True) == 1
+    assert registry.get(job_id)['status'] == RUNNING
+
+    release.set()
+    wait_for(registry, job_id, COMPLETED)
+    assert runs == [{}, {'step': 1}]
+
+
+def test_running_jobs_recover_as_interrupted(tmp_path):
+    (tmp_path / 'abc.json').write_text(json.dumps({'id': 'abc', 'kind': 'work', 'status': RUNNING}))
+    (tmp_path / 'abc.json.x1.tmp').write_text('{')
+    registry = JobRegistry(str(tmp_path))
+    assert registry.get('abc')['status'] == INTERRUPTED
+    assert sorted(os.listdir(tmp_path)) == ['abc.json']
@@ -0,0 +1,129 @@
+import threading
+import time
+
+import pytest
+
+pytest.importorskip('openai')
+pytest.importorskip('httpx')
+pytest.importorskip('dotenv')
+
+from llm_client import PRIORITY_BATCH, PRIORITY_INTERACTIVE, RateLimiter, _GuardedStream, estimate_tokens
+
+
+def wait_until(predicate, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        if time.monotonic() > deadline:
+            pytest.fail("等待超时")
+        time.sleep(0.005)
+
+
+def test_estimate_tokens_counts_chinese_per_character():
+    assert estimate_tokens([{'content': '查询订单'}]) == 4 + 4
+    assert estimate_tokens([{'content': 'a' * 40}, {'content': None}]) == 10 + 4 + 4
+
+
+def test_acquire_deducts_and_settle_refunds():
+    limiter = RateLimiter(requests_per_minute=600, tokens_per_minute=1000)
+    assert limiter.acquire(600) is not None
+    assert limiter.acquire(600, timeout=0.05) is None
+
+    limiter.settle(600, 100)
+    assert limiter.acquire(600, timeout=0.05) is not None
+
+
+def test_settle_charges_underestimated_usage():
+    limiter = RateLimiter(requests_per_minute=600, tokens_per_minute=1000)
+    assert limiter.acquire(100) is not None
+    limiter.settle(100, 1000)
+    assert limiter.acquire(100, timeout=0.05) is None
+
+
+def test_oversized_request_is_capped_at_capacity():
+    limiter = RateLimiter(requests_per_minute=600, tokens_per_minute=1000)
+    assert limiter.acquire(5000, timeout=0.05) is not None
+
+
+def test_request_bucket_limits_calls():
+    limiter = RateLimiter(requests_per_minute=2, tokens_per_minute=1000000)
+    assert limiter.acquire(1) is not None
+    assert limiter.acquire(1) is not None
+    assert limiter.acquire(1, timeout=0.05) is None
+
+
+def test_interactive_calls_overtake_queued_batch_calls():
+    limiter = RateLimiter(requests_per_minute=600, tokens_per_minute=6000)
+    limiter.acquire(6000)
+    granted = []
+
+    def call(priority):
+        limiter.acquire(3000, priority=priority, timeout=5)
+        granted.append(priority)
+
+    batch = threading.Thread(target=call, args=(PRIORITY_BATCH,))
+    batch.start()
+    wait_until(lambda: limiter.get_stats()['queue_depth'] == 1)
+    interactive = threading.Thread(target=call, args=(PRIORITY_INTERACTIVE,))
+    interactive.start()
+    wait_until(lambda: limiter.get_stats()['queue_depth'] == 2)
+    assert limiter.get_stats()['queue_by_priority'] == {PRIORITY_INTERACTIVE: 1, PRIORITY_BATCH: 1}
+
+    # 只退回够一个调用使用的配额：排在后面提交的交互式调用先拿到
+    limiter.settle(6000, 3000)
+    interactive.join(2)
+    assert granted == [PRIORITY_INTERACTIVE]
+
+    limiter.settle(3000, 0)
+    batch.join(2)
+    assert granted == [PRIORITY_INTERACTIVE, PRIORITY_BATCH]
+
+    stats = limiter.get_stats()
+    assert stats['queue_depth'] == 0
+    assert stats['by_priority'][PRIORITY_INTERACTIVE]['granted'] == 2
+    assert stats['by_priority'][PRIORITY_BATCH]['granted'] == 1
+    assert stats['by_priority'][PRIORITY_BATCH]['max_wait'] > 0
+
+
+def test_timed_out_call_leaves_the_queue():
+    limiter = RateLimiter(requests_per_minute=600, tokens_per_minute=1000)
+    limiter.acquire(1000)
+    assert limiter.acquire(500, timeout=0.02) is None
+    assert limiter.get_stats()['queue_depth'] == 0
+
+
+class _Chunk:
+    def __init__(self, content=None, total_tokens=None):
+        self.choices = [type('Choice', (), {'delta': type('Delta', (), {'content': content})()})()] if content else []
+        self.usage = type('Usage', (), {'total_tokens': total_tokens})() if total_tokens else None
+
+
+class _Stream:
+    def __init__(self, chunks):
+        self.chunks = chunks
+        self.closed = False
+
+    def __iter__(self):
+        return iter(self.chunks)
+
+    def close(self):
+        self.closed = True
+
+
+def test_guarded_stream_settles_with_reported_usage_once():
+    stream = _Stream([_Chunk('SELECT'), _Chunk(total_tokens=42)])
+    released, settled = [], []
+    guarded = _GuardedStream(stream, lambda: released.append(1), settled.append, prompt_tokens=10)
+    assert len(list(guarded)) == 2
+    guarded.close()
+    assert stream.closed and released == [1] and settled == [42]
+
+
+def test_guarded_stream_estimates_usage_when_closed_early():
+    stream = _Stream([_Chunk('a' * 40), _Chunk('b' * 40)])
+    released, settled = [], []
+    guarded = _GuardedStream(stream, lambda: released.append(1), settled.append, prompt_tokens=10)
+    for _ in guarded:
+        break
+    guarded.close()
+    assert released == [1]
+    assert settled == [10 + estimate_tokens([{'content': 'a' * 40}])]
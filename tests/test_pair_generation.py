@@ -0,0 +1,88 @@
+import threading
+import types
+
+import pytest
+
+for _module in ('streamlit', 'pandas', 'mysql.connector', 'vanna', 'openai', 'httpx', 'dotenv'):
+    pytest.importorskip(_module)
+
+import app
+
+
+def table(database, name, columns=('id', 'name')):
+    return {'database': database, 'table': name, 'columns': list(columns),
+            'columns_info': [f"{column} (int)" for column in columns]}
+
+
+def test_plan_groups_by_database_and_allocates_every_pair():
+    tables = [table('shop', 'orders'), table('shop', 'users'), table('crm', 'leads')]
+    tasks = app.plan_pair_generation(tables, 10)
+    assert [[t['table'] for t in task['tables']] for task in tasks] == [['orders', 'users'], ['leads']]
+    assert sum(task['count'] for task in tasks) == 10
+    assert tasks[0]['count'] > tasks[1]['count']
+    assert app.plan_pair_generation([], 10) == []
+    assert app.plan_pair_generation(tables, 0) == []
+
+
+def test_plan_splits_large_groups_and_rotates_focus():
+    per_call = app.PAIR_OUTPUT_TOKEN_BUDGET // app.PAIR_TOKENS_PER_PAIR
+    tasks = app.plan_pair_generation([table('shop', 'orders')], per_call * 3)
+    assert len(tasks) == 3
+    assert all(task['count'] <= per_call for task in tasks)
+    assert [task['focus'] for task in tasks] == app.PAIR_QUERY_TYPES[:3]
+
+
+def test_plan_respects_prompt_token_budget(monkeypatch):
+    monkeypatch.setattr(app, 'PAIR_PROMPT_TOKEN_BUDGET', 30)
+    tables = [table('shop', f"t{i}", [f"column_{j}" for j in range(10)]) for i in range(3)]
+    tasks = app.plan_pair_generation(tables, 3)
+    assert [len(task['tables']) for task in tasks] == [1, 1, 1]
+
+
+@pytest.fixture
+def fake_generation(monkeypatch):
+    monkeypatch.setenv('ALI_API_KEY', 'test')
+    monkeypatch.setattr(app, 'get_llm_client', lambda: types.SimpleNamespace(max_concurrency=4))
+    calls = []
+    lock = threading.Lock()
+
+    def generate(task, diversity_level, model):
+        name = task['tables'][0]['table']
+        with lock:
+            calls.append(name)
+        if name == 'broken':
+            raise RuntimeError('模型返回错误')
+        return [(f"{name} 问题{i}", f"SELECT {i} FROM {name}") for i in range(task['count'])]
+
+    monkeypatch.setattr(app, '_generate_pair_group', generate)
+    return calls
+
+
+def test_groups_run_concurrently_and_interleave(fake_generation):
+    tables = [table('a', 'orders'), table('b', 'users')]
+    pairs = app.generate_diverse_qsql_pairs(tables, 4, '中', None, progress_callback=lambda *a: None,
+                                            use_cache=False)
+    assert sorted(fake_generation) == ['orders', 'users']
+    assert [sql.split()[-1] for _, sql in pairs] == ['orders', 'users', 'orders', 'users']
+
+
+def test_failed_group_is_filled_with_basic_queries(fake_generation):
+    tables = [table('a', 'orders'), table('b', 'broken')]
+    pairs = app.generate_diverse_qsql_pairs(tables, 20, '中', None, progress_callback=lambda *a: None,
+                                            use_cache=False)
+    assert len(pairs) == 20
+    assert any('broken' in sql for _, sql in pairs)
+    assert len(set(pairs)) == len(pairs)
+
+
+def test_completed_groups_are_not_regenerated(fake_generation):
+    tables = [table('a', 'orders'), table('b', 'users')]
+    tasks = app.plan_pair_generation(tables, 4)
+    done = {app._pair_task_key(tasks[0]): [["旧问题", "SELECT 1 FROM orders"]]}
+    recorded = {}
+    pairs = app.generate_diverse_qsql_pairs(tables, 4, '中', None, progress_callback=lambda *a: None,
+                                            use_cache=False, completed_groups=done,
+                                            on_group_done=recorded.__setitem__)
+    assert fake_generation == ['users']
+    assert list(recorded) == [app._pair_task_key(tasks[1])]
+    assert ("旧问题", "SELECT 1 FROM orders") in pairs
@@ -0,0 +1,47 @@
+import pytest
+
+for _module in ('streamlit', 'pandas', 'mysql.connector', 'vanna', 'openai', 'httpx', 'dotenv'):
+    pytest.importorskip(_module)
+
+from app import ProgressReporter
+
+
+def make_reporter(total, **kwargs):
+    rendered = []
+    reporter = ProgressReporter(total, render=lambda done, total, message: rendered.append((done, message)),
+                                **kwargs)
+    return reporter, rendered
+
+
+def test_updates_are_coalesced_by_step():
+    reporter, rendered = make_reporter(100, min_interval=60, min_step=0.1)
+    for done in range(1, 100):
+        reporter.update(done, "处理中")
+    assert [done for done, _ in rendered] == [1, 11, 21, 31, 41, 51, 61, 71, 81, 91]
+
+
+def test_finish_and_force_always_render():
+    reporter, rendered = make_reporter(10, min_interval=60, min_step=1.0)
+    reporter.update(1)
+    reporter.update(2)
+    reporter.update(3, force=True)
+    reporter.update(10)
+    assert [done for done, _ in rendered] == [1, 3, 10]
+
+
+def test_message_reports_throughput_and_eta():
+    reporter, rendered = make_reporter(100, unit="KB")
+    reporter.start_time -= 2
+    reporter.update(50, "已导入 50 条")
+    done, message = rendered[-1]
+    assert message.startswith("已导入 50 条（") and "KB/秒" in message and "预计剩余" in message
+    assert reporter.eta == pytest.approx(2, rel=0.2)
+
+    reporter.update(100, "完成")
+    assert "预计剩余" not in rendered[-1][1]
+
+
+def test_eta_unknown_before_progress():
+    reporter, _ = make_reporter(5)
+    assert reporter.rate == 0.0
+    assert reporter.eta is None
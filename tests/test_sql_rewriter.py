@@ -0,0 +1,99 @@
+import doctest
+
+import pytest
+
+import sql_rewriter
+from sql_rewriter import SAFE_REWRITE_RULES, rewrite_sql
+
+DB_INFO = {'databases': {'shop': {'tables_info': {
+    'orders': {'columns': ['id', 'user_id', 'status', 'amount', 'created_at'],
+               'indexes': [{'name': 'PRIMARY', 'columns': ['id']}]},
+}}}}
+
+
+def test_doctests():
+    assert doctest.testmod(sql_rewriter).failed == 0
+
+
+@pytest.mark.parametrize('sql, expected', [
+    ("SELECT * FROM t WHERE YEAR(created_at) = 2024",
+     "SELECT * FROM t WHERE (created_at >= '2024-01-01' AND created_at < '2025-01-01')"),
+    ("SELECT * FROM t WHERE YEAR(t.d) = 2024 AND MONTH(t.d) = 12 ORDER BY id",
+     "SELECT * FROM t WHERE (t.d >= '2024-12-01' AND t.d < '2025-01-01') ORDER BY id"),
+    ("SELECT * FROM t WHERE YEAR(d) BETWEEN 2020 AND 2021",
+     "SELECT * FROM t WHERE (d >= '2020-01-01' AND d < '2022-01-01')"),
+    ("SELECT * FROM t WHERE DATE(d) = '2024-02-29' OR x = 1",
+     "SELECT * FROM t WHERE (d >= '2024-02-29' AND d < '2024-03-01') OR x = 1"),
+])
+def test_sargable_dates(sql, expected):
+    assert rewrite_sql(sql) == (expected, ['sargable_date'])
+
+
+@pytest.mark.parametrize('sql', [
+    "SELECT * FROM t WHERE YEAR(d) = 2024 + 1",
+    "SELECT * FROM t WHERE 1 + YEAR(d) = 2024",
+    "SELECT * FROM t WHERE DATE(d) = '2024-02-30'",
+    "SELECT 'WHERE YEAR(d) = 2024' FROM t",
+    "SELECT * FROM t WHERE YEAR(d) BETWEEN 2022 AND 2021",
+])
+def test_sargable_dates_leave_other_expressions(sql):
+    assert rewrite_sql(sql) == (sql, [])
+
+
+def test_count_order_by_removed_from_aggregate_and_derived_table():
+    assert rewrite_sql("SELECT COUNT(*) FROM orders ORDER BY created_at DESC") == (
+        "SELECT COUNT(*) FROM orders", ['count_order_by'])
+    assert rewrite_sql("SELECT COUNT(*) FROM (SELECT id FROM orders ORDER BY id) t")[0] == (
+        "SELECT COUNT(*) FROM (SELECT id FROM orders) t")
+
+
+@pytest.mark.parametrize('sql', [
+    "SELECT COUNT(*) FROM a UNION ALL SELECT COUNT(*) FROM b ORDER BY 1 DESC",
+    "SELECT status, COUNT(*) FROM orders GROUP BY status ORDER BY 2",
+    "SELECT COUNT(*) FROM (SELECT id FROM orders ORDER BY id LIMIT 10) t",
+])
+def test_count_order_by_kept_when_it_matters(sql):
+    assert rewrite_sql(sql) == (sql, [])
+
+
+@pytest.mark.parametrize('sql, expected', [
+    ("SELECT id FROM (SELECT id FROM orders WHERE status = 'x') t LIMIT 10",
+     "SELECT id FROM (SELECT id FROM orders WHERE status = 'x' LIMIT 10) t LIMIT 10"),
+    ("SELECT * FROM (SELECT id FROM orders) AS t LIMIT 5, 10",
+     "SELECT * FROM (SELECT id FROM orders LIMIT 15) AS t LIMIT 5, 10"),
+    # 集合运算末尾的 LIMIT 作用于整个结果
+    ("SELECT id FROM (SELECT id FROM a UNION SELECT id FROM b) t LIMIT 10",
+     "SELECT id FROM (SELECT id FROM a UNION SELECT id FROM b LIMIT 10) t LIMIT 10"),
+])
+def test_limit_pushdown(sql, expected):
+    assert rewrite_sql(sql) == (expected, ['limit_pushdown'])
+
+
+@pytest.mark.parametrize('sql', [
+    "SELECT COUNT(*) FROM (SELECT id FROM orders) t LIMIT 1",
+    "SELECT DISTINCT id FROM (SELECT id FROM orders) t LIMIT 10",
+    "SELECT id FROM (SELECT id FROM orders) t WHERE id > 1 LIMIT 10",
+    "SELECT id FROM (SELECT id FROM orders LIMIT 3) t LIMIT 10",
+    "SELECT id FROM (SELECT id FROM orders) t LIMIT 10 UNION SELECT 1",
+])
+def test_limit_pushdown_skipped(sql):
+    assert 'limit_pushdown' not in rewrite_sql(sql)[1]
+
+
+def test_select_columns_is_opt_in():
+    sql = "SELECT * FROM orders WHERE status = 'paid'"
+    question = "status 为 paid 的订单的 amount"
+    assert 'select_columns' not in SAFE_REWRITE_RULES
+    assert rewrite_sql(sql, question, DB_INFO, 'shop') == (sql, [])
+
+    rewritten, fired = rewrite_sql(sql, question, DB_INFO, 'shop', rules=SAFE_REWRITE_RULES + ('select_columns',))
+    assert rewritten == "SELECT `id`, `amount` FROM orders WHERE status = 'paid'"
+    assert fired == ['select_columns']
+
+
+def test_select_columns_needs_requested_columns():
+    rules = ('select_columns',)
+    assert rewrite_sql("SELECT * FROM orders WHERE status = 'paid'", "status 为 paid 的订单",
+                       DB_INFO, 'shop', rules)[1] == []
+    assert rewrite_sql("SELECT * FROM orders o JOIN users u ON u.id = o.user_id", "amount",
+                       DB_INFO, 'shop', rules)[1] == []
@@ -0,0 +1,60 @@
+import time
+
+import pytest
+
+from sql_stream import SqlStreamScanner, extract_complete_sql
+
+
+def feed_chunks(text, size):
+    scanner = SqlStreamScanner()
+    for start in range(0, len(text), size):
+        sql = scanner.feed(text[start:start + size])
+        if sql:
+            return sql, start + size
+    return None, len(text)
+
+
+@pytest.mark.parametrize('text, expected', [
+    ("SELECT * FROM orders;\n解释...", "SELECT * FROM orders;"),
+    ("```sql\nSELECT 1\n```\n说明", "SELECT 1"),
+    ("Here's the query you asked for:\n```sql\nSELECT name FROM users WHERE note = 'a;b';\n```",
+     "SELECT name FROM users WHERE note = 'a;b';"),
+    ("可以这样查询 ```sql\nSELECT 1;\n```", "SELECT 1;"),
+    ("It's simple:\nSELECT 'it''s' FROM dual;", "SELECT 'it''s' FROM dual;"),
+    ("-- 假设状态字段为 status\nSELECT * FROM t WHERE status = 'x';",
+     "-- 假设状态字段为 status\nSELECT * FROM t WHERE status = 'x';"),
+    ("SELECT /* ; */ `a;b` FROM t # ;\n;", "SELECT /* ; */ `a;b` FROM t # ;\n;"),
+    ("```\n```\n```sql\nSELECT 2;\n```", "SELECT 2;"),
+])
+@pytest.mark.parametrize('size', [1, 2, 3, 5, 1000])
+def test_complete_statement_in_any_chunking(text, expected, size):
+    assert feed_chunks(text, size)[0] == expected
+
+
+@pytest.mark.parametrize('text', [
+    "SELECT * FROM t WHERE a = 'x;",
+    "```sql\nSELECT 1",
+    "Here's the query",
+    "SELECT 1 -- ;",
+    "```sql\nSELECT 1 ``",
+])
+def test_incomplete_output(text):
+    assert extract_complete_sql(text) is None
+
+
+def test_stops_at_first_statement():
+    sql, consumed = feed_chunks("SELECT 1; SELECT 2; trailing explanation", 1)
+    assert sql == "SELECT 1;"
+    assert consumed == len("SELECT 1;")
+
+
+def test_capitalized_prose_is_not_sql():
+    assert extract_complete_sql("Show me the result;\nSELECT 1;") == "SELECT 1;"
+
+
+def test_scans_each_chunk_once():
+    text = "SELECT " + ", ".join(f"'c{i}'" for i in range(20000)) + " FROM t;"
+    start = time.perf_counter()
+    sql, _ = feed_chunks(text, 4)
+    assert sql == text
+    assert time.perf_counter() - start < 2
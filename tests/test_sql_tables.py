@@ -0,0 +1,81 @@
+import pytest
+
+from sql_tables import TableReference, extract_tables
+
+
+def tables(sql):
+    return [(ref.database, ref.table, ref.alias) for ref in extract_tables(sql)]
+
+
+def test_qualified_table_and_alias():
+    assert tables("SELECT o.id FROM shop.orders AS o WHERE o.id = 1") == [('shop', 'orders', 'o')]
+
+
+def test_comma_join_and_joins():
+    sql = "SELECT * FROM a x, b y LEFT JOIN shop.c ON c.id = y.id STRAIGHT_JOIN d"
+    assert tables(sql) == [(None, 'a', 'x'), (None, 'b', 'y'), ('shop', 'c', None), (None, 'd', None)]
+
+
+def test_select_straight_join_is_a_hint():
+    assert tables("SELECT STRAIGHT_JOIN * FROM a JOIN b ON a.id = b.id") == [
+        (None, 'a', None), (None, 'b', None)]
+
+
+def test_parenthesized_join_list():
+    sql = "SELECT * FROM a JOIN (b JOIN c ON b.id = c.id) ON a.id = b.id"
+    assert tables(sql) == [(None, 'a', None), (None, 'b', None), (None, 'c', None)]
+
+
+def test_derived_table_and_subquery():
+    sql = "SELECT * FROM (SELECT id FROM orders) t, users u WHERE u.id IN (SELECT user_id FROM payments)"
+    assert [ref[1] for ref in tables(sql)] == ['orders', 'users', 'payments']
+
+
+def test_strings_comments_and_functions_are_ignored():
+    sql = "SELECT EXTRACT(YEAR FROM created_at), 'FROM fake' FROM orders -- JOIN other\n/* FROM x */"
+    assert tables(sql) == [(None, 'orders', None)]
+
+
+def test_cte_names_are_not_tables():
+    sql = "WITH recent AS (SELECT * FROM orders) SELECT * FROM recent JOIN users ON users.id = recent.user_id"
+    assert [ref[1] for ref in tables(sql)] == ['orders', 'users']
+
+
+def test_cte_name_scoped_to_its_statement():
+    sql = "WITH t AS (SELECT 1) SELECT * FROM t; SELECT * FROM t"
+    assert tables(sql) == [(None, 't', None)]
+
+
+def test_cte_name_scoped_to_its_subquery():
+    sql = "SELECT * FROM (WITH t AS (SELECT 1) SELECT * FROM t) x JOIN t ON t.id = x.id"
+    assert tables(sql) == [(None, 't', None)]
+
+
+@pytest.mark.parametrize('sql', [
+    "SHOW TABLES FROM shop",
+    "SHOW FULL TABLES IN shop LIKE 'o%'",
+    "SHOW TABLE STATUS FROM shop",
+])
+def test_show_database_is_not_a_table(sql):
+    assert tables(sql) == []
+
+
+@pytest.mark.parametrize('sql', [
+    "SHOW COLUMNS FROM orders IN shop",
+    "SHOW FULL FIELDS FROM orders FROM shop",
+    "SHOW INDEX FROM shop.orders",
+    "SHOW CREATE TABLE shop.orders",
+])
+def test_show_table_statements(sql):
+    assert tables(sql) == [('shop', 'orders', None)]
+
+
+def test_describe_and_dml():
+    assert tables("DESCRIBE shop.orders") == [('shop', 'orders', None)]
+    assert tables("INSERT INTO logs SELECT * FROM events ON DUPLICATE KEY UPDATE n = 1") == [
+        (None, 'logs', None), (None, 'events', None)]
+    assert tables("SELECT * FROM orders ORDER BY id DESC") == [(None, 'orders', None)]
+
+
+def test_returns_table_references():
+    assert extract_tables("SELECT * FROM `my db`.`t``1`") == (TableReference('my db', 't`1', None),)
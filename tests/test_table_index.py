@@ -0,0 +1,98 @@
+import pytest
+
+from table_index import AhoCorasick, NGramIndex, TableIndex, TableRef, comment_aliases
+
+
+def catalog(discovery_time='t1', **databases):
+    return {
+        'discovery_time': discovery_time,
+        'databases': {
+            name: {'tables': list(tables), 'tables_info': tables}
+            for name, tables in databases.items()
+        },
+    }
+
+
+@pytest.fixture
+def index():
+    index = TableIndex()
+    index.update(catalog(
+        shop={'orders': {'comment': '订单表（按天分区）', 'columns': ['id', 'status']},
+              'users': {'comment': '用户', 'columns': ['id', 'name']}},
+        crm={'Users': {'comment': '', 'columns': ['id', 'email']},
+             'order_items': {'comment': '订单明细表', 'columns': ['order_id']}},
+    ), {'crm'})
+    return index
+
+
+@pytest.mark.parametrize('comment, aliases', [
+    ('订单明细表（按天分区）', ['订单明细表', '订单明细']),
+    ('用户, 含注销', ['用户']),
+    ('表', []),
+    (None, []),
+])
+def test_comment_aliases(comment, aliases):
+    assert comment_aliases(comment) == aliases
+
+
+def test_automaton_finds_overlapping_patterns():
+    automaton = AhoCorasick(['he', 'she', 'his', 'hers', ''])
+    assert sorted(automaton.iter_matches('ushers')) == [(1, 4, 'she'), (2, 4, 'he'), (2, 6, 'hers')]
+
+
+def test_lookup_prefers_exact_case_then_priority(index):
+    assert index.lookup('Users') == [TableRef('crm', 'Users', True), TableRef('shop', 'users', False)]
+    assert index.lookup('users') == [TableRef('shop', 'users', False), TableRef('crm', 'Users', True)]
+    assert index.match(['users']) == TableRef('crm', 'Users', True)
+    assert index.match(['missing']) is None
+
+
+def test_find_mentions_in_chinese_question(index):
+    mentions = index.find_mentions('查询orders表里每个用户的订单明细数量')
+    assert [[ref.table for ref in refs] for refs in mentions] == [['orders'], ['users'], ['order_items']]
+
+
+def test_find_mentions_respects_word_boundaries(index):
+    assert index.find_mentions('show user_orders and reorders') == []
+    # 忽略大小写匹配，优先库的表排在前面
+    assert [refs[0] for refs in index.find_mentions('join ORDERS with users')] == [
+        TableRef('shop', 'orders', False), TableRef('crm', 'Users', True)]
+
+
+def test_find_mentions_prefers_longest_leftmost(index):
+    mentions = index.find_mentions('订单明细表')
+    assert [[ref.table for ref in refs] for refs in mentions] == [['order_items']]
+
+
+def test_update_is_incremental(index):
+    version = index.version
+    same = catalog(
+        shop={'orders': {'comment': '订单表（按天分区）', 'columns': ['id', 'status']},
+              'users': {'comment': '用户', 'columns': ['id', 'name']}},
+        crm={'Users': {'comment': '', 'columns': ['id', 'email']},
+             'order_items': {'comment': '订单明细表', 'columns': ['order_id']}},
+        discovery_time='t2',
+    )
+    assert index.update(same, {'crm'}) is False
+    assert index.version == version
+
+    del same['databases']['crm']
+    same['discovery_time'] = 't3'
+    assert index.update(same, {'crm'}) is True
+    assert index.lookup('Users') == [TableRef('shop', 'users', False)]
+    assert [[ref.table for ref in refs] for refs in index.find_mentions('订单明细')] == [['orders']]
+
+
+def test_ngram_search_ranks_by_similarity():
+    ngrams = NGramIndex(['orders', 'order_items', 'users'])
+    results = ngrams.search('ordres', k=2)
+    assert results[0][1] == 'orders'
+    assert all(0 < score < 1 for score, _ in results)
+    assert ngrams.search('zzz', threshold=0.1) == []
+
+
+def test_fuzzy_tables_and_columns(index):
+    [(score, refs)] = index.fuzzy_tables('order', k=1, threshold=0.5)
+    assert [ref.table for ref in refs] == ['orders']
+    [(score, column, refs)] = index.fuzzy_columns('emial', k=1, threshold=0.2)
+    assert column == 'email' and refs == [TableRef('crm', 'Users', True)]
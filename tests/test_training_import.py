@@ -0,0 +1,80 @@
+import io
+import json
+
+import pytest
+
+from training_import import import_training_file, iter_json_records
+
+
+def _records(data: bytes, chunk_size: int):
+    return [(location, record, error) for location, record, error, _ in
+            iter_json_records(io.BytesIO(data), chunk_size=chunk_size)]
+
+
+@pytest.mark.parametrize('chunk_size', [1, 3, 7, 1024])
+def test_jsonl_across_chunk_boundaries(chunk_size):
+    data = '{"ddl": "CREATE TABLE a (id int)"}\n\n{"documentation": "说明"}\n{"bad"\n{"question": "q", "sql": "SELECT 1"}'
+    records = _records(data.encode('utf-8'), chunk_size)
+    assert [location for location, _, _ in records] == [1, 3, 4, 5]
+    assert records[0][1] == {'ddl': 'CREATE TABLE a (id int)'}
+    assert records[1][1] == {'documentation': '说明'}
+    assert records[2][1] is None and records[2][2].startswith('JSON解析失败')
+    assert records[3][1] == {'question': 'q', 'sql': 'SELECT 1'}
+
+
+def test_jsonl_with_bom_and_crlf():
+    records = _records('\ufeff{"a": 1}\r\n{"a": 2}\r\n'.encode('utf-8'), 4)
+    assert [record for _, record, _ in records] == [{'a': 1}, {'a': 2}]
+
+
+@pytest.mark.parametrize('chunk_size', [1, 5, 1024])
+def test_json_array(chunk_size):
+    items = [{'question': f'问题{i}', 'sql': f'SELECT {i}'} for i in range(20)]
+    records = _records(json.dumps(items, ensure_ascii=False, indent=2).encode('utf-8'), chunk_size)
+    assert [record for _, record, _ in records] == items
+    assert [location for location, _, _ in records] == list(range(1, 21))
+
+
+def test_empty_file():
+    assert _records(b'  \n ', 2) == []
+
+
+def test_large_jsonl_stays_linear():
+    line = json.dumps({'question': 'q' * 40, 'sql': 'SELECT 1'}) + '\n'
+    data = (line * 20000).encode('utf-8')
+    assert sum(1 for _ in iter_json_records(io.BytesIO(data), chunk_size=1024 * 1024)) == 20000
+
+
+class RecordingManager:
+    """只记录写入批次的训练管理器，校验规则与 VannaTrainingManager 的约定一致"""
+
+    def __init__(self):
+        self.batches = []
+
+    @staticmethod
+    def normalize_train_item(item):
+        if not isinstance(item, dict):
+            return None, "记录不是对象"
+        if 'sql' in item:
+            return {'type': 'sql', 'question': item.get('question'), 'sql': item['sql']}, None
+        if 'ddl' in item:
+            return {'type': 'ddl', 'content': item['ddl']}, None
+        return None, "无法识别的记录"
+
+    def train_many(self, items):
+        self.batches.append(list(items))
+        return {'valid': len(items), 'new': len(items), 'updated': 0, 'unchanged': 0}
+
+
+def test_import_batches_and_errors():
+    lines = [json.dumps({'question': f'q{i}', 'sql': f'SELECT {i}'}) for i in range(5)]
+    lines += ['[1]', json.dumps({'ddl': 'CREATE TABLE t (id int)'}), 'not json']
+    manager = RecordingManager()
+    progress = []
+    stats = import_training_file(io.BytesIO('\n'.join(lines).encode('utf-8')), manager, expected_type='sql',
+                                 batch_size=2, progress=lambda imported, position: progress.append(imported))
+    assert stats['total'] == 8
+    assert stats['imported'] == 5 and stats['new'] == 5
+    assert stats['bad'] == 3
+    assert [len(batch) for batch in manager.batches] == [2, 2, 1]
+    assert progress[-1] == 5
@@ -0,0 +1,125 @@
+import sqlite3
+
+import pytest
+
+from training_store import HASH_SCHEME_VERSION, NEW, UNCHANGED, UPDATED, TrainingStore, content_hash
+
+
+@pytest.fixture
+def store():
+    store = TrainingStore(':memory:')
+    yield store
+    store.close()
+
+
+def ddl(database, table, body="id int"):
+    return {'type': 'ddl', 'content': f"CREATE TABLE `{table}` ({body}) ENGINE=InnoDB AUTO_INCREMENT=7",
+            'database': database, 'table': table}
+
+
+def test_sql_pairs_dedup_ignoring_whitespace_and_semicolon(store):
+    first = {'type': 'sql', 'question': '订单数', 'sql': 'SELECT COUNT(*)\n  FROM orders;'}
+    again = {'type': 'sql', 'question': ' 订单数 ', 'sql': 'SELECT COUNT(*) FROM orders'}
+    assert store.upsert(first) == NEW
+    assert store.upsert(again) == UNCHANGED
+    assert store.count('sql') == 1
+
+
+def test_metadata_change_updates_in_place(store):
+    item = {'type': 'documentation', 'content': '订单表记录所有订单'}
+    assert store.upsert(item) == NEW
+    assert store.upsert({**item, 'database': 'shop', 'priority': True}) == UPDATED
+    [saved] = store.query('documentation')
+    assert (saved['database'], saved['priority']) == ('shop', True)
+
+
+def test_ddl_keyed_by_database_and_table(store):
+    assert store.upsert(ddl('shop_1', 'orders')) == NEW
+    # 不同库中同结构的表各自保留
+    assert store.upsert(ddl('shop_2', 'orders')) == NEW
+    # 只有 AUTO_INCREMENT 变化视为未变化
+    assert store.upsert({**ddl('shop_1', 'orders'), 'content': ddl('shop_1', 'orders')['content'][:-1] + '9'}) == UNCHANGED
+    # 结构变化时原地更新
+    assert store.upsert(ddl('shop_1', 'orders', 'id int, amount decimal')) == UPDATED
+    assert store.count('ddl') == 2
+    assert 'amount' in store.query('ddl', 'shop_1')[0]['content']
+
+
+def test_upsert_many_counts_in_one_transaction(store):
+    store.upsert(ddl('shop', 'orders'))
+    counts = store.upsert_many([
+        ddl('shop', 'orders'),
+        ddl('shop', 'orders', 'id int, status varchar(20)'),
+        ddl('shop', 'users'),
+        {'type': 'sql', 'question': 'q', 'sql': 'SELECT 1'},
+        {'type': 'sql', 'question': 'q', 'sql': 'SELECT 1;'},
+    ])
+    assert counts == {NEW: 2, UPDATED: 1, UNCHANGED: 2}
+    assert store.count() == 3
+
+
+def test_upsert_many_rolls_back_on_error(store):
+    with pytest.raises(KeyError):
+        store.upsert_many([ddl('shop', 'orders'), {'content': 'missing type'}])
+    assert store.count() == 0
+
+
+def test_rehash_on_scheme_change_merges_duplicates(tmp_path):
+    path = str(tmp_path / 'store.db')
+    TrainingStore(path).close()
+
+    # 模拟旧版本：同一张表的两条 DDL 按旧规则（内容）各有一个哈希
+    conn = sqlite3.connect(path)
+    conn.executemany(
+        "INSERT INTO training_items (type, content, db_name, table_name, created_at, content_hash) "
+        "VALUES ('ddl', ?, 'shop', 'orders', '2024-01-01', ?)",
+        [("CREATE TABLE orders (id int)", 'old-1'), ("CREATE TABLE orders (id int, x int)", 'old-2')]
+    )
+    conn.execute("PRAGMA user_version = 1")
+    conn.commit()
+    conn.close()
+
+    store = TrainingStore(path)
+    [item] = store.query('ddl')
+    assert 'x int' in item['content']
+    assert store.upsert(ddl('shop', 'orders', 'id int, x int')) == UPDATED
+    store.close()
+
+    conn = sqlite3.connect(path)
+    assert conn.execute("PRAGMA user_version").fetchone()[0] == HASH_SCHEME_VERSION
+    [(saved_hash,)] = conn.execute("SELECT content_hash FROM training_items").fetchall()
+    conn.close()
+    assert saved_hash == content_hash(ddl('shop', 'orders'))
+
+
+def test_search_schema_prefers_mentioned_tables_in_stable_order(store):
+    store.upsert_many([
+        ddl('crm', 'leads'),
+        ddl('shop', 'users'),
+        ddl('shop', 'orders'),
+        {'type': 'documentation', 'content': '订单说明', 'database': 'shop', 'table': 'orders'},
+    ])
+    found = store.search_schema('查询orders表和users表', priority_databases=['shop'])
+    assert [(item['type'], item['table']) for item in found] == [
+        ('ddl', 'orders'), ('documentation', 'orders'), ('ddl', 'users')]
+
+    fallback = store.search_schema('最近的数据', priority_databases=['crm'], limit=1)
+    assert [item['table'] for item in fallback] == ['leads']
+
+
+def test_retire_tables_removes_items_and_checksums(store):
+    store.upsert_many([ddl('shop', 'orders'), ddl('shop', 'users')])
+    store.save_table_checksums([('shop', 'orders', 'a'), ('shop', 'users', 'b')])
+    assert store.retire_tables([('shop', 'orders')]) == 1
+    assert [item['table'] for item in store.query('ddl')] == ['users']
+    assert store.get_table_checksums() == {('shop', 'users'): 'b'}
+
+
+def test_pair_cache_round_trip(store):
+    rows = [('fp', '中', 'm', 'q1', 'SELECT 1'), ('fp', '中', 'm', 'q2', 'SELECT 2')]
+    assert store.add_cached_pairs(rows) == 2
+    assert store.add_cached_pairs(rows[:1]) == 0
+    assert store.get_cached_pairs(['fp'], '中', 'm') == {'fp': [('q1', 'SELECT 1'), ('q2', 'SELECT 2')]}
+    assert store.get_cached_pairs(['fp'], '高', 'm') == {}
+    assert store.delete_cached_pairs([('q1', 'SELECT 1')]) == 1
+    assert store.get_cached_pairs(['fp'], '中', 'm') == {'fp': [('q2', 'SELECT 2')]}
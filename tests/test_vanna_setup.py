@@ -0,0 +1,88 @@
+import json
+import re
+import types
+
+import pytest
+
+pytest.importorskip('vanna')
+pytest.importorskip('openai')
+pytest.importorskip('httpx')
+pytest.importorskip('dotenv')
+
+import vanna_setup
+from vanna_setup import parse_batch_response
+
+
+def test_parse_batch_response_accepts_fenced_json():
+    content = '```json\n[{"index": 1, "sql": " SELECT 1 "}, {"index": 2, "sql": "WITH t AS (SELECT 1) SELECT * FROM t"}]\n```'
+    assert parse_batch_response(content) == {1: "SELECT 1", 2: "WITH t AS (SELECT 1) SELECT * FROM t"}
+
+
+@pytest.mark.parametrize('content', [
+    "",
+    "没有结果",
+    "[{\"index\": 1, \"sql\": \"SELECT 1\"",
+    '{"index": 1, "sql": "SELECT 1"}',
+])
+def test_parse_batch_response_rejects_malformed_output(content):
+    assert parse_batch_response(content) == {}
+
+
+def test_parse_batch_response_drops_invalid_entries():
+    content = json.dumps([
+        {"index": 1, "sql": "DROP TABLE users"},
+        {"index": "2", "sql": "SELECT 2"},
+        {"index": 3, "sql": None},
+        "SELECT 4",
+        {"index": 5, "sql": "show tables"},
+    ])
+    assert parse_batch_response(content) == {5: "show tables"}
+
+
+class FakeLLM:
+    """按问题编号返回 JSON 数组；skip 中的问题不返回，迫使调用方单独补生成"""
+
+    max_concurrency = 2
+    client = None
+
+    def __init__(self, skip=()):
+        self.skip = set(skip)
+        self.calls = []
+
+    def chat(self, messages, **params):
+        prompt = messages[-1]['content']
+        self.calls.append(prompt)
+        numbered = re.findall(r'^问题(\d+): (.+)$', prompt, flags=re.M)
+        if numbered:
+            answers = [{"index": int(number), "sql": f"SELECT '{question}'"}
+                       for number, question in numbered if question not in self.skip]
+            content = json.dumps(answers, ensure_ascii=False)
+        else:
+            question = re.search(r'问题: (.+)$', prompt).group(1)
+            content = f"```sql\nSELECT 'single {question}'\n```"
+        message = types.SimpleNamespace(content=content)
+        return types.SimpleNamespace(choices=[types.SimpleNamespace(message=message)], usage=None)
+
+
+def make_vanna(monkeypatch, llm):
+    monkeypatch.setattr(vanna_setup, 'get_llm_client', lambda: llm)
+    return vanna_setup.MyVanna({'store_path': ':memory:'})
+
+
+def test_generate_sql_batch_packs_questions_and_keeps_order(monkeypatch):
+    llm = FakeLLM()
+    vn = make_vanna(monkeypatch, llm)
+    questions = [f"q{i}" for i in range(5)]
+
+    assert vn.generate_sql_batch(questions, batch_size=2) == [f"SELECT '{q}'" for q in questions]
+    assert len(llm.calls) == 3
+    assert vn.last_batch_stats == {'questions': 5, 'groups': 1, 'llm_calls': 3, 'fallbacks': 0}
+
+
+def test_generate_sql_batch_falls_back_for_missing_answers(monkeypatch):
+    llm = FakeLLM(skip={'q1'})
+    vn = make_vanna(monkeypatch, llm)
+
+    assert vn.generate_sql_batch(['q0', 'q1', 'q2']) == ["SELECT 'q0'", "SELECT 'single q1'", "SELECT 'q2'"]
+    assert vn.last_batch_stats['fallbacks'] == 1
+    assert vn.last_batch_stats['llm_calls'] == 2
@@ -0,0 +1,178 @@
+import json
+import codecs
+from typing import Callable, Dict, Iterator, Optional, Tuple
+
+# 单条记录的最大长度，超过后认为数组格式已损坏，避免缓冲区无限增长
+MAX_RECORD_CHARS = 4 * 1024 * 1024
+
+
+def _iter_text_chunks(fileobj, chunk_size: int) -> Iterator[Tuple[str, int]]:
+    """按块读取二进制或文本文件，返回 (文本块, 已读取字节数)"""
+    decoder = codecs.getincrementaldecoder('utf-8-sig')()
+    bytes_read = 0
+    while True:
+        chunk = fileobj.read(chunk_size)
+        if not chunk:
+            tail = decoder.decode(b'', final=True)
+            if tail:
+                yield tail, bytes_read
+            return
+        if isinstance(chunk, str):
+            bytes_read += len(chunk.encode('utf-8'))
+            yield chunk, bytes_read
+        else:
+            bytes_read += len(chunk)
+            yield decoder.decode(chunk), bytes_read
+
+
+def _parse_json_line(line: str) -> Tuple[Optional[object], Optional[str]]:
+    """解析一行 JSON，返回 (记录, 错误)"""
+    try:
+        return json.loads(line), None
+    except ValueError as e:
+        return None, f"JSON解析失败: {str(e)}"
+
+
+def _iter_jsonl(first: str, chunks: Iterator[Tuple[str, int]], position: int):
+    """逐行解析 JSONL，返回 (行号, 记录, 错误, 已读取字节数)
+
+    每个文本块只切分一次，块末尾不完整的一行以片段形式留到下一块拼接。
+    """
+    pending = []
+    line_no = 0
+    text = first
+    while True:
+        if '\n' in text:
+            lines = text.split('\n')
+            lines[0] = ''.join(pending) + lines[0]
+            pending = [lines.pop()]
+            for line in lines:
+                line_no += 1
+                line = line.strip()
+                if line:
+                    record, error = _parse_json_line(line)
+                    yield line_no, record, error, position
+        else:
+            pending.append(text)
+        try:
+            text, position = next(chunks)
+        except StopIteration:
+            break
+
+    line = ''.join(pending).strip()
+    if line:
+        record, error = _parse_json_line(line)
+        yield line_no + 1, record, error, position
+
+
+def _iter_json_array(first: str, chunks: Iterator[Tuple[str, int]], position: int):
+    """流式解析顶层 JSON 数组，返回 (序号, 记录, 错误, 已读取字节数)"""
+    decoder = json.JSONDecoder()
+    buffer = first[first.index('[') + 1:]
+    pos = 0
+    index = 0
+    exhausted = False
+
+    while True:
+        while pos < len(buffer) and buffer[pos] in ' \t\r\n,':
+            pos += 1
+
+        if pos < len(buffer) and buffer[pos] == ']':
+            return
+
+        if pos < len(buffer):
+            try:
+                record, end = decoder.raw_decode(buffer, pos)
+                index += 1
+                yield index, record, None, position
+                pos = end
+                continue
+            except ValueError as e:
+                # 记录可能被分块截断，读取更多内容后重试
+                if exhausted or len(buffer) - pos > MAX_RECORD_CHARS:
+                    yield index + 1, None, f"JSON解析失败，停止读取剩余内容: {str(e)}", position
+                    return
+
+        if exhausted:
+            if pos >= len(buffer):
+                yield index + 1, None, "JSON数组没有正常结束", position
+            return
+
+        try:
+            text, position = next(chunks)
+            buffer = buffer[pos:] + text
+            pos = 0
+        except StopIteration:
+            exhausted = True
+
+
+def iter_json_records(fileobj, chunk_size: int = 1024 * 1024):
+    """流式读取 JSONL 或 JSON 数组文件，逐条返回 (行号/序号, 记录, 错误, 已读取字节数)
+
+    只在内存中保留当前块和一条记录，可以处理任意大小的文件。
+    """
+    chunks = _iter_text_chunks(fileobj, chunk_size)
+    first, position = '', 0
+    for text, position in chunks:
+        first += text
+        if first.strip():
+            break
+
+    if not first.strip():
+        return
+    if first.lstrip().startswith('['):
+        yield from _iter_json_array(first, chunks, position)
+    else:
+        yield from _iter_jsonl(first, chunks, position)
+
+
+def import_training_file(fileobj, training_manager, expected_type: str = None, batch_size: int = 1000,
+                         progress: Optional[Callable[[int, int], None]] = None, max_errors: int = 100) -> Dict:
+    """流式导入训练文件：逐条校验，按批写入存储，坏记录只记录不中断
+
+    expected_type 为 'sql' / 'ddl' / 'documentation' 时，类型不符的记录视为错误。
+    progress(已导入条数, 已读取字节数) 在每批写入后回调。
+    """
+    stats = {'total': 0, 'imported': 0, 'new': 0, 'updated': 0, 'unchanged': 0, 'bad': 0, 'errors': []}
+    batch = []
+
+    def report_error(location, reason):
+        stats['bad'] += 1
+        if len(stats['errors']) < max_errors:
+            stats['errors'].append(f"第 {location} 条: {reason}")
+
+    def flush(position):
+        if batch:
+            result = training_manager.train_many(batch)
+            if result.get('error'):
+                for _ in batch:
+                    report_error('?', result['error'])
+            else:
+                stats['imported'] += result['valid']
+                for status in ('new', 'updated', 'unchanged'):
+                    stats[status] += result[status]
+            batch.clear()
+        if progress:
+            progress(stats['imported'], position)
+
+    position = 0
+    for location, record, error, position in iter_json_records(fileobj):
+        stats['total'] += 1
+        if error:
+            report_error(location, error)
+            continue
+
+        item, reason = training_manager.normalize_train_item(record)
+        if reason:
+            report_error(location, reason)
+            continue
+        if expected_type and item['type'] != expected_type:
+            report_error(location, f"类型不符，期望 {expected_type}，实际 {item['type']}")
+            continue
+
+        batch.append(item)
+        if len(batch) >= batch_size:
+            flush(position)
+
+    flush(position)
+    return stats
@@ -0,0 +1,487 @@
+import os
+import re
+import json
+import sqlite3
+import hashlib
+import threading
+from datetime import datetime
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS training_items (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    type TEXT NOT NULL,
+    content TEXT,
+    question TEXT,
+    sql_text TEXT,
+    db_name TEXT,
+    table_name TEXT,
+    priority INTEGER NOT NULL DEFAULT 0,
+    created_at TEXT NOT NULL,
+    content_hash TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_items_type ON training_items (type, id);
+CREATE INDEX IF NOT EXISTS idx_items_table ON training_items (db_name, table_name);
+CREATE INDEX IF NOT EXISTS idx_items_table_lower ON training_items (type, lower(table_name));
+CREATE TABLE IF NOT EXISTS table_checksums (
+    db_name TEXT NOT NULL,
+    table_name TEXT NOT NULL,
+    checksum TEXT NOT NULL,
+    updated_at TEXT NOT NULL,
+    PRIMARY KEY (db_name, table_name)
+);
+CREATE TABLE IF NOT EXISTS pair_cache (
+    fingerprint TEXT NOT NULL,
+    diversity TEXT NOT NULL,
+    model TEXT NOT NULL,
+    question TEXT NOT NULL,
+    sql_text TEXT NOT NULL,
+    created_at TEXT NOT NULL,
+    PRIMARY KEY (fingerprint, diversity, model, question, sql_text)
+);
+"""
+
+# 写入状态
+NEW, UPDATED, UNCHANGED = 'new', 'updated', 'unchanged'
+
+# 快照文件格式版本及导出的列（不含自增 id，导入时重新分配）
+SNAPSHOT_VERSION = 1
+SNAPSHOT_COLUMNS = ('type', 'content', 'question', 'sql_text', 'db_name', 'table_name',
+                    'priority', 'created_at', 'content_hash')
+
+# 内容哈希规则的版本，content_hash() 的键发生变化时加一，已有数据会在打开时重新计算
+HASH_SCHEME_VERSION = 2
+
+
+def _normalize(text: str) -> str:
+    """折叠空白并去掉结尾分号"""
+    return re.sub(r'\s+', ' ', text or '').strip().rstrip(';').strip()
+
+
+def _normalize_ddl(ddl: str) -> str:
+    """去掉 AUTO_INCREMENT=N，使同一张表插入数据后重新训练仍得到相同的内容"""
+    return _normalize(re.sub(r'\s+AUTO_INCREMENT=\d+', '', ddl or '', flags=re.IGNORECASE))
+
+
+def content_hash(item: Dict) -> str:
+    """训练条目的内容哈希，作为去重键
+
+    SHOW CREATE TABLE 的结果不含库名，不同库中的同名同结构表 DDL 完全相同，
+    因此带有库表信息的 DDL 以 (库, 表) 为键，结构变化时原地更新。
+    """
+    if item['type'] == 'sql':
+        key = f"sql\x00{_normalize(item.get('question'))}\x00{_normalize(item.get('sql'))}"
+    elif item['type'] == 'ddl' and item.get('database') and item.get('table'):
+        key = f"ddl\x00{item['database']}\x00{item['table']}"
+    elif item['type'] == 'ddl':
+        key = f"ddl\x00{_normalize_ddl(item.get('content'))}"
+    else:
+        key = f"{item['type']}\x00{_normalize(item.get('content'))}"
+    return hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+
+# 从问题中提取的候选表名上限
+MAX_MENTION_CANDIDATES = 200
+
+
+def _mention_candidates(question: str) -> List[str]:
+    """问题中可能是表名的词（小写），用于在 lower(table_name) 索引上做 IN 查找
+
+    中文问题没有空格分词，按连续的字母、数字、下划线、$ 切分，如 "查询orders表" -> ["orders"]。
+    """
+    words = dict.fromkeys(re.findall(r'[a-z0-9_$]+', (question or '').lower()))
+    return list(words)[:MAX_MENTION_CANDIDATES]
+
+
+def _row_to_item(row: sqlite3.Row) -> Dict:
+    """把数据库行转换为与原 training_data 列表相同结构的字典"""
+    item = {'id': row['id'], 'type': row['type']}
+    if row['type'] == 'sql':
+        item['question'] = row['question']
+        item['sql'] = row['sql_text']
+    else:
+        item['content'] = row['content']
+    item['database'] = row['db_name']
+    item['table'] = row['table_name']
+    item['priority'] = bool(row['priority'])
+    return item
+
+
+class TrainingStore:
+    """基于 SQLite 的持久化训练数据存储
+
+    按类型、数据库/表建立索引，检索在 SQLite 中完成，不需要把全部训练数据读入内存。
+    path 为 ":memory:" 时只在进程内有效。
+    """
+
+    def __init__(self, path: str = 'vanna_training.db'):
+        self.path = path
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.executescript(SCHEMA)
+            self._ensure_hash_index()
+
+    def _ensure_hash_index(self):
+        """为旧版本数据库补齐内容哈希并去重，然后建立唯一索引
+
+        哈希规则版本记录在 PRAGMA user_version 中，版本变化时所有条目按新规则重新计算。
+        """
+        columns = [row['name'] for row in self._conn.execute("PRAGMA table_info(training_items)")]
+        version = self._conn.execute("PRAGMA user_version").fetchone()[0]
+        with self._conn:
+            if 'content_hash' not in columns:
+                self._conn.execute("ALTER TABLE training_items ADD COLUMN content_hash TEXT")
+            if version != HASH_SCHEME_VERSION:
+                self._conn.execute("DROP INDEX IF EXISTS idx_items_hash")
+                self._conn.execute("UPDATE training_items SET content_hash = NULL")
+            self._fill_missing_hashes()
+            self._conn.execute(
+                "CREATE UNIQUE INDEX IF NOT EXISTS idx_items_hash ON training_items (content_hash)"
+            )
+            self._conn.execute(f"PRAGMA user_version = {HASH_SCHEME_VERSION}")
+
+    def _fill_missing_hashes(self):
+        """计算缺少内容哈希的条目，重复的条目只保留最后写入的一条"""
+        rows = self._conn.execute("SELECT * FROM training_items WHERE content_hash IS NULL ORDER BY id").fetchall()
+        keys = [content_hash(_row_to_item(row)) for row in rows]
+        latest = {key: row['id'] for key, row in zip(keys, rows)}
+        # 与已有哈希相同的条目同样视为重复
+        existing = {}
+        for start in range(0, len(keys), 500):
+            chunk = list(dict.fromkeys(keys[start:start + 500]))
+            existing.update(
+                (row['content_hash'], row['id']) for row in self._conn.execute(
+                    f"SELECT id, content_hash FROM training_items WHERE content_hash IN ({', '.join('?' * len(chunk))})",
+                    chunk
+                )
+            )
+        for key, row in zip(keys, rows):
+            if latest[key] == row['id'] and key not in existing:
+                self._conn.execute("UPDATE training_items SET content_hash = ? WHERE id = ?", (key, row['id']))
+            else:
+                self._conn.execute("DELETE FROM training_items WHERE id = ?", (row['id'],))
+
+    def _upsert(self, item: Dict) -> str:
+        """按内容哈希写入一条数据（调用方负责事务），返回 new / updated / unchanged"""
+        key = content_hash(item)
+        priority = 1 if item.get('priority') else 0
+        existing = self._conn.execute(
+            "SELECT id, content, db_name, table_name, priority FROM training_items WHERE content_hash = ?", (key,)
+        ).fetchone()
+
+        if existing is None:
+            self._conn.execute(
+                "INSERT INTO training_items (type, content, question, sql_text, db_name, table_name, priority, created_at, content_hash) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (item['type'], item.get('content'), item.get('question'), item.get('sql'),
+                 item.get('database'), item.get('table'), priority, datetime.now().isoformat(), key)
+            )
+            return NEW
+
+        same_content = (
+            item['type'] != 'ddl'
+            or _normalize_ddl(existing['content']) == _normalize_ddl(item.get('content'))
+        )
+        same_meta = (existing['db_name'], existing['table_name'], existing['priority']) == (
+            item.get('database'), item.get('table'), priority
+        )
+        if same_content and same_meta:
+            return UNCHANGED
+
+        # DDL 结构变化，或元数据（所属库表、优先标记）变化时原地更新
+        self._conn.execute(
+            "UPDATE training_items SET content = ?, db_name = ?, table_name = ?, priority = ? WHERE id = ?",
+            (item.get('content') if item['type'] == 'ddl' else existing['content'],
+             item.get('database'), item.get('table'), priority, existing['id'])
+        )
+        return UPDATED
+
+    def upsert(self, item: Dict) -> str:
+        """写入一条训练数据，重复内容不会再次插入，返回 new / updated / unchanged"""
+        with self._lock, self._conn:
+            return self._upsert(item)
+
+    def upsert_many(self, items: Iterable[Dict]) -> Dict[str, int]:
+        """在一个事务中批量写入，返回 {new, updated, unchanged} 计数"""
+        counts = {NEW: 0, UPDATED: 0, UNCHANGED: 0}
+        with self._lock, self._conn:
+            for item in items:
+                counts[self._upsert(item)] += 1
+        return counts
+
+    def _where(self, item_type=None, database: str = None, table: str = None) -> tuple:
+        clauses, params = [], []
+        if isinstance(item_type, (list, tuple, set)):
+            clauses.append(f"type IN ({', '.join('?' * len(item_type))})")
+            params.extend(item_type)
+        elif item_type:
+            clauses.append("type = ?")
+            params.append(item_type)
+        if database:
+            clauses.append("db_name = ?")
+            params.append(database)
+        if table:
+            clauses.append("table_name = ?")
+            params.append(table)
+        where = f" WHERE {' AND '.join(clauses)}" if clauses else ""
+        return where, params
+
+    def count(self, item_type=None, database: str = None) -> int:
+        """统计训练数据条数"""
+        where, params = self._where(item_type, database)
+        with self._lock:
+            return self._conn.execute(f"SELECT COUNT(*) FROM training_items{where}", params).fetchone()[0]
+
+    def count_by_type(self) -> Dict[str, int]:
+        """按类型统计条数"""
+        with self._lock:
+            rows = self._conn.execute("SELECT type, COUNT(*) FROM training_items GROUP BY type").fetchall()
+        return {row[0]: row[1] for row in rows}
+
+    def query(self, item_type=None, database: str = None, table: str = None,
+              limit: Optional[int] = None, newest_first: bool = False) -> List[Dict]:
+        """按条件查询训练数据"""
+        where, params = self._where(item_type, database, table)
+        sql = f"SELECT * FROM training_items{where} ORDER BY id {'DESC' if newest_first else 'ASC'}"
+        if limit is not None:
+            sql += " LIMIT ?"
+            params.append(limit)
+        with self._lock:
+            return [_row_to_item(row) for row in self._conn.execute(sql, params).fetchall()]
+
+    def iter_items(self, item_type=None, batch_size: int = 1000) -> Iterator[Dict]:
+        """分批遍历训练数据，避免一次性加载"""
+        where, params = self._where(item_type)
+        where += " AND id > ?" if where else " WHERE id > ?"
+        last_id = 0
+        while True:
+            with self._lock:
+                rows = self._conn.execute(
+                    f"SELECT * FROM training_items{where} ORDER BY id LIMIT ?",
+                    params + [last_id, batch_size]
+                ).fetchall()
+            if not rows:
+                return
+            for row in rows:
+                yield _row_to_item(row)
+            last_id = rows[-1]['id']
+
+    def search_schema(self, question: str, priority_databases=None, limit: int = 10) -> List[Dict]:
+        """检索表结构（DDL/文档）：先找问题中提到的表，没有则取优先库中最近训练的条目
+
+        先按相关性选出最多 limit 条，再在选出的集合内按 优先库 → 库 → 表 排序，
+        相同的候选集合总是得到相同的顺序（提示词前缀稳定）。
+        """
+        priority_databases = list(priority_databases or [])
+        placeholders = ', '.join('?' * len(priority_databases)) or "NULL"
+        priority_rank = f"CASE WHEN priority = 1 OR db_name IN ({placeholders}) THEN 0 ELSE 1 END"
+        order = (
+            f"ORDER BY {priority_rank}, coalesce(db_name, ''), coalesce(table_name, ''), "
+            "CASE type WHEN 'ddl' THEN 0 ELSE 1 END, content"
+        )
+        base = "SELECT * FROM training_items WHERE type IN ('ddl', 'documentation')"
+        candidates = _mention_candidates(question)
+        mention = f" AND lower(table_name) IN ({', '.join('?' * len(candidates)) or 'NULL'}) "
+
+        with self._lock:
+            rows = self._conn.execute(
+                base + mention + order + " LIMIT ?", candidates + priority_databases + [limit]
+            ).fetchall()
+            if not rows:
+                # 没有提到表时选优先库中最近训练的条目，而不是按名称排在最前面的条目
+                recent = f"{base} ORDER BY {priority_rank}, id DESC LIMIT ?"
+                rows = self._conn.execute(
+                    f"SELECT * FROM ({recent}) {order}", priority_databases + [limit] + priority_databases
+                ).fetchall()
+        return [_row_to_item(row) for row in rows]
+
+    def search_examples(self, question: str, limit: int = 5) -> List[Dict]:
+        """检索示例问题-SQL对：优先涉及问题中提到的表，否则取最近的，按写入顺序返回"""
+        base = "SELECT * FROM training_items WHERE type = 'sql'"
+        candidates = _mention_candidates(question)
+        mention = f" AND lower(table_name) IN ({', '.join('?' * len(candidates)) or 'NULL'})"
+        order = " ORDER BY id DESC LIMIT ?"
+
+        with self._lock:
+            rows = self._conn.execute(base + mention + order, candidates + [limit]).fetchall()
+            if not rows:
+                rows = self._conn.execute(base + order, [limit]).fetchall()
+        return [_row_to_item(row) for row in reversed(rows)]
+
+    def get_table_checksums(self) -> Dict[Tuple[str, str], str]:
+        """获取已训练表的结构校验和，键为 (库, 表)，库级上下文的表名为空字符串"""
+        with self._lock:
+            rows = self._conn.execute("SELECT db_name, table_name, checksum FROM table_checksums").fetchall()
+        return {(row['db_name'], row['table_name']): row['checksum'] for row in rows}
+
+    def save_table_checksums(self, checksums: Iterable[Tuple[str, str, str]]):
+        """批量保存 (库, 表, 校验和)"""
+        now = datetime.now().isoformat()
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO table_checksums (db_name, table_name, checksum, updated_at) VALUES (?, ?, ?, ?)",
+                [(db_name, table_name, checksum, now) for db_name, table_name, checksum in checksums]
+            )
+
+    def retire_tables(self, tables: Iterable[Tuple[str, str]], item_types=None) -> int:
+        """删除指定表的训练数据及其校验和，返回删除的条目数
+
+        表名为空字符串表示库级条目（没有关联具体表的条目）。item_types 为空时删除所有类型。
+        """
+        type_clause, type_params = "", []
+        if item_types:
+            type_clause = f" AND type IN ({', '.join('?' * len(item_types))})"
+            type_params = list(item_types)
+
+        deleted = 0
+        with self._lock, self._conn:
+            for db_name, table_name in tables:
+                if table_name:
+                    table_clause, table_params = "table_name = ?", [table_name]
+                else:
+                    table_clause, table_params = "(table_name IS NULL OR table_name = '')", []
+                cursor = self._conn.execute(
+                    f"DELETE FROM training_items WHERE db_name = ? AND {table_clause}{type_clause}",
+                    [db_name] + table_params + type_params
+                )
+                deleted += cursor.rowcount
+                self._conn.execute(
+                    "DELETE FROM table_checksums WHERE db_name = ? AND table_name = ?", (db_name, table_name or '')
+                )
+        return deleted
+
+    def export_snapshot(self, path: str, extra: Dict = None, batch_size: int = 65536) -> int:
+        """把训练数据和表校验和导出为 Arrow IPC 列式文件，返回导出的条目数
+
+        内容哈希随数据一起导出，导入时不需要重新计算；extra 以 JSON 形式保存在文件元数据中。
+        """
+        import pyarrow as pa
+
+        metadata = {
+            b'format_version': str(SNAPSHOT_VERSION).encode(),
+            b'hash_scheme': str(HASH_SCHEME_VERSION).encode(),
+            b'table_checksums': json.dumps(
+                [[db_name, table_name, checksum] for (db_name, table_name), checksum in self.get_table_checksums().items()],
+                ensure_ascii=False
+            ).encode('utf-8'),
+            b'extra': json.dumps(extra or {}, ensure_ascii=False, default=str).encode('utf-8'),
+        }
+        schema = pa.schema(
+            [(name, pa.int8() if name == 'priority' else pa.string()) for name in SNAPSHOT_COLUMNS],
+            metadata=metadata
+        )
+
+        exported = 0
+        tmp_path = f"{path}.tmp"
+        with self._lock:
+            cursor = self._conn.execute(f"SELECT {', '.join(SNAPSHOT_COLUMNS)} FROM training_items ORDER BY id")
+            with pa.OSFile(tmp_path, 'wb') as sink, pa.ipc.new_file(sink, schema) as writer:
+                while True:
+                    rows = cursor.fetchmany(batch_size)
+                    if not rows:
+                        break
+                    columns = list(zip(*rows))
+                    writer.write_batch(pa.record_batch(
+                        [pa.array(column, type=field.type) for column, field in zip(columns, schema)],
+                        schema=schema
+                    ))
+                    exported += len(rows)
+        os.replace(tmp_path, path)
+        return exported
+
+    def import_snapshot(self, path: str, replace: bool = True) -> Tuple[Dict[str, int], Dict]:
+        """通过内存映射读取 export_snapshot 导出的文件并批量写入
+
+        replace 为 True 时先清空现有数据；否则与现有数据合并，内容哈希已存在的条目保持不变。
+        返回 ({'new', 'unchanged'}, extra)。
+        """
+        import pyarrow as pa
+
+        counts = {NEW: 0, UNCHANGED: 0}
+        placeholders = ', '.join('?' * len(SNAPSHOT_COLUMNS))
+        insert_sql = f"INSERT OR IGNORE INTO training_items ({', '.join(SNAPSHOT_COLUMNS)}) VALUES ({placeholders})"
+
+        with pa.memory_map(path, 'r') as source:
+            reader = pa.ipc.open_file(source)
+            metadata = reader.schema.metadata or {}
+            if int(metadata.get(b'format_version', b'0')) != SNAPSHOT_VERSION:
+                raise ValueError(f"不支持的快照版本: {metadata.get(b'format_version', b'').decode()}")
+            checksums = json.loads(metadata.get(b'table_checksums', b'[]').decode('utf-8'))
+            extra = json.loads(metadata.get(b'extra', b'{}').decode('utf-8'))
+
+            with self._lock, self._conn:
+                if replace:
+                    self._conn.execute("DELETE FROM training_items")
+                    self._conn.execute("DELETE FROM table_checksums")
+                last_id = self._conn.execute("SELECT COALESCE(MAX(id), 0) FROM training_items").fetchone()[0]
+                for index in range(reader.num_record_batches):
+                    batch = reader.get_batch(index)
+                    columns = [batch.column(name).to_pylist() for name in SNAPSHOT_COLUMNS]
+                    before = self._conn.total_changes
+                    self._conn.executemany(insert_sql, zip(*columns))
+                    inserted = self._conn.total_changes - before
+                    counts[NEW] += inserted
+                    counts[UNCHANGED] += batch.num_rows - inserted
+                if int(metadata.get(b'hash_scheme', b'1')) != HASH_SCHEME_VERSION:
+                    # 旧规则导出的快照：先按旧哈希去重写入，再按当前规则重新计算导入的条目
+                    self._conn.execute(
+                        "UPDATE training_items SET content_hash = NULL WHERE id > ?", (last_id,)
+                    )
+                    self._fill_missing_hashes()
+
+        self.save_table_checksums((db_name, table_name, checksum) for db_name, table_name, checksum in checksums)
+        return counts, extra
+
+    def get_cached_pairs(self, fingerprints: Iterable[str], diversity: str, model: str) -> Dict[str, List[Tuple[str, str]]]:
+        """读取已缓存的生成结果，返回 {表结构指纹: [(问题, SQL)]}"""
+        fingerprints = list(fingerprints)
+        if not fingerprints:
+            return {}
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT fingerprint, question, sql_text FROM pair_cache "
+                f"WHERE diversity = ? AND model = ? AND fingerprint IN ({', '.join('?' * len(fingerprints))}) "
+                f"ORDER BY created_at, rowid",
+                [diversity, model] + fingerprints
+            ).fetchall()
+        cached = {}
+        for row in rows:
+            cached.setdefault(row['fingerprint'], []).append((row['question'], row['sql_text']))
+        return cached
+
+    def add_cached_pairs(self, rows: Iterable[Tuple[str, str, str, str, str]]) -> int:
+        """缓存生成结果 (表结构指纹, 多样性, 模型, 问题, SQL)，已存在的忽略，返回新增条数"""
+        now = datetime.now().isoformat()
+        with self._lock, self._conn:
+            before = self._conn.total_changes
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO pair_cache (fingerprint, diversity, model, question, sql_text, created_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                [(fingerprint, diversity, model, question, sql, now)
+                 for fingerprint, diversity, model, question, sql in rows]
+            )
+            return self._conn.total_changes - before
+
+    def delete_cached_pairs(self, pairs: Iterable[Tuple[str, str]]) -> int:
+        """从缓存中删除指定的 (问题, SQL)，例如校验失败的对，返回删除条数"""
+        with self._lock, self._conn:
+            before = self._conn.total_changes
+            self._conn.executemany(
+                "DELETE FROM pair_cache WHERE question = ? AND sql_text = ?",
+                [(question, sql) for question, sql in pairs]
+            )
+            return self._conn.total_changes - before
+
+    def clear(self):
+        """清空所有训练数据"""
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM training_items")
+            self._conn.execute("DELETE FROM table_checksums")
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -1,98 +1,253 @@
 import os
 import json
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterator, List
 from dotenv import load_dotenv
 import vanna as vn
-from openai import OpenAI
+from training_store import TrainingStore
+from sql_stream import SqlStreamScanner
+from llm_client import get_llm_client, PRIORITY_INTERACTIVE, PRIORITY_BATCH
 
 # 加载环境变量
 load_dotenv()
 
+# SQL 生成的固定指令，作为提示词稳定前缀的开头
+SQL_SYSTEM_PROMPT = """你是一个专业的 SQL 专家。请根据用户的问题生成准确的 MySQL SQL 查询语句。
+
+注意以下要点：
+1. 只返回 SQL 代码，不要包含解释
+2. 使用正确的 MySQL 语法
+3. 如果问题中涉及到表名，请使用完整的 database.table 格式
+4. 确保 SQL 语法正确
+5. 如果用户问题不明确，做出合理的假设并说明在注释中
+6. 表说明或上下文中列出了索引时，尽量用索引的第一个字段做过滤、关联和排序，不要在这些字段外面包函数
+
+可用上下文信息："""
+
+# 批量生成时追加在可变部分之后的输出格式要求
+BATCH_INSTRUCTIONS = """请为以上编号的每个问题分别生成一条 SQL。
+只返回一个 JSON 数组，不要包含其他内容，格式如下：
+[{"index": 1, "sql": "SELECT ..."}, {"index": 2, "sql": "SELECT ..."}]"""
+
+# 批量结果中可以接受的语句开头
+VALID_SQL_PREFIXES = ('SELECT', 'WITH', 'SHOW', 'DESCRIBE', 'DESC', 'EXPLAIN')
+
+def parse_batch_response(content: str) -> dict:
+    """解析批量生成返回的 JSON 数组，返回 {序号: SQL}，无法解析时返回空字典"""
+    content = content.replace('```json', '').replace('```', '').strip()
+    start, end = content.find('['), content.rfind(']')
+    if start == -1 or end <= start:
+        return {}
+
+    try:
+        data = json.loads(content[start:end + 1])
+    except ValueError:
+        return {}
+
+    answers = {}
+    for entry in data if isinstance(data, list) else []:
+        if not isinstance(entry, dict):
+            continue
+        index, sql = entry.get('index'), entry.get('sql')
+        if isinstance(index, int) and isinstance(sql, str):
+            sql = sql.strip()
+            if sql.upper().startswith(VALID_SQL_PREFIXES):
+                answers[index] = sql
+    return answers
+
 class MyVanna:
     def __init__(self, config=None):
-        # 初始化 OpenAI 客户端（用于阿里云 Qwen-Plus）
-        self.client = OpenAI(
-            api_key=os.getenv('ALI_API_KEY'),
-            base_url=os.getenv('ALI_BASE_URL')
-        )
+        # 使用共享的 LLM 客户端（连接池、并发限制与重试，用于阿里云 Qwen-Plus）
+        self.llm = get_llm_client()
+        self.client = self.llm.client
         self.model = os.getenv('VANNA_MODEL', 'qwen-plus')
 
-        # 初始化训练数据
-        self.training_data = []
+        # 初始化持久化的训练数据存储
+        config = config or {}
+        self.store = TrainingStore(config.get('store_path') or os.getenv('VANNA_STORE_PATH', 'vanna_training.db'))
+
+        # 提示词中最多包含的表结构条目与示例数量
+        self.max_schema_items = 10
+        self.max_examples = 5
+
+        # 最近一次批量生成的统计
+        self.last_batch_stats = {}
+
+        # 前缀缓存统计
+        self.last_prefix_hash = None
+        self._stats_lock = threading.Lock()
+        self.prefix_stats = {
+            'requests': 0,
+            'repeat_prefix': 0,
+            'prompt_tokens': 0,
+            'cached_tokens': 0,
+            'seen': set()
+        }
 
     def train(self, **kwargs):
-        """训练 Vanna，支持多种训练方式"""
+        """训练 Vanna，支持多种训练方式
+
+        可以通过 metadata 传入 database / table / priority，用于构建稳定的提示词前缀。
+        按内容哈希去重，返回 'new' / 'updated' / 'unchanged'。
+        """
+        metadata = kwargs.get('metadata') or {}
+        item_meta = {
+            'database': metadata.get('database'),
+            'table': metadata.get('table'),
+            'priority': bool(metadata.get('priority', False))
+        }
+
         if 'ddl' in kwargs:
             # 存储 DDL 用于训练
-            self.training_data.append({
+            return self.store.upsert({
                 'type': 'ddl',
-                'content': kwargs['ddl']
+                'content': kwargs['ddl'],
+                **item_meta
             })
         elif 'documentation' in kwargs:
             # 存储文档说明
-            self.training_data.append({
+            return self.store.upsert({
                 'type': 'documentation',
-                'content': kwargs['documentation']
+                'content': kwargs['documentation'],
+                **item_meta
             })
         elif 'sql' in kwargs and 'question' in kwargs:
             # 存储 SQL-问题对
-            self.training_data.append({
+            return self.store.upsert({
                 'type': 'sql',
                 'question': kwargs['question'],
-                'sql': kwargs['sql']
+                'sql': kwargs['sql'],
+                **item_meta
             })
 
-        return True
+        return False
 
-    def generate_sql(self, question: str, **kwargs) -> str:
-        """生成 SQL 查询"""
+    def train_many(self, items) -> dict:
+        """在一个事务中批量写入已校验的训练条目，返回 {new, updated, unchanged} 计数
+
+        每个条目为 {'type': 'ddl'|'documentation', 'content': ...} 或
+        {'type': 'sql', 'question': ..., 'sql': ...}，可附带 'metadata'。
+        """
+        def to_store_item(item):
+            metadata = item.get('metadata') or {}
+            return {
+                'type': item['type'],
+                'content': item.get('content'),
+                'question': item.get('question'),
+                'sql': item.get('sql'),
+                'database': metadata.get('database'),
+                'table': metadata.get('table'),
+                'priority': bool(metadata.get('priority', False))
+            }
 
-        # 构建系统提示词
-        system_prompt = """你是一个专业的 SQL 专家。请根据用户的问题生成准确的 MySQL SQL 查询语句。
+        return self.store.upsert_many(to_store_item(item) for item in items)
 
-        注意以下要点：
-        1. 只返回 SQL 代码，不要包含解释
-        2. 使用正确的 MySQL 语法
-        3. 如果问题中涉及到表名，请使用完整的 database.table 格式
-        4. 确保 SQL 语法正确
-        5. 如果用户问题不明确，做出合理的假设并说明在注释中
+    def _retrieve_schema_items(self, question: str, priority_databases=None) -> list:
+        """检索与问题相关的 DDL / 文档，并按 优先库 → 库名 → 表名 的固定顺序排列
 
-        可用上下文信息："""
+        排序只依赖条目内容，与训练数据的追加顺序无关，相同的表集合总是得到相同的前缀。
+        """
+        return self.store.search_schema(question, priority_databases, limit=self.max_schema_items)
 
-        # 添加训练数据到上下文
-        context = ""
-        for item in self.training_data[-10:]:  # 只使用最近10条训练数据
+    def _retrieve_examples(self, question: str) -> list:
+        """检索示例问题-SQL对：优先选择与问题涉及相同表的示例，否则使用最近的示例"""
+        return self.store.search_examples(question, limit=self.max_examples)
+
+    def build_prompt(self, question: str, **kwargs) -> tuple:
+        """构建提示词，返回 (稳定前缀, 可变部分, 前缀哈希)
+
+        稳定前缀 = 固定指令 + 排好序的表结构，放在 system 消息中以命中服务端的前缀缓存；
+        可变部分 = 检索到的示例 + 数据库上下文 + 用户问题，放在 user 消息中。
+        """
+        prefix = SQL_SYSTEM_PROMPT
+        for item in self._retrieve_schema_items(question, kwargs.get('priority_databases')):
             if item['type'] == 'ddl':
-                context += f"\n\nDDL结构:\n{item['content']}"
-            elif item['type'] == 'documentation':
-                context += f"\n\n表说明:\n{item['content']}"
-            elif item['type'] == 'sql':
-                context += f"\n\n示例查询:\n问题: {item['question']}\nSQL: {item['sql']}"
+                prefix += f"\n\nDDL结构:\n{item['content']}"
+            else:
+                prefix += f"\n\n表说明:\n{item['content']}"
 
-        system_prompt += context
+        variable = ""
+        for item in self._retrieve_examples(question):
+            variable += f"示例查询:\n问题: {item['question']}\nSQL: {item['sql']}\n\n"
 
         # 如果有额外的数据库上下文，添加进去
         if 'db_context' in kwargs:
-            system_prompt += f"\n\n当前数据库上下文:\n{kwargs['db_context']}"
+            variable += f"当前数据库上下文:\n{kwargs['db_context']}\n\n"
+
+        variable += f"问题: {question}"
+
+        prefix_hash = hashlib.sha256(prefix.encode('utf-8')).hexdigest()[:16]
+        return prefix, variable, prefix_hash
+
+    def _record_prefix(self, prefix_hash: str, response=None):
+        """记录前缀哈希与服务端返回的缓存命中 token 数，用于评估前缀缓存效果"""
+        stats = self.prefix_stats
+        with self._stats_lock:
+            stats['requests'] += 1
+            if prefix_hash in stats['seen']:
+                stats['repeat_prefix'] += 1
+            else:
+                stats['seen'].add(prefix_hash)
+            self.last_prefix_hash = prefix_hash
+
+            usage = getattr(response, 'usage', None)
+            if usage is not None:
+                stats['prompt_tokens'] += getattr(usage, 'prompt_tokens', 0) or 0
+                details = getattr(usage, 'prompt_tokens_details', None)
+                stats['cached_tokens'] += getattr(details, 'cached_tokens', 0) or 0
+
+    def get_prefix_cache_stats(self) -> dict:
+        """获取前缀缓存统计"""
+        stats = self.prefix_stats
+        return {
+            'requests': stats['requests'],
+            'distinct_prefixes': len(stats['seen']),
+            'repeat_prefix': stats['repeat_prefix'],
+            'repeat_rate': stats['repeat_prefix'] / stats['requests'] if stats['requests'] else 0.0,
+            'prompt_tokens': stats['prompt_tokens'],
+            'cached_tokens': stats['cached_tokens'],
+            'last_prefix_hash': self.last_prefix_hash,
+        }
+
+    def generate_sql(self, question: str, stream: bool = False, on_token=None, **kwargs) -> str:
+        """生成 SQL 查询
+
+        stream=True 时逐块读取模型输出，每收到新内容就回调 on_token(已生成文本)，
+        一旦解析出完整的 SQL 语句就关闭响应，不再等待后续的解释文字。
+        """
+        prefix, variable, prefix_hash = self.build_prompt(question, **kwargs)
 
         messages = [
             {
                 "role": "system",
-                "content": system_prompt
+                "content": prefix
             },
             {
                 "role": "user",
-                "content": question
+                "content": variable
             }
         ]
 
         try:
-            response = self.client.chat.completions.create(
+            if stream:
+                self._record_prefix(prefix_hash)
+                return self._generate_sql_stream(
+                    messages, on_token, kwargs.get('deadline'),
+                    kwargs.get('priority', PRIORITY_INTERACTIVE)
+                )
+
+            response = self.llm.chat(
+                messages,
                 model=self.model,
-                messages=messages,
+                deadline=kwargs.get('deadline'),
+                priority=kwargs.get('priority', PRIORITY_INTERACTIVE),
                 temperature=0.1,  # 稍高的温度以获得更好的创造性
                 max_tokens=1000,
             )
 
+            self._record_prefix(prefix_hash, response)
             sql = response.choices[0].message.content.strip()
 
             # 清理 SQL 输出
@@ -105,21 +260,154 @@ class MyVanna:
             print(f"生成 SQL 时出错: {e}")
             return f"-- 生成 SQL 时出错: {str(e)}\n-- 请检查您的查询问题"
 
+    def _generate_sql_stream(self, messages, on_token=None, deadline: float = None,
+                             priority: int = PRIORITY_INTERACTIVE) -> str:
+        """流式生成 SQL，解析到完整语句后立即停止读取"""
+        response = self.llm.chat(
+            messages,
+            model=self.model,
+            deadline=deadline,
+            priority=priority,
+            temperature=0.1,
+            max_tokens=1000,
+            stream=True,
+        )
+
+        scanner = SqlStreamScanner()
+        sql = None
+        try:
+            for chunk in response:
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta.content
+                if not delta:
+                    continue
+
+                sql = scanner.feed(delta)
+                if on_token:
+                    on_token(scanner.text)
+                if sql:
+                    break
+        finally:
+            # 提前结束时关闭连接，取消剩余的输出
+            response.close()
+
+        if sql is None:
+            sql = scanner.text.replace('```sql', '').replace('```', '').strip()
+
+        return sql
+
+    def generate_sql_batch(self, questions: List[str], batch_size: int = 10, **kwargs) -> List[str]:
+        """批量生成 SQL，返回与 questions 顺序一致的结果
+
+        检索到相同表结构上下文（前缀哈希相同）的问题会合并到同一次调用中，
+        要求模型返回 JSON 数组；解析或校验失败的问题再单独调用 generate_sql。
+        """
+        kwargs.setdefault('priority', PRIORITY_BATCH)
+
+        groups = {}
+        for index, question in enumerate(questions):
+            prefix, _, prefix_hash = self.build_prompt(question, **kwargs)
+            groups.setdefault(prefix_hash, {'prefix': prefix, 'indexes': []})['indexes'].append(index)
+
+        chunks = []
+        for group in groups.values():
+            indexes = group['indexes']
+            for i in range(0, len(indexes), batch_size):
+                chunks.append((group['prefix'], indexes[i:i + batch_size]))
+
+        results = [None] * len(questions)
+
+        def run_chunk(chunk):
+            prefix, indexes = chunk
+            return indexes, self._generate_sql_chunk(prefix, [questions[i] for i in indexes], **kwargs)
+
+        with ThreadPoolExecutor(max_workers=self.llm.max_concurrency) as executor:
+            for indexes, answers in executor.map(run_chunk, chunks):
+                for position, index in enumerate(indexes, 1):
+                    results[index] = answers.get(position)
+
+        fallbacks = 0
+        for index, sql in enumerate(results):
+            if sql is None:
+                fallbacks += 1
+                results[index] = self.generate_sql(questions[index], **kwargs)
+
+        self.last_batch_stats = {
+            'questions': len(questions),
+            'groups': len(groups),
+            'llm_calls': len(chunks) + fallbacks,
+            'fallbacks': fallbacks,
+        }
+        return results
+
+    def _generate_sql_chunk(self, prefix: str, questions: List[str], **kwargs) -> dict:
+        """用一次调用为共享同一前缀的一组问题生成 SQL，返回 {序号: SQL}"""
+        examples = []
+        for question in questions:
+            for item in self._retrieve_examples(question):
+                if item not in examples:
+                    examples.append(item)
+
+        variable = ""
+        for item in examples[-self.max_examples:]:
+            variable += f"示例查询:\n问题: {item['question']}\nSQL: {item['sql']}\n\n"
+        if 'db_context' in kwargs:
+            variable += f"当前数据库上下文:\n{kwargs['db_context']}\n\n"
+        for number, question in enumerate(questions, 1):
+            variable += f"问题{number}: {question}\n"
+        variable += f"\n{BATCH_INSTRUCTIONS}"
+
+        try:
+            response = self.llm.chat(
+                [
+                    {"role": "system", "content": prefix},
+                    {"role": "user", "content": variable}
+                ],
+                model=self.model,
+                deadline=kwargs.get('deadline'),
+                priority=kwargs.get('priority', PRIORITY_BATCH),
+                temperature=0.1,
+                max_tokens=min(4000, 300 * len(questions)),
+            )
+            self._record_prefix(hashlib.sha256(prefix.encode('utf-8')).hexdigest()[:16], response)
+            answers = parse_batch_response(response.choices[0].message.content)
+        except Exception as e:
+            print(f"批量生成 SQL 时出错: {e}")
+            return {}
+
+        return {index: sql for index, sql in answers.items() if 1 <= index <= len(questions)}
+
     def run_sql(self, sql: str, **kwargs):
         """执行 SQL 查询（在实际应用中，这会连接到数据库）"""
         # 这个方法在实际应用中会连接到数据库执行查询
         # 这里返回一个模拟的结果
         return {"status": "success", "message": "SQL 执行成功（模拟）"}
 
-    def get_training_data(self):
-        """获取所有训练数据"""
-        return self.training_data
+    @property
+    def training_data(self) -> Iterator[dict]:
+        """全部训练数据（兼容旧接口），按 id 分批从存储中读取，不会一次性加载所有条目"""
+        return self.store.iter_items()
+
+    def get_training_data(self, item_type: str = None, database: str = None, limit: int = None):
+        """获取训练数据，可按类型、数据库过滤并限制条数（按训练时间倒序）"""
+        if item_type is None and database is None and limit is None:
+            return self.store.query()
+        return self.store.query(item_type, database, limit=limit, newest_first=True)
 
     def clear_training_data(self):
         """清空训练数据"""
-        self.training_data = []
+        self.store.clear()
         return True
 
+    def export_training_data(self, path: str, extra: dict = None) -> int:
+        """导出训练数据快照（需要 pyarrow），返回导出条数"""
+        return self.store.export_snapshot(path, extra)
+
+    def import_training_data(self, path: str, replace: bool = True) -> tuple:
+        """导入训练数据快照，导入后即可直接检索，无需重新训练"""
+        return self.store.import_snapshot(path, replace)
+
 def initialize_vanna():
     """初始化 Vanna 实例"""
     try: